@@ -8,6 +8,8 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.routers import marketing, documents, legal, finance
+from app.services.metrics import metrics
+from app.services.request_context import RequestContextMiddleware
 
 load_dotenv()
 
@@ -26,6 +28,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Клиентский дедлайн (X-Request-Deadline) для ограничения запросов к провайдеру
+app.add_middleware(RequestContextMiddleware)
+
 # Подключаем роутеры
 app.include_router(marketing.router, prefix="/api/v1/marketing", tags=["marketing"])
 app.include_router(documents.router, prefix="/api/v1/documents", tags=["documents"])
@@ -40,6 +45,10 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics_snapshot():
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
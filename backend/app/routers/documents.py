@@ -1,22 +1,74 @@
-from fastapi import APIRouter, HTTPException
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from app.models.schemas import DocumentRequest, DocumentResponse, AIErrorResponse
 from app.services.ai_service import AIService
+from app.services.idempotency import IdempotencyConflict, idempotency_store
+from app.services.request_context import RequestAbandoned, run_until_disconnect
 
 router = APIRouter()
 ai_service = AIService()
 
 @router.post("/generate-document", response_model=DocumentResponse, responses={500: {"model": AIErrorResponse}})
-async def generate_document(request: DocumentRequest):
+async def generate_document(
+    request: DocumentRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     try:
-        result = await ai_service.generate_document(
-            doc_type=request.doc_type,
-            content=request.content,
-            style=request.style
+        result = await run_until_disconnect(
+            http_request,
+            idempotency_store.run(
+                idempotency_key,
+                "documents:generate-document",
+                request.model_dump(),
+                lambda: ai_service.generate_document(
+                    doc_type=request.doc_type,
+                    content=request.content,
+                    style=request.style
+                ),
+            ),
         )
         return DocumentResponse(
             document=result.get("document", ""),
             corrections=result.get("corrections", []),
             suggestions=result.get("suggestions", [])
         )
+    except RequestAbandoned as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+
+@router.post("/generate-document/stream")
+async def stream_document(request: DocumentRequest):
+    """NDJSON stream: {"delta": ...} lines while the document is written, then {"result": ...} or {"error": ...}.
+
+    The stream has no total deadline (X-Request-Deadline is ignored): it stops,
+    and the provider call is cancelled, when the client disconnects.
+    """
+    async def events():
+        try:
+            async for event in ai_service.stream_document(
+                doc_type=request.doc_type,
+                content=request.content,
+                style=request.style
+            ):
+                if "result" in event:
+                    result = event["result"]
+                    event = {"result": DocumentResponse(
+                        document=result.get("document", ""),
+                        corrections=result.get("corrections", []),
+                        suggestions=result.get("suggestions", [])
+                    ).model_dump()}
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except RequestAbandoned as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"AI service error: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    # X-Accel-Buffering: a buffering proxy would hold the deltas back
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
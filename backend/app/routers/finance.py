@@ -1,16 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
 from app.models.schemas import FinanceAnalysisRequest, FinanceAnalysisResponse, AIErrorResponse
 from app.services.ai_service import AIService
+from app.services.idempotency import IdempotencyConflict, idempotency_store
+from app.services.request_context import RequestAbandoned, run_until_disconnect
 
 router = APIRouter()
 ai_service = AIService()
 
 @router.post("/analyze-data", response_model=FinanceAnalysisResponse, responses={500: {"model": AIErrorResponse}})
-async def analyze_finance_data(request: FinanceAnalysisRequest):
+async def analyze_finance_data(
+    request: FinanceAnalysisRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     try:
-        result = await ai_service.analyze_finance_data(
-            data=request.data,
-            analysis_type=request.analysis_type
+        result = await run_until_disconnect(
+            http_request,
+            idempotency_store.run(
+                idempotency_key,
+                "finance:analyze-data",
+                request.model_dump(),
+                lambda: ai_service.analyze_finance_data(
+                    data=request.data,
+                    analysis_type=request.analysis_type
+                ),
+            ),
         )
         return FinanceAnalysisResponse(
             analysis=result.get("analysis", ""),
@@ -18,5 +34,9 @@ async def analyze_finance_data(request: FinanceAnalysisRequest):
             recommendations=result.get("recommendations", []),
             forecast=result.get("forecast", {})
         )
+    except RequestAbandoned as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
\ No newline at end of file
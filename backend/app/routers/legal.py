@@ -1,16 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
 from app.models.schemas import LegalAnalysisRequest, LegalAnalysisResponse, AIErrorResponse
 from app.services.ai_service import AIService
+from app.services.idempotency import IdempotencyConflict, idempotency_store
+from app.services.request_context import RequestAbandoned, run_until_disconnect
 
 router = APIRouter()
 ai_service = AIService()
 
 @router.post("/analyze-contract", response_model=LegalAnalysisResponse, responses={500: {"model": AIErrorResponse}})
-async def analyze_contract(request: LegalAnalysisRequest):
+async def analyze_contract(
+    request: LegalAnalysisRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     try:
-        result = await ai_service.analyze_contract(
-            contract_text=request.contract_text,
-            analyze_risks=request.analyze_risks
+        result = await run_until_disconnect(
+            http_request,
+            idempotency_store.run(
+                idempotency_key,
+                "legal:analyze-contract",
+                request.model_dump(),
+                lambda: ai_service.analyze_contract(
+                    contract_text=request.contract_text,
+                    analyze_risks=request.analyze_risks
+                ),
+            ),
         )
         return LegalAnalysisResponse(
             summary=result.get("summary", ""),
@@ -18,5 +34,9 @@ async def analyze_contract(request: LegalAnalysisRequest):
             recommendations=result.get("recommendations", []),
             todo_items=result.get("todo_items", [])
         )
+    except RequestAbandoned as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
\ No newline at end of file
@@ -1,22 +1,42 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
 from app.models.schemas import MarketingRequest, MarketingResponse, AIErrorResponse
 from app.services.ai_service import AIService
+from app.services.idempotency import IdempotencyConflict, idempotency_store
+from app.services.request_context import RequestAbandoned, run_until_disconnect
 
 router = APIRouter()
 ai_service = AIService()
 
 @router.post("/generate-posts", response_model=MarketingResponse, responses={500: {"model": AIErrorResponse}})
-async def generate_marketing_posts(request: MarketingRequest):
+async def generate_marketing_posts(
+    request: MarketingRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     try:
-        result = await ai_service.generate_marketing_content(
-            idea=request.idea,
-            tone=request.tone,
-            target_audience=request.target_audience
+        result = await run_until_disconnect(
+            http_request,
+            idempotency_store.run(
+                idempotency_key,
+                "marketing:generate-posts",
+                request.model_dump(),
+                lambda: ai_service.generate_marketing_content(
+                    idea=request.idea,
+                    tone=request.tone,
+                    target_audience=request.target_audience
+                ),
+            ),
         )
         return MarketingResponse(
             post_variants=result.get("post_variants", []),
             suggestions=result.get("suggestions", [])
         )
+    except RequestAbandoned as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
 
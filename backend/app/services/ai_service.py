@@ -1,12 +1,136 @@
+import asyncio
 import json
 import os
-from typing import Any, Dict, List
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Type
 
 import httpx
 from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from app.models.schemas import DocumentResponse, FinanceAnalysisResponse, LegalAnalysisResponse, MarketingResponse
+from app.services.metrics import metrics
+from app.services.request_context import DeadlineExceeded, RequestAbandoned, remaining_budget
+from app.services.scheduler import provider_scheduler
+from app.services.token_budget import count_message_tokens, token_budgeter
 
 load_dotenv()
 
+PROVIDER_TIMEOUT = 60.0
+# Longest wait for the next chunk of a streamed completion. A stream has no
+# total limit: long documents take as long as they take, and the call is
+# cancelled when the client disconnects.
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "30"))
+# Separates the streamed plain-text section from the trailing JSON section
+STREAM_SECTION_MARKER = "===JSON==="
+
+
+@asynccontextmanager
+async def provider_call_budget(stream: bool = False):
+    """Cap the provider timeout by the client deadline and account saved provider time.
+
+    Saved time is an upper bound: the provider timeout minus the time actually
+    spent on calls that were cancelled, cut short by the deadline or skipped.
+    A streamed call (``stream=True``) ignores the deadline and gets
+    STREAM_IDLE_TIMEOUT as its per-read timeout instead.
+    """
+    timeout = STREAM_IDLE_TIMEOUT if stream else remaining_budget(PROVIDER_TIMEOUT)
+    metrics.inc("provider.calls")
+    if timeout <= 0:
+        metrics.inc("provider.skipped_expired")
+        metrics.inc("provider.saved_seconds", PROVIDER_TIMEOUT)
+        raise DeadlineExceeded("Client deadline expired before the provider call")
+
+    started = time.monotonic()
+    cancelled = False
+    try:
+        yield timeout
+    except asyncio.CancelledError:
+        cancelled = True
+        metrics.inc("provider.cancelled")
+        metrics.inc("provider.saved_seconds", max(0.0, PROVIDER_TIMEOUT - (time.monotonic() - started)))
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        metrics.observe("provider.latency_seconds", elapsed)
+        if not stream and not cancelled and timeout < PROVIDER_TIMEOUT and elapsed >= timeout:
+            metrics.inc("provider.deadline_cut")
+            metrics.inc("provider.saved_seconds", PROVIDER_TIMEOUT - timeout)
+
+
+async def iter_stream_deltas(response: httpx.Response, idle_timeout: float) -> AsyncIterator[str]:
+    """Text deltas of an OpenAI-compatible streamed chat completion (server-sent events).
+
+    ``idle_timeout`` bounds the wait for the next delta, not the whole stream.
+    The httpx read timeout catches a silent connection; this check catches a
+    provider that keeps the connection alive with comments but sends no text.
+    """
+    last_delta = time.monotonic()
+    async for line in response.aiter_lines():
+        if time.monotonic() - last_delta > idle_timeout:
+            raise Exception(f"Provider stream stalled: no text for {idle_timeout:g}s")
+        if not line.startswith("data:"):
+            continue  # keep-alive comments and blank separators
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise Exception(f"Provider stream error: {chunk['error']}")
+        choices = chunk.get("choices") or []
+        delta = (choices[0].get("delta") or {}).get("content") if choices else None
+        if delta:
+            yield delta
+            last_delta = time.monotonic()
+
+
+class _SectionSplitter:
+    """Splits a streamed answer into the plain-text section and the JSON section after the marker.
+
+    Text before the marker is released as it arrives, holding back only a possible
+    partial marker at the end. An answer that starts with JSON (the model ignored
+    the layout, or a demo response) is buffered whole and never released as text.
+    """
+
+    def __init__(self, marker: str = STREAM_SECTION_MARKER):
+        self.marker = marker
+        self.json_only: Optional[bool] = None
+        self.text: List[str] = []
+        self.pending = ""
+        self.tail: Optional[str] = None
+
+    def feed(self, delta: str) -> str:
+        if self.tail is not None:
+            self.tail += delta
+            return ""
+        self.pending += delta
+        if self.json_only is None:
+            stripped = self.pending.lstrip()
+            if not stripped:
+                return ""
+            self.json_only = stripped[0] in "{`"
+        if self.json_only:
+            return ""
+
+        head, found, tail = self.pending.partition(self.marker)
+        if found:
+            self.tail = tail
+            self.pending = ""
+        else:
+            keep = len(self.marker) - 1
+            head, self.pending = self.pending[:-keep], self.pending[-keep:]
+        self.text.append(head)
+        return head
+
+    def finish(self) -> str:
+        """Release the held-back text of an answer that ended without the marker"""
+        if self.json_only or self.tail is not None:
+            return ""
+        rest, self.pending = self.pending, ""
+        self.text.append(rest)
+        return rest
+
 
 class GigaChatService:
     """GigaChat API (Sber) - Russian AI Service"""
@@ -14,50 +138,48 @@ class GigaChatService:
     def __init__(self):
         self.access_token = os.getenv("GIGACHAT_ACCESS_TOKEN")
         self.base_url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+        self.model = os.getenv("GIGACHAT_MODEL", "GigaChat")
+        self.small_model = os.getenv("GIGACHAT_SMALL_MODEL") or None
+        self.max_tokens = 2048
 
-    async def _make_request(self, messages: List[Dict[str, str]]) -> str:
-        """Make request to GigaChat API"""
-        if not self.access_token:
-            print(f"⚠️ GIGACHAT_ACCESS_TOKEN not set. Auto-switching to DEMO mode.")
-            return self._get_demo_response(messages)
-
+    def _request_parts(self, messages: List[Dict[str, str]], model: Optional[str], max_tokens: Optional[int]):
         headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json",
         }
 
         payload = {
-            "model": "GigaChat",
+            "model": model or self.model,
             "messages": messages,
             "temperature": 0.7,
-            "max_tokens": 2048,
+            "max_tokens": max_tokens or self.max_tokens,
         }
+        return headers, payload
+
+    async def _make_request(
+        self, messages: List[Dict[str, str]], model: Optional[str] = None, max_tokens: Optional[int] = None
+    ) -> str:
+        """Make request to GigaChat API"""
+        if not self.access_token:
+            print(f"⚠️ GIGACHAT_ACCESS_TOKEN not set. Auto-switching to DEMO mode.")
+            return self._get_demo_response(messages)
+
+        headers, payload = self._request_parts(messages, model, max_tokens)
 
-        async with httpx.AsyncClient(verify=False) as client:
+        async with provider_call_budget() as timeout, httpx.AsyncClient(verify=False) as client:
             try:
                 response = await client.post(
                     self.base_url,
                     json=payload,
                     headers=headers,
-                    timeout=60.0
+                    timeout=timeout
                 )
                 response.raise_for_status()
                 data = response.json()
                 return data["choices"][0]["message"]["content"]
 
             except httpx.HTTPStatusError as e:
-                # Auto-fallback for auth errors (401) - token expired
-                if e.response.status_code == 401:
-                    print(f"⚠️ GigaChat token expired or invalid (401). Auto-switching to DEMO mode.")
-                    return self._get_demo_response(messages)
-                
-                # Check for demo mode fallback for other errors
-                demo_mode = os.getenv("DEMO_MODE", "false").lower() == "true"
-                if demo_mode:
-                    print(f"⚠️ DEMO MODE: GigaChat API error ({e.response.status_code}). Using fallback.")
-                    return self._get_demo_response(messages)
-                
-                raise Exception(f"GigaChat API error: {e.response.status_code} - {e.response.text}")
+                return self._status_error_fallback(e, messages)
             except Exception as e:
                 demo_mode = os.getenv("DEMO_MODE", "false").lower() == "true"
                 if demo_mode:
@@ -65,6 +187,50 @@ class GigaChatService:
                     return self._get_demo_response(messages)
                 raise Exception(f"GigaChat request error: {str(e)}")
 
+    async def _stream_request(
+        self, messages: List[Dict[str, str]], model: Optional[str] = None, max_tokens: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Stream the completion from GigaChat API as text deltas"""
+        if not self.access_token:
+            print(f"⚠️ GIGACHAT_ACCESS_TOKEN not set. Auto-switching to DEMO mode.")
+            yield self._get_demo_response(messages)
+            return
+
+        headers, payload = self._request_parts(messages, model, max_tokens)
+        payload["stream"] = True
+
+        async with provider_call_budget(stream=True) as timeout, httpx.AsyncClient(verify=False) as client:
+            fallback = None
+            try:
+                async with client.stream(
+                    "POST", self.base_url, json=payload, headers=headers, timeout=timeout
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for delta in iter_stream_deltas(response, timeout):
+                        yield delta
+            except httpx.HTTPStatusError as e:
+                fallback = self._status_error_fallback(e, messages)
+            except httpx.RequestError as e:
+                raise Exception(f"GigaChat request error: {str(e)}")
+            if fallback is not None:
+                yield fallback
+
+    def _status_error_fallback(self, e: httpx.HTTPStatusError, messages: List[Dict[str, str]]) -> str:
+        # Auto-fallback for auth errors (401) - token expired
+        if e.response.status_code == 401:
+            print(f"⚠️ GigaChat token expired or invalid (401). Auto-switching to DEMO mode.")
+            return self._get_demo_response(messages)
+
+        # Check for demo mode fallback for other errors
+        demo_mode = os.getenv("DEMO_MODE", "false").lower() == "true"
+        if demo_mode:
+            print(f"⚠️ DEMO MODE: GigaChat API error ({e.response.status_code}). Using fallback.")
+            return self._get_demo_response(messages)
+
+        raise Exception(f"GigaChat API error: {e.response.status_code} - {e.response.text}")
+
     def _get_demo_response(self, messages: List[Dict[str, str]]) -> str:
         """Demo fallback response"""
         user_message = messages[-1]["content"].lower()
@@ -104,8 +270,10 @@ class OpenRouterService:
         self.model = os.getenv(
             "OPENROUTER_MODEL", "meta-llama/llama-3.2-3b-instruct:free"
         )
+        self.small_model = os.getenv("OPENROUTER_SMALL_MODEL") or None
+        self.max_tokens = 4000
 
-    async def _make_request(self, messages: List[Dict[str, str]]) -> str:
+    def _request_parts(self, messages: List[Dict[str, str]], model: str, max_tokens: Optional[int]):
         if not self.api_key:
             raise Exception("OPENROUTER_API_KEY is not set in environment variables")
 
@@ -116,33 +284,71 @@ class OpenRouterService:
             "X-Title": "Alfapilot AI Assistant",
         }
 
-        payload = {"model": self.model, "messages": messages, "max_tokens": 4000, "temperature": 0.7}
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens or self.max_tokens, "temperature": 0.7}
+        return headers, payload
+
+    async def _make_request(
+        self, messages: List[Dict[str, str]], model: Optional[str] = None, max_tokens: Optional[int] = None
+    ) -> str:
+        model = model or self.model
+        headers, payload = self._request_parts(messages, model, max_tokens)
 
-        async with httpx.AsyncClient() as client:
+        async with provider_call_budget() as timeout, httpx.AsyncClient() as client:
             try:
-                response = await client.post(self.base_url, json=payload, headers=headers, timeout=60.0)
+                response = await client.post(self.base_url, json=payload, headers=headers, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
                 return data["choices"][0]["message"]["content"]
             except httpx.HTTPStatusError as e:
-                demo_mode = os.getenv("DEMO_MODE", "false").lower() == "true"
-                if e.response.status_code in [401, 429, 404]:
-                    if e.response.status_code == 429:
-                        error_msg = f"Model {self.model} is rate-limited. "
-                    else:
-                        error_msg = f"OpenRouter API authentication failed (invalid API key). "
-
-                    if demo_mode:
-                        print(f"⚠️ DEMO MODE: {error_msg}Using fallback response.")
-                        return self._get_demo_response(messages)
-
-                    error_msg += "Try setting DEMO_MODE=true in .env for mock responses."
-                    raise Exception(f"OpenRouter API HTTP error: {e.response.status_code} - {error_msg}")
-                raise Exception(f"OpenRouter API HTTP error: {e.response.status_code}")
+                return self._status_error_fallback(e, model, messages)
+            except httpx.RequestError as e:
+                raise Exception(f"OpenRouter API connection error: {str(e)}")
+            except (KeyError, IndexError) as e:
+                raise Exception(f"Invalid response format from OpenRouter: {str(e)}")
+
+    async def _stream_request(
+        self, messages: List[Dict[str, str]], model: Optional[str] = None, max_tokens: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Stream the completion from OpenRouter as text deltas"""
+        model = model or self.model
+        headers, payload = self._request_parts(messages, model, max_tokens)
+        payload["stream"] = True
+
+        async with provider_call_budget(stream=True) as timeout, httpx.AsyncClient() as client:
+            fallback = None
+            try:
+                async with client.stream(
+                    "POST", self.base_url, json=payload, headers=headers, timeout=timeout
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for delta in iter_stream_deltas(response, timeout):
+                        yield delta
+            except httpx.HTTPStatusError as e:
+                fallback = self._status_error_fallback(e, model, messages)
             except httpx.RequestError as e:
                 raise Exception(f"OpenRouter API connection error: {str(e)}")
             except (KeyError, IndexError) as e:
                 raise Exception(f"Invalid response format from OpenRouter: {str(e)}")
+            if fallback is not None:
+                yield fallback
+
+    def _status_error_fallback(self, e: httpx.HTTPStatusError, model: str, messages: List[Dict[str, str]]) -> str:
+        demo_mode = os.getenv("DEMO_MODE", "false").lower() == "true"
+        if e.response.status_code in [401, 429, 404]:
+            if e.response.status_code == 429:
+                error_msg = f"Model {model} is rate-limited. "
+            else:
+                error_msg = f"OpenRouter API authentication failed (invalid API key). "
+
+            if demo_mode:
+                print(f"⚠️ DEMO MODE: {error_msg}Using fallback response.")
+                return self._get_demo_response(messages)
+
+            error_msg += "Try setting DEMO_MODE=true in .env for mock responses."
+            raise Exception(f"OpenRouter API HTTP error: {e.response.status_code} - {error_msg}")
+        raise Exception(f"OpenRouter API HTTP error: {e.response.status_code}")
 
     def _get_demo_response(self, messages: List[Dict[str, str]]) -> str:
         user_message = messages[-1]["content"].lower()
@@ -184,6 +390,86 @@ class AIService:
         else:
             self.ai_service = OpenRouterService()
 
+        # Endpoints that try the small model first (needs *_SMALL_MODEL to be set)
+        self.cascade_endpoints = {
+            name.strip()
+            for name in os.getenv("MODEL_CASCADE_ENDPOINTS", "marketing,documents,finance").split(",")
+            if name.strip()
+        }
+
+    def _fit_input(self, endpoint: str, text: str) -> str:
+        """Trim user text to the endpoint's prompt budget instead of letting the provider reject it"""
+        max_tokens = token_budgeter.max_tokens(endpoint, self.ai_service.max_tokens)
+        return token_budgeter.fit(endpoint, text, token_budgeter.input_budget(max_tokens))
+
+    async def _complete(self, messages: List[Dict[str, str]], endpoint: str, model: Optional[str] = None) -> str:
+        """Provider call behind the shared priority scheduler with an adaptive max_tokens"""
+        max_tokens = token_budgeter.max_tokens(endpoint, self.ai_service.max_tokens)
+        metrics.observe(f"tokens.{endpoint}.prompt", count_message_tokens(messages))
+        async with provider_scheduler.slot():
+            response = await self.ai_service._make_request(messages, model=model, max_tokens=max_tokens)
+        token_budgeter.record_output(endpoint, response, max_tokens)
+        return response
+
+    async def _complete_cascade(
+        self,
+        endpoint: str,
+        messages: List[Dict[str, str]],
+        schema: Type[BaseModel],
+        quality_check: Callable[[Dict[str, Any]], bool],
+    ) -> str:
+        """Try the small model first and escalate to the main one if its output fails validation"""
+        small_model = self.ai_service.small_model
+        if not small_model or endpoint not in self.cascade_endpoints:
+            return await self._complete(messages, endpoint)
+
+        metrics.inc(f"cascade.{endpoint}.attempts")
+        try:
+            response = await self._complete(messages, endpoint, model=small_model)
+            data = self._extract_json_from_response(response)
+            schema.model_validate(data)
+            if quality_check(data):
+                metrics.inc(f"cascade.{endpoint}.accepted")
+                return response
+            reason = "quality"
+        except RequestAbandoned:
+            raise
+        except ValueError:
+            # json.JSONDecodeError and pydantic.ValidationError are ValueErrors
+            reason = "invalid"
+        except Exception as e:
+            print(f"⚠️ Small model {small_model} failed for {endpoint}: {e}. Escalating.")
+            reason = "error"
+
+        metrics.inc(f"cascade.{endpoint}.escalated")
+        metrics.inc(f"cascade.{endpoint}.escalated_{reason}")
+        metrics.gauge(
+            f"cascade.{endpoint}.escalation_rate",
+            metrics.counter(f"cascade.{endpoint}.escalated") / metrics.counter(f"cascade.{endpoint}.attempts"),
+        )
+        return await self._complete(messages, endpoint)
+
+    async def _stream_sections(
+        self, messages: List[Dict[str, str]], endpoint: str, splitter: _SectionSplitter
+    ) -> AsyncIterator[str]:
+        """Streamed counterpart of ``_complete``: yields the text section as it arrives"""
+        max_tokens = token_budgeter.max_tokens(endpoint, self.ai_service.max_tokens)
+        metrics.observe(f"tokens.{endpoint}.prompt", count_message_tokens(messages))
+        parts = []
+        async with provider_scheduler.slot():
+            started = time.monotonic()
+            async for delta in self.ai_service._stream_request(messages, max_tokens=max_tokens):
+                if not parts:
+                    metrics.observe(f"stream.{endpoint}.first_delta_seconds", time.monotonic() - started)
+                parts.append(delta)
+                text = splitter.feed(delta)
+                if text:
+                    yield text
+        token_budgeter.record_output(endpoint, "".join(parts), max_tokens)
+        text = splitter.finish()
+        if text:
+            yield text
+
     def _extract_json_from_response(self, response: str) -> Dict[str, Any]:
         try:
             return json.loads(response)
@@ -204,41 +490,87 @@ class AIService:
             raise ValueError("Could not extract valid JSON from AI response")
 
     async def generate_marketing_content(self, idea: str, tone: str, target_audience: str) -> Dict[str, Any]:
+        idea = self._fit_input("marketing", idea)
         prompt = f"""
         Сгенерируй 3 варианта постов для социальных сетей на основе идеи.
         \n        Идея: {idea}\n        Тон: {tone}\n        Целевая аудитория: {target_audience}\n        \n        ВАЖНО: Верни ответ ТОЛЬКО в виде валидного JSON (без markdown форматирования):\n        {{\n            \"post_variants\": [\"вариант1\", \"вариант2\", \"вариант3\"],\n            \"suggestions\": [\"предложение1\", \"предложение2\"]\n        }}\n        """
         messages = [{"role": "system", "content": "Ты эксперт по маркетингу и контент-стратегии. Отвечай только в формате JSON."}, {"role": "user", "content": prompt}]
-        response = await self.ai_service._make_request(messages)
+        response = await self._complete_cascade(
+            "marketing", messages, MarketingResponse,
+            lambda data: len(data["post_variants"]) >= 3 and all(variant.strip() for variant in data["post_variants"]),
+        )
         try:
             return self._extract_json_from_response(response)
         except (json.JSONDecodeError, ValueError):
             return {"post_variants": [f"📢 {idea}\n\nЦелевая аудитория: {target_audience}. Тон: {tone}.", f"✨ Новинка! {idea}\n\n#маркетинг #бизнес", f"🚀 {idea}\n\nУзнайте больше!"], "suggestions": ["Добавьте призыв к действию", "Используйте релевантные хэштеги"]}
 
     async def generate_document(self, doc_type: str, content: str, style: str) -> Dict[str, Any]:
+        content = self._fit_input("documents", content)
         prompt = f"""
         Сгенерируй {doc_type} на основе следующего описания.\n\n        Тип документа: {doc_type}\n        Содержание: {content}\n        Стиль: {style}\n\n        Также предложи 2-3 исправления/улучшения.\n\n        ВАЖНО: Верни ответ ТОЛЬКО в виде валидного JSON (без markdown форматирования):\n        {{\n            \"document\": \"полный текст документа\",\n            \"corrections\": [\"исправление1\", \"исправление2\"],\n            \"suggestions\": [\"предложение1\", \"предложение2\"]\n        }}\n        """
         messages = [{"role": "system", "content": "Ты профессиональный юрист и копирайтер. Отвечай только в формате JSON."}, {"role": "user", "content": prompt}]
-        response = await self.ai_service._make_request(messages)
+        response = await self._complete_cascade(
+            "documents", messages, DocumentResponse,
+            lambda data: bool(data["document"].strip()),
+        )
         try:
             return self._extract_json_from_response(response)
         except (json.JSONDecodeError, ValueError):
             return {"document": f"# {doc_type}\n\n{content}\n\nСтиль: {style}", "corrections": ["Проверьте орфографию и пунктуацию", "Уточните юридические термины"], "suggestions": ["Добавьте контактную информацию", "Укажите сроки и даты"]}
 
+    async def stream_document(self, doc_type: str, content: str, style: str) -> AsyncIterator[Dict[str, Any]]:
+        """Stream ``{"delta": text}`` events while the document is written, then ``{"result": {...}}``.
+
+        The prompt asks for the document as plain text followed by the corrections
+        and suggestions as JSON, so the document can be shown before it is complete.
+        """
+        content = self._fit_input("documents", content)
+        prompt = f"""
+        Сгенерируй {doc_type} на основе следующего описания.\n\n        Тип документа: {doc_type}\n        Содержание: {content}\n        Стиль: {style}\n\n        Сначала выведи полный текст документа обычным текстом, без markdown форматирования.\n        Затем на отдельной строке выведи {STREAM_SECTION_MARKER} и после него валидный JSON с 2-3 исправлениями/улучшениями:\n        {{\n            \"corrections\": [\"исправление1\", \"исправление2\"],\n            \"suggestions\": [\"предложение1\", \"предложение2\"]\n        }}\n        """
+        messages = [{"role": "system", "content": "Ты профессиональный юрист и копирайтер."}, {"role": "user", "content": prompt}]
+        splitter = _SectionSplitter()
+        async for text in self._stream_sections(messages, "documents", splitter):
+            yield {"delta": text}
+
+        fallback = {"document": f"# {doc_type}\n\n{content}\n\nСтиль: {style}", "corrections": ["Проверьте орфографию и пунктуацию", "Уточните юридические термины"], "suggestions": ["Добавьте контактную информацию", "Укажите сроки и даты"]}
+        if splitter.json_only:
+            try:
+                result = self._extract_json_from_response(splitter.pending)
+            except (json.JSONDecodeError, ValueError):
+                result = fallback
+        else:
+            result = {"document": "".join(splitter.text).strip() or fallback["document"]}
+            try:
+                extras = self._extract_json_from_response(splitter.tail or "")
+            except (json.JSONDecodeError, ValueError):
+                extras = {}
+            result["corrections"] = extras.get("corrections", [])
+            result["suggestions"] = extras.get("suggestions", [])
+        yield {"result": result}
+
     async def analyze_contract(self, contract_text: str, analyze_risks: bool) -> Dict[str, Any]:
+        contract_text = self._fit_input("legal", contract_text)
         prompt = f"""
-        Проанализируй следующий договор и предоставь:\n        1. Краткое содержание (3-4 пункта)\n        2. Рисковые пункты (если analyze_risks=True)\n        3. Рекомендации\n        4. Пункты для добавления в To-Do список\n\n        Анализ рисков: {"Да" if analyze_risks else "Нет"}\n        Текст договора: {contract_text[:3000]}\n\n        ВАЖНО: Верни ответ ТОЛЬКО в виде валидного JSON (без markdown форматирования):\n        {{\n            \"summary\": \"краткое содержание\",\n            \"risks\": [\"риск1\", \"риск2\"],\n            \"recommendations\": [\"рекомендация1\", \"рекомендация2\"],\n            \"todo_items\": [\"задача1\", \"задача2\"]\n        }}\n        """
+        Проанализируй следующий договор и предоставь:\n        1. Краткое содержание (3-4 пункта)\n        2. Рисковые пункты (если analyze_risks=True)\n        3. Рекомендации\n        4. Пункты для добавления в To-Do список\n\n        Анализ рисков: {"Да" if analyze_risks else "Нет"}\n        Текст договора: {contract_text}\n\n        ВАЖНО: Верни ответ ТОЛЬКО в виде валидного JSON (без markdown форматирования):\n        {{\n            \"summary\": \"краткое содержание\",\n            \"risks\": [\"риск1\", \"риск2\"],\n            \"recommendations\": [\"рекомендация1\", \"рекомендация2\"],\n            \"todo_items\": [\"задача1\", \"задача2\"]\n        }}\n        """
         messages = [{"role": "system", "content": "Ты опытный юрист с expertise в анализе договоров. Отвечай только в формате JSON."}, {"role": "user", "content": prompt}]
-        response = await self.ai_service._make_request(messages)
+        response = await self._complete_cascade(
+            "legal", messages, LegalAnalysisResponse,
+            lambda data: bool(data["summary"].strip()) and (bool(data["risks"]) or not analyze_risks),
+        )
         try:
             return self._extract_json_from_response(response)
         except (json.JSONDecodeError, ValueError):
             return {"summary": "Договор содержит основные положения о предоставлении услуг/товаров между сторонами.", "risks": ["Не указаны точные сроки выполнения", "Неясные условия оплаты", "Отсутствуют штрафные санкции"], "recommendations": ["Проконсультироваться с юристом", "Уточнить условия расторжения", "Добавить приложения с деталями"], "todo_items": ["Запросить дополнительные документы", "Назначить встречу с юристом", "Уточнить реквизиты сторон"]}
 
     async def analyze_finance_data(self, data: str, analysis_type: str) -> Dict[str, Any]:
+        data = self._fit_input("finance", data)
         prompt = f"""
         Проанализируй финансовые данные и предоставь {analysis_type}.\n\n        Данные: {data}\n        Тип анализа: {analysis_type}\n\n        ВАЖНО: Верни ответ ТОЛЬКО в виде валидного JSON (без markdown форматирования):\n        {{\n            \"analysis\": \"детальный анализ\",\n            \"insights\": [\"инсайт1\", \"инсайт2\"],\n            \"recommendations\": [\"рекомендация1\", \"рекомендация2\"],\n            \"forecast\": {{\"trend\": \"прогноз тренда\", \"growth\": \"ожидаемый рост\"}}\n        }}\n        """
         messages = [{"role": "system", "content": "Ты финансовый аналитик с опытом в бизнес-аналитике. Отвечай только в формате JSON."}, {"role": "user", "content": prompt}]
-        response = await self.ai_service._make_request(messages)
+        response = await self._complete_cascade(
+            "finance", messages, FinanceAnalysisResponse,
+            lambda data: bool(data["analysis"].strip()) and bool(data["insights"]),
+        )
         try:
             return self._extract_json_from_response(response)
         except (json.JSONDecodeError, ValueError):
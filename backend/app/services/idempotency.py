@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.services.request_context import DeadlineExceeded, request_deadline
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an Idempotency-Key is reused with a different request body"""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "task", "expires_at", "waiters", "deadline", "deadline_timer", "orphan_timer")
+
+    def __init__(self, fingerprint: str, task: "asyncio.Future[Any]", deadline: Optional[float]):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.waiters = 0
+        self.expires_at: Optional[float] = None  # None while the generation is in flight
+        # Latest client deadline (unix time) among attached clients; None if one has none
+        self.deadline = deadline
+        self.deadline_timer: Optional[asyncio.TimerHandle] = None
+        # Cancels the generation if no client reattaches before it fires
+        self.orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def cancel_timers(self) -> None:
+        for timer in (self.deadline_timer, self.orphan_timer):
+            if timer is not None:
+                timer.cancel()
+        self.deadline_timer = self.orphan_timer = None
+
+
+class IdempotencyStore:
+    """Deduplicates generations that share an Idempotency-Key.
+
+    The first request with a key starts the generation; repeated requests with
+    the same key attach to the in-flight task or get the completed result until
+    the retention window expires. Failed generations are not retained, so a retry
+    after an error runs again.
+
+    A keyed generation is not bound to the client that started it: it runs until
+    the latest deadline among the clients attached to it, and a retry with a later
+    deadline extends it. Once every client has disconnected the generation gets
+    ``orphan_grace`` seconds for a retry to reattach and is cancelled otherwise, so
+    an abandoned key does not hold the provider call. Requests without a key are
+    cancelled together with their client.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        orphan_grace: Optional[float] = None,
+    ):
+        self.ttl = ttl_seconds if ttl_seconds is not None else float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+        self.orphan_grace = (
+            orphan_grace if orphan_grace is not None else float(os.getenv("IDEMPOTENCY_ORPHAN_GRACE_SECONDS", "5"))
+        )
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _fingerprint(payload: Dict[str, Any]) -> str:
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for entry_key in list(self._entries):
+            entry = self._entries[entry_key]
+            if entry.expires_at is not None and entry.expires_at <= now:
+                del self._entries[entry_key]
+        # Hard cap: drop the oldest completed results first
+        if len(self._entries) > self.max_entries:
+            for entry_key in list(self._entries):
+                if len(self._entries) <= self.max_entries:
+                    break
+                if self._entries[entry_key].expires_at is not None:
+                    del self._entries[entry_key]
+
+    def _on_done(self, entry_key: str, entry: _Entry) -> None:
+        entry.cancel_timers()
+        if self._entries.get(entry_key) is not entry:
+            return
+        if entry.task.cancelled() or entry.task.exception() is not None:
+            del self._entries[entry_key]
+        else:
+            entry.expires_at = time.monotonic() + self.ttl
+
+    @staticmethod
+    def _attach(entry: _Entry, deadline: Optional[float]) -> None:
+        """Extend the generation to the deadline of a newly attached client"""
+        if entry.task.done():
+            return
+        if entry.orphan_timer is not None:
+            entry.orphan_timer.cancel()
+            entry.orphan_timer = None
+        if entry.deadline is not None:
+            entry.deadline = None if deadline is None else max(entry.deadline, deadline)
+        if entry.deadline_timer is not None:
+            entry.deadline_timer.cancel()
+            entry.deadline_timer = None
+        if entry.deadline is not None:
+            entry.deadline_timer = asyncio.get_running_loop().call_later(
+                max(entry.deadline - time.time(), 0.0), entry.task.cancel
+            )
+
+    async def run(
+        self,
+        key: Optional[str],
+        scope: str,
+        payload: Dict[str, Any],
+        factory: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        """Run ``factory`` once per (scope, key) and share its result"""
+        if not key:
+            return await factory()
+
+        self._evict()
+        deadline = request_deadline.get()
+        entry_key = f"{scope}:{key}"
+        fingerprint = self._fingerprint(payload)
+        entry = self._entries.get(entry_key)
+
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict(f"Idempotency-Key '{key}' was already used with a different request body")
+            self.hits += 1
+        else:
+            self.misses += 1
+            # The task copies the current context: the first client's deadline is
+            # enforced by the entry's timer instead, which a retry can extend
+            token = request_deadline.set(None)
+            try:
+                entry = _Entry(fingerprint, asyncio.ensure_future(factory()), deadline)
+            finally:
+                request_deadline.reset(token)
+            self._entries[entry_key] = entry
+            entry.task.add_done_callback(lambda _task: self._on_done(entry_key, entry))
+
+        self._attach(entry, deadline)
+        # shield: a client that gives up must not cancel the generation a retry will pick up
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if entry.task.cancelled() and not asyncio.current_task().cancelling():
+                # cancelled by the entry deadline, not by this client
+                raise DeadlineExceeded("Client deadline exceeded")
+            raise
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.task.done():
+                entry.orphan_timer = asyncio.get_running_loop().call_later(self.orphan_grace, entry.task.cancel)
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,49 @@
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and sample windows exposed by the /metrics endpoint"""
+
+    def __init__(self, window: int = 1000):
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def inc(self, name: str, value: float = 1.0) -> None:
+        self._counters[name] += value
+
+    def gauge(self, name: str, value: float) -> None:
+        self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        self._samples[name].append(value)
+
+    def counter(self, name: str) -> float:
+        return self._counters.get(name, 0.0)
+
+    @staticmethod
+    def percentile(values, q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = {}
+        for name, values in self._samples.items():
+            samples[name] = {
+                "count": len(values),
+                "p50": round(self.percentile(values, 0.50), 4),
+                "p95": round(self.percentile(values, 0.95), 4),
+                "max": round(max(values), 4) if values else 0.0,
+            }
+        return {
+            "counters": {name: round(value, 4) for name, value in sorted(self._counters.items())},
+            "gauges": dict(sorted(self._gauges.items())),
+            "samples": dict(sorted(samples.items())),
+        }
+
+
+metrics = MetricsRegistry()
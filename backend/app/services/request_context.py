@@ -0,0 +1,104 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Optional
+
+from starlette.requests import Request
+
+from app.services.metrics import metrics
+
+DEADLINE_HEADER = b"x-request-deadline"
+PRIORITY_HEADER = b"x-priority"
+TENANT_HEADER = b"x-tenant-id"
+
+# Absolute client deadline (unix time, seconds) of the request being served
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# Scheduling class of the request: interactive, background or bulk
+request_priority: ContextVar[str] = ContextVar("request_priority", default="interactive")
+# Fair-queueing tenant; falls back to the client address
+request_tenant: ContextVar[Optional[str]] = ContextVar("request_tenant", default=None)
+
+
+class RequestAbandoned(Exception):
+    """The client no longer waits for the result"""
+
+    status_code = 499
+
+
+class DeadlineExceeded(RequestAbandoned):
+    status_code = 504
+
+
+class ClientDisconnected(RequestAbandoned):
+    status_code = 499
+
+
+def remaining_budget(default: float) -> float:
+    """Seconds left until the client deadline, capped by ``default``"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return default
+    return min(default, deadline - time.time())
+
+
+class RequestContextMiddleware:
+    """Reads scheduling headers into the request context.
+
+    X-Request-Deadline holds the absolute unix time after which the client stops
+    waiting; malformed values are ignored. X-Priority selects the provider
+    scheduling class and X-Tenant-Id the fair-queueing tenant.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        deadline = None
+        priority = "interactive"
+        client = scope.get("client")
+        tenant = client[0] if client else None
+        for name, value in scope.get("headers", []):
+            if name == DEADLINE_HEADER:
+                try:
+                    deadline = float(value.decode("latin-1"))
+                except ValueError:
+                    deadline = None
+            elif name == PRIORITY_HEADER:
+                priority = value.decode("latin-1").strip().lower()
+            elif name == TENANT_HEADER:
+                tenant = value.decode("latin-1").strip()[:128] or tenant
+
+        tokens = [
+            (request_deadline, request_deadline.set(deadline)),
+            (request_priority, request_priority.set(priority)),
+            (request_tenant, request_tenant.set(tenant)),
+        ]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for var, token in reversed(tokens):
+                var.reset(token)
+
+
+async def run_until_disconnect(request: Request, awaitable: Awaitable[Any], poll_interval: float = 0.5) -> Any:
+    """Await ``awaitable`` but cancel it once the client disconnects or its deadline passes"""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            budget = remaining_budget(poll_interval)
+            if budget <= 0:
+                metrics.inc("requests.deadline_exceeded")
+                raise DeadlineExceeded("Client deadline exceeded")
+            done, _ = await asyncio.wait({task}, timeout=budget)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.inc("requests.client_disconnected")
+                raise ClientDisconnected("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
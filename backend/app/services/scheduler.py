@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from app.services.metrics import metrics
+from app.services.request_context import request_priority, request_tenant
+
+PRIORITY_CLASSES = ("interactive", "background", "bulk")
+DEFAULT_WEIGHTS = {"interactive": 8.0, "background": 3.0, "bulk": 1.0}
+
+
+def _weights_from_env() -> Dict[str, float]:
+    """PROVIDER_PRIORITY_WEIGHTS="interactive=8,background=3,bulk=1" """
+    weights = dict(DEFAULT_WEIGHTS)
+    raw = os.getenv("PROVIDER_PRIORITY_WEIGHTS", "")
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        name = name.strip().lower()
+        if name in weights and value.strip():
+            weights[name] = max(float(value), 0.001)
+    return weights
+
+
+class _PriorityClass:
+    __slots__ = ("name", "weight", "virtual_finish", "tenants", "depth")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.virtual_finish = 0.0
+        self.tenants: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.depth = 0
+
+
+class ProviderScheduler:
+    """Admission control for provider calls with priority classes.
+
+    At most ``concurrency`` provider calls run at once; the last ``reserve``
+    slots are kept for interactive traffic so bulk work can saturate the rest
+    without delaying bot and web users. Waiting calls are served by weighted
+    fair queueing: the class with the smallest virtual finish time goes next and
+    advances by ``1 / weight``. Inside a class tenants are served round-robin,
+    so one tenant's batch cannot starve the others.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        reserve: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.concurrency = concurrency or int(os.getenv("PROVIDER_CONCURRENCY", "4"))
+        reserve = reserve if reserve is not None else int(os.getenv("PROVIDER_INTERACTIVE_RESERVE", "1"))
+        self.reserve = min(max(reserve, 0), self.concurrency - 1)
+        weights = weights or _weights_from_env()
+        self._classes = {name: _PriorityClass(name, weights[name]) for name in PRIORITY_CLASSES}
+        self._virtual_time = 0.0
+        self._running = 0
+
+    @staticmethod
+    def normalize_priority(priority: Optional[str]) -> str:
+        priority = (priority or "").lower()
+        return priority if priority in PRIORITY_CLASSES else "interactive"
+
+    def _capacity(self, priority: str) -> int:
+        if priority == "interactive":
+            return self.concurrency
+        return self.concurrency - self.reserve
+
+    def _has_waiters(self) -> bool:
+        return any(cls.depth for cls in self._classes.values())
+
+    def _enqueue(self, cls: _PriorityClass, tenant: str, future: asyncio.Future) -> None:
+        if cls.depth == 0:
+            # an idle class does not bank credit while it had nothing to send
+            cls.virtual_finish = max(cls.virtual_finish, self._virtual_time)
+        cls.tenants.setdefault(tenant, deque()).append(future)
+        cls.depth += 1
+        self._update_gauges(cls)
+
+    def _remove(self, cls: _PriorityClass, tenant: str, future: asyncio.Future) -> None:
+        waiters = cls.tenants.get(tenant)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            cls.depth -= 1
+            if not waiters:
+                del cls.tenants[tenant]
+            self._update_gauges(cls)
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency:
+            candidates = [
+                cls
+                for cls in self._classes.values()
+                if cls.depth and self._running < self._capacity(cls.name)
+            ]
+            if not candidates:
+                return
+            cls = min(candidates, key=lambda c: c.virtual_finish)
+
+            tenant, waiters = next(iter(cls.tenants.items()))
+            future = waiters.popleft()
+            cls.depth -= 1
+            if waiters:
+                cls.tenants.move_to_end(tenant)
+            else:
+                del cls.tenants[tenant]
+            self._update_gauges(cls)
+
+            self._virtual_time = cls.virtual_finish
+            cls.virtual_finish += 1.0 / cls.weight
+            self._running += 1
+            future.set_result(None)
+
+    def _release(self) -> None:
+        self._running -= 1
+        self._dispatch()
+
+    def _update_gauges(self, cls: _PriorityClass) -> None:
+        metrics.gauge(f"scheduler.{cls.name}.queue_depth", cls.depth)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[str] = None, tenant: Optional[str] = None):
+        """Hold a provider concurrency slot for the duration of the block"""
+        priority = self.normalize_priority(priority or request_priority.get())
+        tenant = tenant or request_tenant.get() or "anonymous"
+        cls = self._classes[priority]
+        enqueued = time.monotonic()
+
+        if not self._has_waiters() and self._running < self._capacity(priority):
+            self._running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._enqueue(cls, tenant, future)
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # the slot was granted right before cancellation: hand it on
+                    self._release()
+                else:
+                    self._remove(cls, tenant, future)
+                raise
+
+        metrics.observe(f"scheduler.{priority}.wait_seconds", time.monotonic() - enqueued)
+        metrics.inc(f"scheduler.{priority}.started")
+        metrics.gauge("scheduler.running", self._running)
+        try:
+            yield
+        finally:
+            self._release()
+            metrics.gauge("scheduler.running", self._running)
+
+
+provider_scheduler = ProviderScheduler()
@@ -0,0 +1,114 @@
+import math
+import os
+import re
+from collections import defaultdict, deque
+from typing import Deque, Dict, List
+
+from app.services.metrics import MetricsRegistry, metrics
+
+# Words, numbers and single punctuation marks, like a BPE pre-tokenizer
+_PRETOKEN_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]", re.UNICODE)
+_LATIN_RE = re.compile(r"[A-Za-z]+")
+
+TRIM_MARKER = "\n[...]\n"
+TRUNCATION_RATIO = 0.95
+
+
+def _load_encoding():
+    """Optional exact tokenizer: TOKENIZER_ENCODING=cl100k_base with tiktoken installed"""
+    name = os.getenv("TOKENIZER_ENCODING")
+    if not name:
+        return None
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        print(f"⚠️ Tokenizer {name} unavailable ({e}). Using the built-in estimator.")
+        return None
+
+
+_encoding = _load_encoding()
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens locally.
+
+    Without an exact encoding the text is pre-tokenized like BPE does and each
+    piece is charged by length: about 4 characters per token for Latin words and
+    numbers, 2.5 for Cyrillic and other scripts. This errs on the high side.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    tokens = 0
+    for piece in _PRETOKEN_RE.findall(text):
+        if len(piece) == 1:
+            tokens += 1
+        elif piece.isdigit() or _LATIN_RE.fullmatch(piece):
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += math.ceil(len(piece) / 2.5)
+    return tokens
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    # ~4 tokens of chat framing per message
+    return sum(count_tokens(message["content"]) + 4 for message in messages)
+
+
+class TokenBudgeter:
+    """Prompt budgeting and adaptive max_tokens per endpoint.
+
+    ``max_tokens`` follows the observed output-length p95 of each endpoint with
+    headroom, capped by the provider default. A response that used up its limit
+    is recorded as twice the limit so the next requests get more room.
+    """
+
+    def __init__(self):
+        self.context_tokens = int(os.getenv("MODEL_CONTEXT_TOKENS", "8192"))
+        self.min_output_tokens = int(os.getenv("MIN_OUTPUT_TOKENS", "256"))
+        self.min_samples = int(os.getenv("MAX_TOKENS_MIN_SAMPLES", "20"))
+        self.prompt_overhead_tokens = 512
+        self._outputs: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=500))
+
+    def max_tokens(self, endpoint: str, default: int) -> int:
+        samples = self._outputs[endpoint]
+        if len(samples) < self.min_samples:
+            return default
+        p95 = MetricsRegistry.percentile(samples, 0.95)
+        return int(min(default, max(self.min_output_tokens, p95 * 1.25 + 64)))
+
+    def record_output(self, endpoint: str, text: str, max_tokens: int) -> None:
+        tokens = count_tokens(text)
+        metrics.observe(f"tokens.{endpoint}.output", tokens)
+        if tokens >= max_tokens * TRUNCATION_RATIO:
+            metrics.inc(f"tokens.{endpoint}.hit_limit")
+            tokens = max_tokens * 2
+        self._outputs[endpoint].append(tokens)
+        metrics.gauge(f"tokens.{endpoint}.max_tokens", self.max_tokens(endpoint, max_tokens))
+
+    def input_budget(self, max_tokens: int) -> int:
+        """Tokens left for user text once the prompt template and the answer are reserved"""
+        return max(self.context_tokens - max_tokens - self.prompt_overhead_tokens, 256)
+
+    def fit(self, endpoint: str, text: str, budget: int) -> str:
+        """Trim ``text`` to ``budget`` tokens keeping its beginning and end"""
+        tokens = count_tokens(text)
+        metrics.observe(f"tokens.{endpoint}.input", tokens)
+        if tokens <= budget:
+            return text
+
+        metrics.inc(f"tokens.{endpoint}.trimmed")
+        chars = int(len(text) * budget / tokens)
+        while True:
+            head = text[: chars * 2 // 3]
+            tail = text[len(text) - chars // 3 :]
+            trimmed = head + TRIM_MARKER + tail
+            if count_tokens(trimmed) <= budget or chars < 64:
+                return trimmed
+            chars = int(chars * 0.9)
+
+
+token_budgeter = TokenBudgeter()
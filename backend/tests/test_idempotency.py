@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.ai_service import provider_call_budget
+from app.services.idempotency import IdempotencyStore
+from app.services.metrics import metrics
+from app.services.request_context import (
+    ClientDisconnected,
+    DeadlineExceeded,
+    request_deadline,
+    run_until_disconnect,
+)
+
+
+class _Request:
+    """Starlette request stand-in for run_until_disconnect"""
+
+    def __init__(self, disconnected: bool = False):
+        self.disconnected = disconnected
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+class _Provider:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            async with provider_call_budget():
+                await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"text": "done"}
+
+
+def test_keyed_request_disconnect_cancels_provider_call():
+    async def scenario():
+        store = IdempotencyStore(orphan_grace=0.05)
+        provider = _Provider(10)
+        cancelled_before = metrics.counter("provider.cancelled")
+        with pytest.raises(ClientDisconnected):
+            await run_until_disconnect(
+                _Request(disconnected=True),
+                store.run("key", "scope", {"a": 1}, provider),
+                poll_interval=0.01,
+            )
+        await asyncio.sleep(0.1)
+        assert provider.cancelled == 1
+        assert metrics.counter("provider.cancelled") == cancelled_before + 1
+
+    asyncio.run(scenario())
+
+
+def test_keyed_generation_stops_at_client_deadline():
+    async def scenario():
+        store = IdempotencyStore(orphan_grace=10)
+        provider = _Provider(10)
+        request_deadline.set(time.time() + 0.05)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await store.run("key", "scope", {"a": 1}, provider)
+        assert time.monotonic() - started < 1
+        await asyncio.sleep(0)
+        assert provider.cancelled == 1
+
+    asyncio.run(scenario())
+
+
+def test_retry_within_grace_reuses_generation():
+    async def scenario():
+        store = IdempotencyStore(orphan_grace=1)
+        provider = _Provider(0.1)
+        with pytest.raises(ClientDisconnected):
+            await run_until_disconnect(
+                _Request(disconnected=True),
+                store.run("key", "scope", {"a": 1}, provider),
+                poll_interval=0.01,
+            )
+        result = await store.run("key", "scope", {"a": 1}, provider)
+        assert result == {"text": "done"}
+        assert provider.calls == 1 and provider.cancelled == 0
+
+    asyncio.run(scenario())
+
+
+def test_retry_extends_deadline():
+    async def scenario():
+        store = IdempotencyStore(orphan_grace=1)
+        provider = _Provider(0.2)
+
+        async def client(deadline: float):
+            request_deadline.set(time.time() + deadline)
+            return await run_until_disconnect(
+                _Request(), store.run("key", "scope", {"a": 1}, provider), poll_interval=0.01
+            )
+
+        first = asyncio.ensure_future(client(0.05))
+        await asyncio.sleep(0.01)
+        retry = asyncio.ensure_future(client(5))
+        with pytest.raises(DeadlineExceeded):
+            await first
+        assert await retry == {"text": "done"}
+        assert provider.calls == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import asyncio
+
+import httpx
+
+from app.services.request_context import RequestContextMiddleware, request_tenant
+from app.services.scheduler import ProviderScheduler
+
+
+def test_heavy_tenant_does_not_starve_another():
+    scheduler = ProviderScheduler(concurrency=1, reserve=0)
+    served = []
+
+    async def app(scope, receive, send):
+        async with scheduler.slot():
+            served.append(request_tenant.get())
+            await asyncio.sleep(0.01)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=RequestContextMiddleware(app))
+        async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client:
+
+            def call(tenant: str):
+                return client.post("/", headers={"X-Tenant-Id": tenant, "X-Priority": "interactive"})
+
+            heavy = [asyncio.ensure_future(call("telegram:1")) for _ in range(10)]
+            await asyncio.sleep(0.005)
+            light = asyncio.ensure_future(call("telegram:2"))
+            await asyncio.gather(*heavy, light)
+
+    asyncio.run(scenario())
+    # The light tenant waits for at most one heavy call besides the one running
+    assert served.index("telegram:2") <= 2
+    assert served.count("telegram:1") == 10
@@ -0,0 +1,73 @@
+"""Задержка запросов к бэкенду: новый клиент на запрос против общего пула.
+
+Отправляет --requests запросов GET /health волнами по --concurrency: сначала
+как раньше, с отдельным httpx.AsyncClient (и новым соединением) на каждый
+запрос, затем через общий клиент BackendService. Печатает медиану и p95.
+Адрес берется из BACKEND_URL, BACKEND_UDS и BACKEND_HTTP2, как у бота.
+
+Запуск из каталога bot/ при запущенном бэкенде:
+    BACKEND_URL=http://localhost:8000 python benchmarks/backend_client.py
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import httpx
+from services.ai_service import BackendService
+
+
+async def _per_request(service: BackendService):
+    uds = os.getenv("BACKEND_UDS")
+    transport = httpx.AsyncHTTPTransport(uds=uds) if uds else None
+    async with httpx.AsyncClient(
+        base_url=service.backend_url, transport=transport, timeout=service.timeout
+    ) as client:
+        (await client.get("/health")).raise_for_status()
+
+
+async def _pooled(service: BackendService):
+    (await service.client.get("/health")).raise_for_status()
+
+
+async def _measure(label: str, request, service, requests: int, concurrency: int):
+    timings = []
+
+    async def timed():
+        started = time.perf_counter()
+        await request(service)
+        timings.append(time.perf_counter() - started)
+
+    for _ in range(0, requests, concurrency):
+        await asyncio.gather(*(timed() for _ in range(concurrency)))
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(
+        f"{label:>12} {statistics.median(timings) * 1000:>10.2f} {p95 * 1000:>8.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    service = BackendService()
+    try:
+        await service.warm_up()
+        print(f"{'client':>12} {'median ms':>10} {'p95 ms':>8}")
+        await _measure(
+            "per-request", _per_request, service, args.requests, args.concurrency
+        )
+        await _measure("pooled", _pooled, service, args.requests, args.concurrency)
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
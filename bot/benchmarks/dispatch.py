@@ -0,0 +1,194 @@
+"""Обработка обновлений: последовательно, задачами aiogram и ShardedDispatcher.
+
+--users пользователей присылают по --messages сообщений с интервалом
+--gap секунд. Обработчик читает счетчик из FSM, ждет «бэкенд» случайные
+0..--backend секунд и записывает счетчик + 1. Три режима:
+последовательная обработка (handle_as_tasks=False), задача на каждое
+обновление (как при polling по умолчанию) и ShardedDispatcher с пулом
+--workers. Печатает пропускную способность, число пользователей, чьи
+сообщения обработаны не по порядку, и потерянные записи состояния.
+
+Второй замер - обработчик генерации с latest_submission, который отпускает
+очередь пользователя: «ответ» показывается после ожидания бэкенда, затем,
+еще через 0..--backend секунд, номер сообщения записывается в FSM.
+Устаревшие записи - те, что заменили в FSM номер более нового ответа
+номером более старого.
+
+Запуск из каталога bot/:
+    python benchmarks/dispatch.py --users 50 --messages 5 --backend 0.2
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update, User
+from services.dispatcher import ShardedDispatcher
+from services.inflight import inflight_registry, latest_submission, settle_submission
+
+
+def _update(update_id: int, user_id: int, number: int) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=number,
+            date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="User"),
+            text=str(number),
+        ),
+    )
+
+
+def _router(order, backend: float) -> Router:
+    router = Router()
+
+    @router.message()
+    async def handler(message: Message, state: FSMContext):
+        data = await state.get_data()
+        await asyncio.sleep(random.uniform(0, backend))
+        await state.update_data(count=data.get("count", 0) + 1)
+        order[message.chat.id].append(int(message.text))
+
+    return router
+
+
+class _RecordingStorage(MemoryStorage):
+    """MemoryStorage, считающий записи, вернувшие номер ответа назад"""
+
+    def __init__(self):
+        super().__init__()
+        self.stale = 0
+
+    async def set_data(self, key, data):
+        previous = (await self.get_data(key)).get("last", -1)
+        if data.get("last", previous) < previous:
+            self.stale += 1
+        await super().set_data(key, data)
+
+
+def _latest_router(answered, backend: float) -> Router:
+    router = Router()
+
+    @router.message()
+    @latest_submission("benchmark")
+    async def handler(message: Message, state: FSMContext):
+        # Сообщения, пришедшие до запуска генерации, склеены через \n
+        number = int(message.text.split()[-1])
+        await asyncio.sleep(random.uniform(0, backend))
+        settle_submission()
+        answered[message.chat.id].append(number)
+        await asyncio.sleep(random.uniform(0, backend))
+        await state.update_data(last=number)
+
+    return router
+
+
+async def _run(label: str, dp: Dispatcher, as_tasks: bool, args):
+    random.seed(1)
+    order = defaultdict(list)
+    dp.include_router(_router(order, args.backend))
+    bot = Bot("1234:token")
+    tasks = []
+    update_id = 0
+    started = time.monotonic()
+    for number in range(args.messages):
+        for user_id in range(1, args.users + 1):
+            update_id += 1
+            update = _update(update_id, user_id, number)
+            if as_tasks:
+                tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+            else:
+                await dp.feed_update(bot, update)
+        await asyncio.sleep(args.gap)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    reordered = sum(numbers != sorted(numbers) for numbers in order.values())
+    lost = 0
+    for user_id in order:
+        data = await dp.storage.get_data(key=_storage_key(bot, user_id))
+        lost += args.messages - data.get("count", 0)
+    total = args.users * args.messages
+    print(
+        f"{label:>10} {total / elapsed:>10.1f} {elapsed:>8.2f} "
+        f"{reordered:>10} {lost:>6}"
+    )
+    await bot.session.close()
+
+
+async def _run_latest(label: str, dispatcher_type, args, **kwargs):
+    random.seed(1)
+    storage = _RecordingStorage()
+    dp = dispatcher_type(storage=storage, **kwargs)
+    answered = defaultdict(list)
+    dp.include_router(_latest_router(answered, args.backend))
+    bot = Bot("1234:token")
+    tasks = []
+    update_id = 0
+    started = time.monotonic()
+    for number in range(args.messages):
+        for user_id in range(1, args.users + 1):
+            update_id += 1
+            update = _update(update_id, user_id, number)
+            tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+        await asyncio.sleep(args.gap)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    answers = sum(len(numbers) for numbers in answered.values())
+    total = args.users * args.messages
+    print(
+        f"{label:>10} {total / elapsed:>10.1f} {elapsed:>8.2f} "
+        f"{answers:>10} {storage.stale:>6}"
+    )
+    await bot.session.close()
+
+
+def _storage_key(bot: Bot, user_id: int) -> StorageKey:
+    return StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--gap", type=float, default=0.05)
+    parser.add_argument("--backend", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument(
+        "--skip-serial", action="store_true", help="без последовательного режима"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':>10} {'updates/s':>10} {'total s':>8} "
+        f"{'reordered':>10} {'lost':>6}"
+    )
+    if not args.skip_serial:
+        await _run("serial", Dispatcher(), False, args)
+    await _run("tasks", Dispatcher(), True, args)
+    await _run("sharded", ShardedDispatcher(workers=args.workers), True, args)
+
+    # latest_submission: генерация отпускает очередь (release_lane)
+    inflight_registry.debounce = 0
+    print(
+        f"\n{'latest':>10} {'updates/s':>10} {'total s':>8} "
+        f"{'answered':>10} {'stale':>6}"
+    )
+    await _run_latest("tasks", Dispatcher, args)
+    await _run_latest("sharded", ShardedDispatcher, args, workers=args.workers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""Память FSM при росте числа пользователей, бросивших сценарий.
+
+Волнами по --users пользователей имитирует незавершенный маркетинговый
+сценарий: прежний вариант - полный ответ модели в данных MemoryStorage
+aiogram, новый - MarketingDraft со ссылкой на историю в TTLMemoryStorage.
+Каждый пользователь также проходит через get_state без сценария (так
+aiogram делает на любое сообщение). Между волнами проходит больше TTL,
+поэтому новый вариант держит в памяти только последнюю волну. Печатает
+размер хранилищ по tracemalloc после каждой волны и отчет по состояниям.
+
+Запуск из каталога bot/:
+    python benchmarks/fsm_memory.py --users 20000 --waves 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from services.fsm_storage import TTLMemoryStorage
+from states.marketing_states import MarketingStates
+from states.payloads import MarketingDraft, save_payload
+
+BOT_ID = 1
+TTL = 0.5
+
+
+def _result(n: int):
+    """Ответ бэкенда маркетинга примерно реального размера"""
+    return {
+        "post_variants": [f"Вариант поста {n}.{i} " + "текст " * 80 for i in range(3)],
+        "suggestions": [f"Совет {n}.{i} " + "подробно " * 10 for i in range(3)],
+    }
+
+
+async def _wave(storage, compact: bool, first_user: int, users: int):
+    state = MarketingStates.waiting_for_variant_selection
+    for user in range(first_user, first_user + users):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user, user_id=user)
+        await storage.get_state(key)
+        # Сообщение без сценария от соседнего пользователя
+        passerby = StorageKey(bot_id=BOT_ID, chat_id=-user, user_id=-user)
+        await storage.get_state(passerby)
+
+        if compact:
+            await save_payload(FSMContext(storage, key), MarketingDraft(user, 3))
+        else:
+            result = _result(user)
+            await storage.update_data(
+                key,
+                {
+                    "post_variants": result["post_variants"],
+                    "suggestions": result["suggestions"],
+                    "original_idea": f"идея {user}",
+                },
+            )
+        await storage.set_state(key, state)
+
+
+async def _measure(label: str, storage, compact: bool, users: int, waves: int):
+    tracemalloc.start()
+    sizes = []
+    for wave in range(waves):
+        await _wave(storage, compact, 1 + wave * users, users)
+        sizes.append(tracemalloc.get_traced_memory()[0] / 2**20)
+        if wave < waves - 1:
+            await asyncio.sleep(TTL * 1.5)
+    tracemalloc.stop()
+    print(f"{label:>8} " + " ".join(f"{size:>9.1f}" for size in sizes))
+    return storage
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--waves", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'MB after':>8} "
+        + " ".join(f"{(wave + 1) * args.users:>9}" for wave in range(args.waves))
+    )
+    await _measure("legacy", MemoryStorage(), False, args.users, args.waves)
+    storage = await _measure(
+        "compact",
+        TTLMemoryStorage(ttl=TTL, sweep_interval=TTL / 5),
+        True,
+        args.users,
+        args.waves,
+    )
+
+    print("\nTTLMemoryStorage by state:")
+    for state, (records, size) in (await storage.memory_report()).items():
+        print(f"  {state}: {records} records, {size / 1024:.0f} KB")
+    await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""Задержка операций FSM-хранилища на одно обновление Telegram.
+
+Для каждого хранилища (memory, postgres и redis, если задан REDIS_URL)
+прогоняет типичный цикл обработчика - get_state, get_data, update_data,
+set_state - по множеству пользователей и печатает медиану и p95 каждой
+операции и всего цикла. Для postgres нужна миграция 0007 (alembic upgrade head).
+
+Запуск из каталога bot/:
+    DATABASE_URL=postgresql://... python benchmarks/fsm_storage.py --updates 5000
+    REDIS_URL=redis://localhost:6379/0 DATABASE_URL=... python benchmarks/fsm_storage.py
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from services.fsm_storage import PostgresStorage
+from services.history_service import HistoryService
+
+BOT_ID = 1
+FIRST_BENCH_USER = -300
+OPERATIONS = ("get_state", "get_data", "update_data", "set_state", "cycle")
+
+
+async def _cycle(storage, key: StorageKey, n: int, timings):
+    started = time.perf_counter()
+    await storage.get_state(key)
+    timings["get_state"].append(time.perf_counter() - started)
+
+    begin = time.perf_counter()
+    await storage.get_data(key)
+    timings["get_data"].append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    await storage.update_data(key, {"original_idea": f"idea {n}", "post_variants": ["a"] * 3})
+    timings["update_data"].append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    await storage.set_state(key, "MarketingStates:waiting_for_variant_selection")
+    timings["set_state"].append(time.perf_counter() - begin)
+    timings["cycle"].append(time.perf_counter() - started)
+
+
+async def _measure(label: str, storage, updates: int, users: int):
+    keys = [
+        StorageKey(bot_id=BOT_ID, chat_id=user, user_id=user)
+        for user in range(FIRST_BENCH_USER, FIRST_BENCH_USER - users, -1)
+    ]
+    timings = {operation: [] for operation in OPERATIONS}
+    for n in range(updates):
+        await _cycle(storage, keys[n % users], n, timings)
+    for key in keys:
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+
+    for operation in OPERATIONS:
+        values = sorted(timings[operation])
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(
+            f"{label:>9} {operation:>12} "
+            f"{statistics.median(values) * 1000:>10.3f} {p95 * 1000:>8.3f}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'storage':>9} {'operation':>12} {'median ms':>10} {'p95 ms':>8}")
+    await _measure("memory", MemoryStorage(), args.updates, args.users)
+
+    service = HistoryService()
+    await service.initialize()
+    try:
+        await service.warm_up(1)
+        storage = PostgresStorage(service.engine, ttl=3600)
+        await _measure("postgres", storage, args.updates, args.users)
+        await storage.close()
+    finally:
+        await service.close()
+
+    if os.getenv("REDIS_URL"):
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        storage = RedisStorage.from_url(os.environ["REDIS_URL"], state_ttl=3600, data_ttl=3600)
+        try:
+            await _measure("redis", storage, args.updates, args.users)
+        finally:
+            await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+"""Степень сжатия и скорость zstd со словарем на реальной истории.
+
+Берет тексты запросов и ответов из выгрузки партиции (.jsonl.gz архиватора
+истории) или из последних записей базы, обучает словарь на части текстов и
+на остальных сравнивает zstd без словаря и со словарем: степень сжатия и
+скорость сжатия/распаковки в МБ/с. С --save обучает словарь на базе и
+сохраняет его новой версией (нужен HISTORY_COMPRESSION=zstd, чтобы новые
+записи сразу сжимались им).
+
+Запуск из каталога bot/:
+    python benchmarks/history_compression.py --dump /data/history-archive/user_history_p202501.jsonl.gz
+    DATABASE_URL=postgresql://... python benchmarks/history_compression.py --records 20000
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import orjson
+import zstandard
+from services.history_compression import HistoryCompression
+from services.history_service import HistoryService
+
+
+def _texts_from_dump(path: str, limit: int):
+    texts = []
+    with gzip.open(path, "rb") as dump:
+        for line in dump:
+            record = orjson.loads(line)
+            texts.extend(
+                value for value in (record["request_text"], record["response_text"]) if value
+            )
+            if len(texts) >= limit:
+                break
+    return texts
+
+
+async def _texts_from_database(limit: int):
+    service = HistoryService()
+    try:
+        return await service.sample_texts(limit)
+    finally:
+        await service.close()
+
+
+def _measure(label: str, compressor, decompressor, samples):
+    raw = sum(len(sample) for sample in samples)
+
+    started = time.perf_counter()
+    frames = [compressor.compress(sample) for sample in samples]
+    encode_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for frame in frames:
+        decompressor.decompress(frame)
+    decode_seconds = time.perf_counter() - started
+
+    compressed = sum(len(frame) for frame in frames)
+    print(
+        f"{label:>18} {raw / compressed:>7.2f}x "
+        f"{raw / encode_seconds / 2**20:>10.1f} {raw / decode_seconds / 2**20:>10.1f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dump", help="архив партиции .jsonl.gz")
+    parser.add_argument("--records", type=int, default=20_000)
+    parser.add_argument("--train-share", type=float, default=0.2)
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--save", action="store_true", help="сохранить словарь в базу")
+    args = parser.parse_args()
+
+    if args.dump:
+        texts = _texts_from_dump(args.dump, args.records * 2)
+    else:
+        texts = await _texts_from_database(args.records)
+    if len(texts) < 100:
+        sys.exit(f"Need at least 100 texts, got {len(texts)}")
+
+    split = int(len(texts) * args.train_share)
+    training, samples = texts[:split], [text.encode() for text in texts[split:]]
+    compression = HistoryCompression(enabled=True, level=args.level)
+
+    started = time.perf_counter()
+    dictionary = zstandard.ZstdCompressionDict(compression.train(training))
+    print(
+        f"Dictionary: {len(dictionary.as_bytes())} bytes from {len(training)} texts "
+        f"in {time.perf_counter() - started:.1f}s; measuring {len(samples)} texts, "
+        f"{sum(map(len, samples)) / 2**20:.1f} MB"
+    )
+    print(f"{'':>18} {'ratio':>8} {'enc MB/s':>10} {'dec MB/s':>10}")
+    _measure(
+        "zstd",
+        zstandard.ZstdCompressor(level=args.level),
+        zstandard.ZstdDecompressor(),
+        samples,
+    )
+    _measure(
+        "zstd + dictionary",
+        zstandard.ZstdCompressor(level=args.level, dict_data=dictionary),
+        zstandard.ZstdDecompressor(dict_data=dictionary),
+        samples,
+    )
+
+    if args.save:
+        service = HistoryService()
+        try:
+            dict_id = await service.train_compression_dictionary(samples=args.records)
+            print(f"Saved dictionary version {dict_id}")
+        finally:
+            await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
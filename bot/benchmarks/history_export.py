@@ -0,0 +1,132 @@
+"""Выгрузка истории (/export): память и задержка event loop против fetchall.
+
+Заполняет историю тестового пользователя --records записями (с
+response_data) и выгружает ее в сжатый JSONL двумя способами: прежним
+подходом «прочитать все и записать» (fetchall, затем gzip) и
+HistoryExport (серверный курсор, пачки, сжатие в потоке). Печатает время,
+размер файла, пик памяти Python (tracemalloc) и наибольшую задержку
+event loop, которую в это время видят другие обновления.
+
+Запуск из каталога bot/:
+    DATABASE_URL=postgresql://... python benchmarks/history_export.py --records 100000
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import orjson
+from sqlalchemy import text
+from services.history_export import HistoryExport
+from services.history_service import HistoryService
+
+BENCH_USER = -300
+
+_SEED = text(
+    """
+    INSERT INTO user_history (user_id, category, request_text, response_text,
+                              response_data, created_at, request_preview, response_preview)
+    SELECT :user_id, 'benchmark', 'идея для поста номер ' || n,
+           repeat('вариант поста про кофейню и акцию недели ', 20),
+           jsonb_build_object('post_variants',
+                              jsonb_build_array('пост ' || n, 'пост ' || n || 'b'),
+                              'suggestions', jsonb_build_array('хэштеги')),
+           date_trunc('month', now()) + n * INTERVAL '1 second', '', ''
+    FROM generate_series(CAST(:start AS INTEGER), CAST(:stop AS INTEGER)) AS n
+"""
+)
+
+
+async def _fetchall_export(service: HistoryService, user_id: int) -> str:
+    """Прежний подход: вся история в памяти, затем файл"""
+    async with service.engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                "SELECT id, category, created_at, request_text, response_text, "
+                "response_data FROM user_history WHERE user_id = :user_id "
+                "ORDER BY created_at, id"
+            ),
+            {"user_id": user_id},
+        )
+        records = [dict(row) for row in result.mappings().all()]
+    handle, path = tempfile.mkstemp(suffix=".jsonl.gz")
+    os.close(handle)
+    with gzip.open(path, "wb") as archive:
+        archive.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+    return path
+
+
+async def _cursor_export(service: HistoryService, user_id: int) -> str:
+    path, _ = await HistoryExport(concurrency=1).export(user_id, "jsonl")
+    return str(path)
+
+
+async def _measure(label: str, export, service: HistoryService):
+    lag = 0.0
+
+    async def ticker():
+        nonlocal lag
+        while True:
+            begin = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - begin - 0.01)
+
+    probe = asyncio.create_task(ticker())
+    tracemalloc.start()
+    begin = time.perf_counter()
+    path = await export(service, BENCH_USER)
+    elapsed = time.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    probe.cancel()
+    size = os.path.getsize(path)
+    os.unlink(path)
+    print(
+        f"{label:>10} {elapsed:>8.2f} {size / 2**20:>8.1f} "
+        f"{peak / 2**20:>9.1f} {lag * 1000:>8.0f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+
+    service = HistoryService()
+    await service.initialize()
+    for start in range(1, args.records + 1, 50_000):
+        async with service.engine.begin() as conn:
+            await conn.execute(
+                _SEED,
+                {
+                    "user_id": BENCH_USER,
+                    "start": start,
+                    "stop": min(start + 49_999, args.records),
+                },
+            )
+
+    try:
+        print(f"Exporting {args.records} records")
+        print(
+            f"{'export':>10} {'time s':>8} {'file MB':>8} "
+            f"{'peak MB':>9} {'lag ms':>8}"
+        )
+        await _measure("fetchall", _fetchall_export, service)
+        await _measure("cursor", _cursor_export, service)
+    finally:
+        async with service.engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM user_history WHERE user_id = :user_id"),
+                {"user_id": BENCH_USER},
+            )
+        await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
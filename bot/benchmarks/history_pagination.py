@@ -0,0 +1,112 @@
+"""Стоимость перелистывания истории: LIMIT/OFFSET + COUNT(*) против keyset.
+
+Заполняет историю тестовых пользователей (по умолчанию 100k записей у каждого)
+и измеряет время одного перелистывания на разной глубине: прежний путь -
+два запроса (страница с OFFSET и отдельный COUNT(*)), новый - один запрос
+по курсору из callback data.
+
+Запуск из каталога bot/:
+    DATABASE_URL=postgresql://... python benchmarks/history_pagination.py --records 100000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from sqlalchemy import text
+from services.history_service import HistoryService
+
+PAGE_SIZE = 5
+BENCH_USER_IDS = (-101, -102, -103)
+
+_SEED = text(
+    """
+    INSERT INTO user_history (user_id, category, request_text, response_text, created_at)
+    SELECT :user_id, '💬 Маркетинг и контент', 'benchmark idea ' || n, repeat('variant ', 40),
+           date_trunc('month', now()) + n * INTERVAL '1 second'
+    FROM generate_series(1, :records) AS n
+"""
+)
+_LEGACY_PAGE = text(
+    """
+    SELECT id, category, request_text, response_text, created_at, message_id
+    FROM user_history
+    WHERE user_id = :user_id
+    ORDER BY created_at DESC
+    LIMIT :limit OFFSET :offset
+"""
+)
+_LEGACY_COUNT = text("SELECT COUNT(*) FROM user_history WHERE user_id = :user_id")
+_CURSOR_AT = text(
+    """
+    SELECT created_at, id FROM user_history
+    WHERE user_id = :user_id
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1 OFFSET :offset
+"""
+)
+
+
+async def _timed(coro_factory, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await coro_factory()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    service = HistoryService()
+    await service.initialize()
+    engine = service.engine
+    user_id = BENCH_USER_IDS[0]
+
+    async with engine.begin() as conn:
+        for bench_user in BENCH_USER_IDS:
+            await conn.execute(_SEED, {"user_id": bench_user, "records": args.records})
+        await conn.execute(text("ANALYZE user_history"))
+
+    async def legacy_page(offset: int):
+        async with engine.connect() as conn:
+            await conn.execute(
+                _LEGACY_PAGE, {"user_id": user_id, "limit": PAGE_SIZE, "offset": offset}
+            )
+            await conn.execute(_LEGACY_COUNT, {"user_id": user_id})
+
+    last_page = args.records // PAGE_SIZE - 1
+    print(f"{args.records} records per user, median of {args.repeats} page flips")
+    print(f"{'page':>8} {'OFFSET+COUNT ms':>16} {'keyset ms':>10}")
+    try:
+        for page in sorted({1, 10, 100, 1000, last_page // 2, last_page}):
+            offset = page * PAGE_SIZE
+            async with engine.connect() as conn:
+                row = (await conn.execute(_CURSOR_AT, {"user_id": user_id, "offset": offset - 1})).one()
+            cursor = service.encode_cursor(row.created_at, row.id)
+
+            legacy_ms = await _timed(lambda: legacy_page(offset), args.repeats)
+            keyset_ms = await _timed(
+                lambda: service.get_history_page(user_id, limit=PAGE_SIZE, cursor=cursor),
+                args.repeats,
+            )
+            print(f"{page:>8} {legacy_ms:>16.2f} {keyset_ms:>10.2f}")
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM user_history WHERE user_id = ANY(:user_ids)"),
+                {"user_ids": list(BENCH_USER_IDS)},
+            )
+        await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
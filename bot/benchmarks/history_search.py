@@ -0,0 +1,120 @@
+"""Задержка поиска по истории (/search) на большой таблице.
+
+Заполняет историю тестовых пользователей (по умолчанию 1M записей на 1000
+пользователей) текстами из словаря деловой лексики и измеряет медиану
+времени search_history для частого слова, фразы, редкого слова и запроса
+без совпадений.
+
+Запуск из каталога bot/:
+    DATABASE_URL=postgresql://... python benchmarks/history_search.py --records 1000000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from sqlalchemy import text
+from services.history_service import HistoryService
+
+FIRST_BENCH_USER = -200
+WORDS = (
+    "договор поставки оборудования аренда помещения услуги оплата счет акт "
+    "штраф неустойка срок расторжение претензия сторона ответственность "
+    "продажи выручка прибыль расходы бюджет квартал прогноз клиент скидка "
+    "акция кофе кофейня пост сторис баннер встреча задача решение отчет "
+    "сотрудник письмо предложение коммерческое партнер доставка"
+).split()
+
+_SEED = text(
+    """
+    INSERT INTO user_history (user_id, category, request_text, response_text, created_at,
+                              request_preview, response_preview)
+    SELECT :first_user - (n % :users), 'benchmark',
+           (SELECT string_agg((CAST(:words AS TEXT[]))[1 + abs(hashtext(n || ':' || k)) % CAST(:vocabulary AS INTEGER)], ' ')
+            FROM generate_series(1, 12) AS k),
+           (SELECT string_agg((CAST(:words AS TEXT[]))[1 + abs(hashtext(n || '/' || k)) % CAST(:vocabulary AS INTEGER)], ' ')
+            FROM generate_series(1, 60) AS k),
+           date_trunc('month', now()) + n * INTERVAL '1 second', '', ''
+    FROM generate_series(CAST(:start AS INTEGER), CAST(:stop AS INTEGER)) AS n
+"""
+)
+_NEEDLE = text(
+    """
+    INSERT INTO user_history (user_id, category, request_text, response_text, created_at,
+                              request_preview, response_preview)
+    VALUES (:user_id, 'benchmark', 'рефинансирование кредита', 'условия рефинансирования',
+            date_trunc('month', now()), '', '')
+"""
+)
+
+QUERIES = (
+    ("частое слово", "договор"),
+    ("фраза", '"неустойка за срок"'),
+    ("редкое слово", "рефинансирование"),
+    ("нет совпадений", "криптовалюта"),
+)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    service = HistoryService()
+    await service.initialize()
+    engine = service.engine
+    bench_users = list(range(FIRST_BENCH_USER, FIRST_BENCH_USER - args.users, -1))
+
+    started = time.perf_counter()
+    for start in range(1, args.records + 1, 100_000):
+        async with engine.begin() as conn:
+            await conn.execute(
+                _SEED,
+                {
+                    "first_user": FIRST_BENCH_USER,
+                    "users": args.users,
+                    "words": list(WORDS),
+                    "vocabulary": len(WORDS),
+                    "start": start,
+                    "stop": min(start + 99_999, args.records),
+                },
+            )
+    async with engine.begin() as conn:
+        await conn.execute(_NEEDLE, {"user_id": FIRST_BENCH_USER})
+        await conn.execute(text("ANALYZE user_history"))
+    print(
+        f"Seeded {args.records} records for {args.users} users "
+        f"in {time.perf_counter() - started:.0f}s"
+    )
+
+    try:
+        print(f"{'query':>16} {'found':>6} {'median ms':>10} {'p95 ms':>8}")
+        for label, query in QUERIES:
+            timings = []
+            for _ in range(args.repeats):
+                begin = time.perf_counter()
+                results = await service.search_history(FIRST_BENCH_USER, query)
+                timings.append((time.perf_counter() - begin) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(
+                f"{label:>16} {len(results):>6} "
+                f"{statistics.median(timings):>10.2f} {p95:>8.2f}"
+            )
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM user_history WHERE user_id = ANY(:user_ids)"),
+                {"user_ids": bench_users},
+            )
+        await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
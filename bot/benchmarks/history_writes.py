@@ -0,0 +1,135 @@
+"""Пропускная способность обработки апдейтов с записью в историю.
+
+Сравнивает прежний путь (синхронные Session/psycopg2 внутри async-обработчика)
+и HistoryService на asyncpg. Каждый апдейт имитирует обработчик категории:
+ожидание ответа бэкенда и запись в историю. Параллельно измеряется задержка
+event loop - насколько блокирующие вызовы замораживают остальных пользователей.
+
+Запуск из каталога bot/:
+    DATABASE_URL=postgresql://... python benchmarks/history_writes.py --updates 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from services.history_service import HistoryService
+
+BENCH_USER_ID = -1
+BACKEND_LATENCY = 0.005
+
+
+class LegacyHistoryWriter:
+    """Прежняя реализация add_record: синхронный Session внутри async def"""
+
+    def __init__(self, db_url: str):
+        self.engine = create_engine(db_url, pool_pre_ping=True, pool_recycle=300)
+        self.Session = sessionmaker(bind=self.engine)
+
+    async def add_record(self, user_id, category, request_text, response_text=None, response_data=None, message_id=None):
+        session = self.Session()
+        try:
+            result = session.execute(
+                text(
+                    """
+                    INSERT INTO user_history
+                    (user_id, category, request_text, response_text, response_data, message_id, created_at)
+                    VALUES (:user_id, :category, :request_text, :response_text, :response_data, :message_id, :created_at)
+                    RETURNING id
+                """
+                ),
+                {
+                    "user_id": user_id,
+                    "category": category,
+                    "request_text": request_text,
+                    "response_text": response_text,
+                    # столбец стал JSONB: str(dict) прежней версии туда уже не записать
+                    "response_data": json.dumps(response_data) if response_data else None,
+                    "message_id": message_id,
+                    "created_at": datetime.utcnow(),
+                },
+            )
+            session.commit()
+            return result.scalar()
+        finally:
+            session.close()
+
+
+async def _loop_lag_monitor(stop: asyncio.Event, samples: list, interval: float = 0.001):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def _run(writer, updates: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle_update(i: int):
+        async with semaphore:
+            await asyncio.sleep(BACKEND_LATENCY)
+            await writer.add_record(
+                user_id=BENCH_USER_ID,
+                category="💬 Маркетинг и контент",
+                request_text=f"benchmark idea {i}",
+                response_text="variant " * 40,
+                response_data={"post_variants": ["a", "b", "c"]},
+                message_id=i,
+            )
+
+    stop = asyncio.Event()
+    lag = []
+    monitor = asyncio.create_task(_loop_lag_monitor(stop, lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(handle_update(i) for i in range(updates)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    lag.sort()
+    return {
+        "updates_per_s": updates / elapsed,
+        "loop_lag_p99_ms": lag[int(len(lag) * 0.99)] * 1000 if lag else 0.0,
+        "loop_lag_max_ms": lag[-1] * 1000 if lag else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    db_url = os.environ["DATABASE_URL"]
+    service = HistoryService()
+    await service.initialize()
+
+    results = {
+        "before (sync psycopg2)": await _run(LegacyHistoryWriter(db_url), args.updates, args.concurrency),
+        "after (asyncpg)": await _run(service, args.updates, args.concurrency),
+    }
+
+    async with service.engine.begin() as conn:
+        await conn.execute(
+            text("DELETE FROM user_history WHERE user_id = :user_id"),
+            {"user_id": BENCH_USER_ID},
+        )
+    await service.close()
+
+    print(f"{args.updates} updates, concurrency {args.concurrency}")
+    for name, stats in results.items():
+        print(
+            f"{name:24} {stats['updates_per_s']:8.1f} updates/s  "
+            f"loop lag p99 {stats['loop_lag_p99_ms']:6.1f} ms  max {stats['loop_lag_max_ms']:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""Доставка сообщений при всплеске: прямые вызовы против OutboundScheduler.
+
+Имитирует Bot API с лимитами Telegram: общий - --api-rate запросов в
+секунду, на чат - 1 в секунду с запасом 3, превышение дает 429 с
+retry_after. Всплеск: --chats чатов по --messages сообщений, плюс рассылка
+--bulk сообщений в отдельные чаты. Без очереди сообщение, получившее 429,
+теряется (как в обработчиках до очереди); с очередью оно повторяется.
+Печатает доставленные, потерянные, число 429 и время доставки ответов.
+
+Запуск из каталога bot/:
+    python benchmarks/outbound.py --chats 200 --messages 3 --bulk 300
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from services.outbound import OutboundScheduler, bulk_sends
+
+
+class FakeBotAPI:
+    """Лимиты Bot API: токен-бакеты на бота и на чат, штраф при превышении"""
+
+    def __init__(self, rate: float, penalty: int = 2):
+        self.rate = rate
+        self.penalty = penalty
+        self.tokens = rate
+        self.refilled = time.monotonic()
+        self.chats = {}
+        self.blocked_until = {}
+        self.flood_errors = 0
+
+    async def __call__(self, bot, method):
+        await asyncio.sleep(0.005)
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        tokens, seen = self.chats.get(method.chat_id, (3.0, now))
+        tokens = min(3.0, tokens + (now - seen))
+        if self.blocked_until.get(method.chat_id, 0) > now or tokens < 1 or self.tokens < 1:
+            self.flood_errors += 1
+            self.blocked_until[method.chat_id] = now + self.penalty
+            raise TelegramRetryAfter(
+                method=method, message="Too Many Requests", retry_after=self.penalty
+            )
+        self.tokens -= 1
+        self.chats[method.chat_id] = (tokens - 1, now)
+        return True
+
+
+async def _run(label: str, scheduler, args):
+    api = FakeBotAPI(args.api_rate)
+    call = (lambda method: scheduler(api, None, method)) if scheduler else (
+        lambda method: api(None, method)
+    )
+    latencies, lost = [], 0
+    started = time.monotonic()
+
+    async def send(chat_id: int, bulk: bool):
+        nonlocal lost
+        begin = time.monotonic()
+        try:
+            if bulk:
+                with bulk_sends():
+                    await call(SendMessage(chat_id=chat_id, text="bulk"))
+            else:
+                await call(SendMessage(chat_id=chat_id, text="reply"))
+                latencies.append(time.monotonic() - begin)
+        except TelegramRetryAfter:
+            lost += 1
+
+    tasks = [
+        send(chat, False) for chat in range(1, args.chats + 1) for _ in range(args.messages)
+    ]
+    tasks += [send(100_000 + n, True) for n in range(args.bulk)]
+    await asyncio.gather(*tasks)
+    if scheduler:
+        await scheduler.stop()
+    elapsed = time.monotonic() - started
+    delivered = len(tasks) - lost
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+    median = statistics.median(latencies) if latencies else 0.0
+    print(
+        f"{label:>10} {delivered:>9} {lost:>6} {api.flood_errors:>6} "
+        f"{median:>10.2f} {p95:>8.2f} {elapsed:>8.1f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--bulk", type=int, default=300)
+    parser.add_argument("--api-rate", type=float, default=30)
+    args = parser.parse_args()
+
+    print(
+        f"{'sender':>10} {'delivered':>9} {'lost':>6} {'429s':>6} "
+        f"{'reply p50':>10} {'p95 s':>8} {'total s':>8}"
+    )
+    await _run("direct", None, args)
+    await _run(
+        "scheduler",
+        OutboundScheduler(global_rate=args.api_rate, chat_rate=1, chat_burst=3),
+        args,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+"""Запросы к Bot API и задержка ответа: заглушка+удаление+ответ против правки.
+
+--users пользователей одновременно запускают генерацию длительностью
+--generation секунд. Прежний вариант: заглушка, ее удаление и ответ;
+новый - pending_reply: заглушка, ее правка и статус «печатает» для долгих
+ответов. Bot API имитируется сессией с задержкой --api-latency и лимитом
+--api-rate запросов в секунду за общей очередью OutboundScheduler.
+Печатает число запросов и время от сообщения до готового ответа.
+
+Запуск из каталога bot/:
+    python benchmarks/replies.py --users 300 --generation 2
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, User
+from services.outbound import OutboundScheduler
+from services.replies import pending_reply
+
+
+class FakeSession(BaseSession):
+    """Bot API с фиксированной задержкой и общим лимитом частоты"""
+
+    def __init__(self, latency: float, rate: float):
+        super().__init__()
+        self.latency = latency
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+        self.calls = Counter()
+        self.message_ids = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        now = time.monotonic()
+        self.next_slot = max(self.next_slot, now) + self.interval
+        await asyncio.sleep(self.next_slot - now - self.interval + self.latency)
+        self.calls[type(method).__name__] += 1
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self.message_ids += 1
+            return _message(bot, method.chat_id, method.text, self.message_ids)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def _message(bot: Bot, chat_id: int, text: str, message_id: int) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=chat_id, type="private"),
+        from_user=User(id=chat_id, is_bot=False, first_name="User"),
+        text=text,
+    ).as_(bot)
+
+
+async def _legacy_flow(message: Message, generation: float):
+    processing_msg = await message.answer("🔄 Генерирую...")
+    await asyncio.sleep(generation)
+    await processing_msg.delete()
+    await message.answer("✅ <b>Ответ</b>", parse_mode="HTML")
+
+
+async def _pending_reply_flow(message: Message, generation: float):
+    async with pending_reply(message, "🔄 Генерирую...") as reply:
+        await asyncio.sleep(generation)
+        await reply.finish("✅ <b>Ответ</b>")
+
+
+async def _measure(label: str, flow, args):
+    session = FakeSession(args.api_latency, args.api_rate)
+    scheduler = OutboundScheduler(global_rate=args.api_rate)
+    session.middleware(scheduler)
+    bot = Bot("1234:token", session=session)
+    latencies = []
+
+    async def user(chat_id: int):
+        started = time.monotonic()
+        await flow(_message(bot, chat_id, "идея", 0), args.generation)
+        latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*(user(chat) for chat in range(1, args.users + 1)))
+    await scheduler.stop()
+    latencies.sort()
+    calls = sum(session.calls.values())
+    print(
+        f"{label:>14} {calls:>6} {calls / args.users:>9.2f} "
+        f"{statistics.median(latencies):>8.2f} "
+        f"{latencies[int(len(latencies) * 0.95)]:>8.2f}  {dict(session.calls)}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--generation", type=float, default=2.0)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--api-rate", type=float, default=30)
+    args = parser.parse_args()
+
+    print(f"{'flow':>14} {'calls':>6} {'per user':>9} {'p50 s':>8} {'p95 s':>8}")
+    await _measure("delete+answer", _legacy_flow, args)
+    await _measure("pending_reply", _pending_reply_flow, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,12 +2,18 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from keyboards import action_menu, document_types_menu, scenario_menu
-from services.ai_service import BackendService
+from services.ai_service import backend_service
 from services.history_service import get_history_service
+from services.inflight import latest_submission
+from services.message_stream import stream_to_message
+from services.replies import pending_reply, send_reply
 from states.document_states import DocumentStates
+from states.payloads import DocumentDraft, load_payload, save_payload
 
 router = Router()
-backend_service = BackendService()
+
+# Тип по умолчанию, если пользователь не выбрал его перед описанием
+DEFAULT_DOC_TYPE = "документа"
 
 
 @router.message(F.text == "📑 Документы и письма")
@@ -27,7 +33,7 @@ async def process_document_type(message: Message, state: FSMContext):
     doc_type = message.text
 
     # Сохраняем тип документа
-    await state.update_data(doc_type=doc_type)
+    await save_payload(state, DocumentDraft(doc_type))
 
     await message.answer(
         f"📝 <b>Создание {doc_type}</b>\n\n"
@@ -38,69 +44,108 @@ async def process_document_type(message: Message, state: FSMContext):
     await state.set_state(DocumentStates.waiting_for_content)
 
 
+def render_document(result: dict, doc_type: str) -> str:
+    """Ответ с готовым документом"""
+    corrections = result.get("corrections", [])
+    suggestions = result.get("suggestions", [])
+
+    # Формируем ответ
+    response_text = f"✅ <b>{doc_type} создан!</b>\n\n"
+    response_text += f"{result.get('document', '')}\n\n"
+
+    if corrections:
+        response_text += "⚠️ <b>Предлагаемые исправления:</b>\n"
+        for correction in corrections:
+            response_text += f"• {correction}\n"
+        response_text += "\nПрименить исправления?"
+
+    elif suggestions:
+        response_text += "💡 <b>Предложения по улучшению:</b>\n"
+        for suggestion in suggestions:
+            response_text += f"• {suggestion}\n"
+    return response_text
+
+
+async def _offer_corrections(state: FSMContext, result: dict):
+    """Вопрос об исправлениях, если бэкенд их предложил
+
+    Документ готов: DocumentDraft больше не нужен и в FSM не остается.
+    """
+    await state.set_data({})
+    await state.set_state(
+        DocumentStates.waiting_for_corrections if result.get("corrections") else None
+    )
+
+
 @router.message(DocumentStates.waiting_for_content)
+@latest_submission("documents:content")
 async def process_document_content(message: Message, state: FSMContext):
     """Обработка содержания документа и генерация через бэкенд"""
-    content = message.text
-    data = await state.get_data()
-    doc_type = data.get("doc_type", "документа")
+    draft = await load_payload(state, DocumentDraft)
+    doc_type = draft.doc_type if draft else DEFAULT_DOC_TYPE
+    await create_document(
+        message, state, doc_type, message.text, message.from_user.id
+    )
 
-    processing_msg = await message.answer("🔄 Создаю документ...")
 
+async def create_document(
+    message: Message, state: FSMContext, doc_type: str, content: str, user_id: int
+):
+    """Генерация документа с ответом в чат ``message``
+
+    Общая для нового запроса и повторной генерации из истории.
+    """
     try:
-        # Вызываем бэкенд для генерации документа
-        result = await backend_service.generate_document(
-            doc_type=doc_type, content=content
-        )
+        # Документ появляется в сообщении по мере генерации
+        async with pending_reply(message, "🔄 Создаю документ...", action_menu) as reply:
+            result = await stream_to_message(
+                reply,
+                backend_service.stream_document(doc_type=doc_type, content=content),
+                lambda result: render_document(result, doc_type),
+            )
 
         history_service = get_history_service()
-        await history_service.add_record(
-            user_id=message.from_user.id,
+        await history_service.enqueue_record(
+            user_id=user_id,
             category="📑 Документы и письма",
             request_text=content,
-            response_text="\n\n".join(result.get("document", [])[:3]),
-            response_data=result,
+            response_text=result.get("document", ""),
+            # Тип нужен, чтобы показать или пересоздать документ из истории
+            response_data={**result, "doc_type": doc_type},
             message_id=message.message_id,
         )
+        await _offer_corrections(state, result)
 
-        document_text = result.get("document", "")
-        corrections = result.get("corrections", [])
-        suggestions = result.get("suggestions", [])
-
-        # Сохраняем сгенерированный документ для возможных исправлений
-        await state.update_data(
-            generated_document=document_text, corrections=corrections
+    except Exception as e:
+        await message.answer(
+            "❌ Ошибка при создании документа. Попробуйте еще раз.",
+            reply_markup=scenario_menu,
         )
+        await state.clear()
 
-        # Формируем ответ
-        response_text = f"✅ <b>{doc_type} создан!</b>\n\n"
-        response_text += f"{document_text}\n\n"
 
-        if corrections:
-            response_text += "⚠️ <b>Предлагаемые исправления:</b>\n"
-            for correction in corrections:
-                response_text += f"• {correction}\n"
-            response_text += "\nПрименить исправления?"
+def _stored_doc_type(record: dict) -> str:
+    """Тип документа записи истории (в старых записях не сохранялся)"""
+    return (record["response_data"] or {}).get("doc_type", DEFAULT_DOC_TYPE)
 
-        elif suggestions:
-            response_text += "💡 <b>Предложения по улучшению:</b>\n"
-            for suggestion in suggestions:
-                response_text += f"• {suggestion}\n"
 
-        await processing_msg.delete()
-        await message.answer(response_text, reply_markup=action_menu, parse_mode="HTML")
+async def show_document(message: Message, state: FSMContext, record: dict):
+    """Документ из записи истории, без обращения к бэкенду"""
+    doc_type = _stored_doc_type(record)
+    result = record["response_data"]
+    await send_reply(
+        message, render_document(result, doc_type), reply_markup=action_menu
+    )
+    await _offer_corrections(state, result)
 
-        if corrections:
-            await state.set_state(DocumentStates.waiting_for_corrections)
-        else:
-            await state.clear()
 
-    except Exception as e:
-        await message.answer(
-            "❌ Ошибка при создании документа. Попробуйте еще раз.",
-            reply_markup=scenario_menu,
-        )
-        await state.clear()
+async def regenerate_document(
+    message: Message, state: FSMContext, record: dict, user_id: int
+):
+    """Новый документ того же типа по содержанию из записи истории"""
+    await create_document(
+        message, state, _stored_doc_type(record), record["request_text"], user_id
+    )
 
 
 @router.message(DocumentStates.waiting_for_corrections)
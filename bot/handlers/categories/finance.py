@@ -2,12 +2,14 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from keyboards import action_menu, scenario_menu
-from services.ai_service import BackendService
+from services.ai_service import backend_service
 from services.history_service import get_history_service
+from services.inflight import latest_submission
+from services.replies import pending_reply, send_reply
 from states.finance_states import FinanceStates
+from states.payloads import FinanceDraft, load_payload, save_payload
 
 router = Router()
-backend_service = BackendService()
 
 
 @router.message(F.text == "📊 Финансы и аналитика")
@@ -22,66 +24,78 @@ async def finance_handler(message: Message, state: FSMContext):
     await state.set_state(FinanceStates.waiting_for_data)
 
 
+def render_analysis(result: dict) -> str:
+    """Ответ с финансовым анализом"""
+    analysis = result.get("analysis", "")
+    insights = result.get("insights", [])
+    recommendations = result.get("recommendations", [])
+
+    response_text = "📈 <b>Финансовый анализ:</b>\n\n"
+    response_text += f"{analysis}\n\n"
+
+    if insights:
+        response_text += "💡 <b>Ключевые инсайты:</b>\n"
+        for insight in insights:
+            response_text += f"• {insight}\n"
+        response_text += "\n"
+
+    if recommendations:
+        response_text += "🎯 <b>Рекомендации:</b>\n"
+        for recommendation in recommendations:
+            response_text += f"• {recommendation}\n"
+
+    response_text += "\nХотите получить сравнение с предыдущим периодом или прогноз?"
+    return response_text
+
+
+async def _offer_comparison(state: FSMContext, history_id: int):
+    """Дальнейшие анализы берут исходные данные из истории по ссылке"""
+    await save_payload(state, FinanceDraft(history_id))
+    await state.set_state(FinanceStates.waiting_for_comparison)
+
+
 @router.message(FinanceStates.waiting_for_data)
+@latest_submission("finance:data")
 async def process_finance_data(message: Message, state: FSMContext):
     """Обработка финансовых данных и анализ через бэкенд"""
-    financial_data = message.text
+    await analyze_data(message, state, message.text, message.from_user.id)
 
-    current_state = await state.get_state()
-    if current_state:
-        await state.clear()
 
-    processing_msg = await message.answer("🔄 Анализирую финансовые данные...")
+async def analyze_data(
+    message: Message, state: FSMContext, financial_data: str, user_id: int
+):
+    """Анализ финансовых данных с ответом в чат ``message``
 
+    Общий для нового запроса и повторной генерации из истории.
+    """
+    # Состояние не сбрасываем до ответа: уточнение данных, присланное во
+    # время анализа, должно попасть в этот же сценарий
     try:
-        # Вызываем бэкенд для анализа данных
-        result = await backend_service.analyze_finance_data(
-            data=financial_data, analysis_type="summary"
-        )
+        async with pending_reply(
+            message, "🔄 Анализирую финансовые данные...", scenario_menu
+        ) as reply:
+            # Вызываем бэкенд для анализа данных
+            result = await backend_service.analyze_finance_data(
+                data=financial_data, analysis_type="summary"
+            )
+
+            await reply.finish(render_analysis(result))
 
         history_service = get_history_service()
-        await history_service.add_record(
-            user_id=message.from_user.id,
+        # ID выдается сразу, сама запись идет через write-behind буфер
+        history_id = await history_service.enqueue_record(
+            user_id=user_id,
             category="📊 Финансы и аналитика",
             request_text=financial_data,
             response_text="\n\n".join(result.get("analysis", [])[:3]),
             response_data=result,
             message_id=message.message_id,
+            reserve_id=True,
         )
-
-        # Сохраняем данные для возможных дальнейших анализов
-        await state.set_data(
-            {"financial_data": financial_data, "initial_analysis": result}
-        )
-
-        # Формируем ответ
-        analysis = result.get("analysis", "")
-        insights = result.get("insights", [])
-        recommendations = result.get("recommendations", [])
-
-        response_text = "📈 <b>Финансовый анализ:</b>\n\n"
-        response_text += f"{analysis}\n\n"
-
-        if insights:
-            response_text += "💡 <b>Ключевые инсайты:</b>\n"
-            for insight in insights:
-                response_text += f"• {insight}\n"
-            response_text += "\n"
-
-        if recommendations:
-            response_text += "🎯 <b>Рекомендации:</b>\n"
-            for recommendation in recommendations:
-                response_text += f"• {recommendation}\n"
-
-        response_text += (
-            "\nХотите получить сравнение с предыдущим периодом или прогноз?"
-        )
-
-        await processing_msg.delete()
-        await message.answer(
-            response_text, reply_markup=scenario_menu, parse_mode="HTML"
-        )
-        await state.set_state(FinanceStates.waiting_for_comparison)
+        if history_id is None:
+            await state.clear()
+            return
+        await _offer_comparison(state, history_id)
 
     except Exception as e:
         await message.answer(
@@ -91,47 +105,63 @@ async def process_finance_data(message: Message, state: FSMContext):
         await state.clear()
 
 
+async def show_analysis(message: Message, state: FSMContext, record: dict):
+    """Анализ из записи истории, без обращения к бэкенду"""
+    await send_reply(
+        message, render_analysis(record["response_data"]), reply_markup=scenario_menu
+    )
+    await _offer_comparison(state, record["id"])
+
+
 @router.message(FinanceStates.waiting_for_comparison)
 async def process_comparison_choice(message: Message, state: FSMContext):
     """Обработка выбора типа дополнительного анализа"""
     user_choice = message.text.lower()
-    data = await state.get_data()
-    financial_data = data.get("financial_data", "")
-
-    processing_msg = await message.answer("🔄 Формирую отчет...")
+    draft = await load_payload(state, FinanceDraft)
+    record = None
+    if draft is not None:
+        record = await get_history_service().get_record(
+            draft.history_id, message.from_user.id
+        )
+    if not record:
+        await message.answer(
+            "Исходные данные больше недоступны. Отправьте их заново:",
+            reply_markup=scenario_menu,
+        )
+        await state.set_state(FinanceStates.waiting_for_data)
+        return
+    financial_data = record["request_text"]
+
+    if "сравнен" in user_choice:
+        analysis_type = "comparison"
+    elif "прогноз" in user_choice:
+        analysis_type = "forecast"
+    else:
+        await message.answer("Пожалуйста, выберите 'сравнение' или 'прогноз':")
+        return
 
     try:
-        if "сравнен" in user_choice:
-            analysis_type = "comparison"
+        async with pending_reply(message, "🔄 Формирую отчет...", action_menu) as reply:
             result = await backend_service.analyze_finance_data(
                 data=financial_data, analysis_type=analysis_type
             )
 
-            response_text = "📊 <b>Сравнительный анализ:</b>\n\n"
-            response_text += result.get("analysis", "")
+            if analysis_type == "comparison":
+                response_text = "📊 <b>Сравнительный анализ:</b>\n\n"
+                response_text += result.get("analysis", "")
 
-        elif "прогноз" in user_choice:
-            analysis_type = "forecast"
-            result = await backend_service.analyze_finance_data(
-                data=financial_data, analysis_type=analysis_type
-            )
-
-            response_text = "🔮 <b>Прогноз и тренды:</b>\n\n"
-            response_text += result.get("analysis", "")
+            else:
+                response_text = "🔮 <b>Прогноз и тренды:</b>\n\n"
+                response_text += result.get("analysis", "")
 
-            forecast = result.get("forecast", {})
-            if forecast:
-                response_text += (
-                    f"\n📈 <b>Тренд:</b> {forecast.get('trend', 'не определен')}"
-                )
-                response_text += f"\n📊 <b>Ожидаемый рост:</b> {forecast.get('growth', 'не определен')}"
-
-        else:
-            await message.answer("Пожалуйста, выберите 'сравнение' или 'прогноз':")
-            return
+                forecast = result.get("forecast", {})
+                if forecast:
+                    response_text += (
+                        f"\n📈 <b>Тренд:</b> {forecast.get('trend', 'не определен')}"
+                    )
+                    response_text += f"\n📊 <b>Ожидаемый рост:</b> {forecast.get('growth', 'не определен')}"
 
-        await processing_msg.delete()
-        await message.answer(response_text, reply_markup=action_menu, parse_mode="HTML")
+            await reply.finish(response_text)
         await state.clear()
 
     except Exception as e:
@@ -2,12 +2,13 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ContentType, Message
 from keyboards import action_menu, scenario_menu
-from services.ai_service import BackendService
+from services.ai_service import backend_service
 from services.history_service import get_history_service
+from services.inflight import latest_submission
+from services.replies import pending_reply, send_reply
 from states.legal_states import LegalStates
 
 router = Router()
-backend_service = BackendService()
 
 
 @router.message(F.text == "⚖️ Юридическая помощь")
@@ -23,11 +24,10 @@ async def legal_handler(message: Message, state: FSMContext):
 
 
 @router.message(LegalStates.waiting_for_contract)
+@latest_submission("legal:contract")
 async def process_contract_text(message: Message, state: FSMContext):
     """Обработка текста договора"""
-    contract_text = message.text
-
-    await _analyze_contract(message, state, contract_text)
+    await analyze_contract(message, state, message.text, message.from_user.id)
 
 
 @router.message(
@@ -43,60 +43,64 @@ async def process_contract_document(message: Message, state: FSMContext):
     )
 
 
-async def _analyze_contract(message: Message, state: FSMContext, contract_text: str):
-    """Общая функция анализа договора"""
-    processing_msg = await message.answer("🔄 Анализирую договор...")
+def render_contract_review(result: dict) -> str:
+    """Ответ с анализом договора"""
+    summary = result.get("summary", "")
+    risks = result.get("risks", [])
+    recommendations = result.get("recommendations", [])
+    todo_items = result.get("todo_items", [])
 
-    try:
-        # Вызываем бэкенд для анализа договора
-        result = await backend_service.analyze_contract(
-            contract_text=contract_text, analyze_risks=True
-        )
+    # Формируем ответ
+    response_text = "📑 <b>Анализ договора:</b>\n\n"
+    response_text += f"<b>Краткое содержание:</b>\n{summary}\n\n"
 
-        history_service = get_history_service()
-        await history_service.add_record(
-            user_id=message.from_user.id,
-            category="⚖️ Юридическая помощь",
-            request_text=contract_text,
-            response_text="\n\n".join(result.get("summary", [])[:3]),
-            response_data=result,
-            message_id=message.message_id,
-        )
+    if risks:
+        response_text += "⚠️ <b>Рисковые пункты:</b>\n"
+        for risk in risks:
+            response_text += f"• {risk}\n"
+        response_text += "\n"
 
-        summary = result.get("summary", "")
-        risks = result.get("risks", [])
-        recommendations = result.get("recommendations", [])
-        todo_items = result.get("todo_items", [])
+    if recommendations:
+        response_text += "🎯 <b>Рекомендации:</b>\n"
+        for recommendation in recommendations:
+            response_text += f"• {recommendation}\n"
+        response_text += "\n"
 
-        # Сохраняем результаты анализа
-        await state.update_data(contract_analysis=result, todo_items=todo_items)
+    if todo_items:
+        response_text += "📋 <b>To-Do пункты:</b>\n"
+        for item in todo_items:
+            response_text += f"• {item}\n"
 
-        # Формируем ответ
-        response_text = "📑 <b>Анализ договора:</b>\n\n"
-        response_text += f"<b>Краткое содержание:</b>\n{summary}\n\n"
+    response_text += "\nХотите добавить напоминание по срокам?"
+    return response_text
 
-        if risks:
-            response_text += "⚠️ <b>Рисковые пункты:</b>\n"
-            for risk in risks:
-                response_text += f"• {risk}\n"
-            response_text += "\n"
 
-        if recommendations:
-            response_text += "🎯 <b>Рекомендации:</b>\n"
-            for recommendation in recommendations:
-                response_text += f"• {recommendation}\n"
-            response_text += "\n"
+async def analyze_contract(
+    message: Message, state: FSMContext, contract_text: str, user_id: int
+):
+    """Анализ договора с ответом в чат ``message``
 
-        if todo_items:
-            response_text += "📋 <b>To-Do пункты:</b>\n"
-            for item in todo_items:
-                response_text += f"• {item}\n"
+    Общий для нового запроса и повторной генерации из истории.
+    """
+    try:
+        async with pending_reply(
+            message, "🔄 Анализирую договор...", scenario_menu
+        ) as reply:
+            # Вызываем бэкенд для анализа договора
+            result = await backend_service.analyze_contract(
+                contract_text=contract_text, analyze_risks=True
+            )
 
-        response_text += "\nХотите добавить напоминание по срокам?"
+            await reply.finish(render_contract_review(result))
 
-        await processing_msg.delete()
-        await message.answer(
-            response_text, reply_markup=scenario_menu, parse_mode="HTML"
+        history_service = get_history_service()
+        await history_service.enqueue_record(
+            user_id=user_id,
+            category="⚖️ Юридическая помощь",
+            request_text=contract_text,
+            response_text="\n\n".join(result.get("summary", [])[:3]),
+            response_data=result,
+            message_id=message.message_id,
         )
         await state.set_state(LegalStates.waiting_for_reminder)
 
@@ -108,6 +112,16 @@ async def _analyze_contract(message: Message, state: FSMContext, contract_text:
         await state.clear()
 
 
+async def show_contract_review(message: Message, state: FSMContext, record: dict):
+    """Анализ договора из записи истории, без обращения к бэкенду"""
+    await send_reply(
+        message,
+        render_contract_review(record["response_data"]),
+        reply_markup=scenario_menu,
+    )
+    await state.set_state(LegalStates.waiting_for_reminder)
+
+
 @router.message(LegalStates.waiting_for_reminder)
 async def process_reminder_choice(message: Message, state: FSMContext):
     """Обработка решения о напоминании"""
@@ -2,12 +2,14 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ContentType, Message
 from keyboards import action_menu, marketing_menu, scenario_menu
-from services.ai_service import BackendService
+from services.ai_service import backend_service
 from services.history_service import get_history_service
+from services.inflight import latest_submission
+from services.replies import pending_reply, send_reply
 from states.marketing_states import MarketingStates
+from states.payloads import MarketingDraft, load_payload, save_payload
 
 router = Router()
-backend_service = BackendService()
 
 
 @router.message(F.text == "💬 Маркетинг и контент")
@@ -22,57 +24,74 @@ async def marketing_handler(message: Message, state: FSMContext):
     await state.set_state(MarketingStates.waiting_for_idea)
 
 
+def render_posts(result: dict) -> str:
+    """Ответ с вариантами постов"""
+    post_variants = result.get("post_variants", [])
+    suggestions = result.get("suggestions", [])
+
+    # Формируем ответ с вариантами постов
+    response_text = "✅ <b>Вот варианты постов для вашей идеи:</b>\n\n"
+
+    for i, variant in enumerate(post_variants[:3], 1):  # Показываем первые 3 варианта
+        response_text += f"<b>Вариант {i}:</b>\n{variant}\n\n"
+
+    if suggestions:
+        response_text += "💡 <b>Предложения:</b>\n"
+        for suggestion in suggestions:
+            response_text += f"• {suggestion}\n"
+
+    response_text += "\nВыберите понравившийся вариант (напишите номер 1, 2 или 3) или создайте новый контент:"
+    return response_text
+
+
+async def _offer_variants(state: FSMContext, history_id: int, result: dict):
+    """Ожидание выбора варианта: в state только ссылка на запись истории"""
+    await save_payload(
+        state, MarketingDraft(history_id, len(result.get("post_variants", [])))
+    )
+    await state.set_state(MarketingStates.waiting_for_variant_selection)
+
+
 @router.message(MarketingStates.waiting_for_idea)
+@latest_submission("marketing:idea")
 async def process_idea(message: Message, state: FSMContext):
     """Обработка идеи пользователя и генерация постов через бэкенд"""
-    user_idea = message.text
+    await generate_posts(message, state, message.text, message.from_user.id)
 
-    processing_msg = await message.answer("🔄 Генерирую варианты постов...")
 
+async def generate_posts(
+    message: Message, state: FSMContext, user_idea: str, user_id: int
+):
+    """Генерация постов по идее с ответом в чат ``message``
+
+    Общая для нового запроса и повторной генерации из истории.
+    """
     try:
-        # Вызываем бэкенд для генерации постов
-        result = await backend_service.generate_marketing_posts(idea=user_idea)
+        async with pending_reply(
+            message, "🔄 Генерирую варианты постов...", marketing_menu
+        ) as reply:
+            # Вызываем бэкенд для генерации постов
+            result = await backend_service.generate_marketing_posts(idea=user_idea)
 
-        # Сохраняем варианты в state для следующего шага
-        post_variants = result.get("post_variants", [])
-        suggestions = result.get("suggestions", [])
+            # Заглушка "Генерирую..." становится ответом
+            await reply.finish(render_posts(result))
 
+        # Выбор варианта читает его из истории: в state только ссылка на запись
         history_service = get_history_service()
-        await history_service.add_record(
-            user_id=message.from_user.id,
+        # ID выдается сразу, сама запись идет через write-behind буфер
+        history_id = await history_service.enqueue_record(
+            user_id=user_id,
             category="💬 Маркетинг и контент",
             request_text=user_idea,
             response_text="\n\n".join(result.get("post_variants", [])[:3]),
             response_data=result,
             message_id=message.message_id,
+            reserve_id=True,
         )
-        await state.update_data(
-            post_variants=post_variants,
-            suggestions=suggestions,
-            original_idea=user_idea,
-        )
-
-        # Формируем ответ с вариантами постов
-        response_text = "✅ <b>Вот варианты постов для вашей идеи:</b>\n\n"
-
-        for i, variant in enumerate(
-            post_variants[:3], 1
-        ):  # Показываем первые 3 варианта
-            response_text += f"<b>Вариант {i}:</b>\n{variant}\n\n"
-
-        if suggestions:
-            response_text += "💡 <b>Предложения:</b>\n"
-            for suggestion in suggestions:
-                response_text += f"• {suggestion}\n"
-
-        response_text += "\nВыберите понравившийся вариант (напишите номер 1, 2 или 3) или создайте новый контент:"
-
-        # Удаляем сообщение "Генерирую..." и отправляем результат
-        await processing_msg.delete()
-        await message.answer(
-            response_text, reply_markup=marketing_menu, parse_mode="HTML"
-        )
-        await state.set_state(MarketingStates.waiting_for_variant_selection)
+        if history_id is None:
+            await state.clear()
+            return
+        await _offer_variants(state, history_id, result)
 
     except Exception as e:
         await message.answer(
@@ -82,19 +101,42 @@ async def process_idea(message: Message, state: FSMContext):
         await state.clear()
 
 
+async def show_posts(message: Message, state: FSMContext, record: dict):
+    """Варианты постов из записи истории, без обращения к бэкенду"""
+    result = record["response_data"]
+    await send_reply(message, render_posts(result), reply_markup=marketing_menu)
+    await _offer_variants(state, record["id"], result)
+
+
+async def _variants_unavailable(message: Message, state: FSMContext):
+    """Запись с вариантами удалена или не сохранилась"""
+    await message.answer(
+        "Варианты постов больше недоступны. Создайте новый контент:",
+        reply_markup=marketing_menu,
+    )
+    await state.clear()
+
+
 @router.message(MarketingStates.waiting_for_variant_selection)
 async def process_variant_selection(message: Message, state: FSMContext):
     """Обработка выбора варианта поста"""
     user_input = message.text.strip()
 
-    # Получаем сохраненные данные
-    data = await state.get_data()
-    post_variants = data.get("post_variants", [])
+    draft = await load_payload(state, MarketingDraft)
+    if draft is None:
+        await _variants_unavailable(message, state)
+        return
 
     # Проверяем, выбрал ли пользователь номер варианта
-    if user_input.isdigit() and 1 <= int(user_input) <= len(post_variants):
+    if user_input.isdigit() and 1 <= int(user_input) <= draft.variants:
         selected_index = int(user_input) - 1
-        selected_post = post_variants[selected_index]
+        record = await get_history_service().get_record(
+            draft.history_id, message.from_user.id, include_data=True
+        )
+        if not record or not record["response_data"]:
+            await _variants_unavailable(message, state)
+            return
+        selected_post = record["response_data"]["post_variants"][selected_index]
 
         await message.answer(
             f"✅ <b>Вы выбрали вариант {user_input}:</b>\n\n{selected_post}\n\n"
@@ -103,8 +145,6 @@ async def process_variant_selection(message: Message, state: FSMContext):
             parse_mode="HTML",
         )
 
-        # Сохраняем выбранный пост для возможных дальнейших действий
-        await state.update_data(selected_post=selected_post)
         await state.clear()
 
     else:
@@ -126,25 +166,26 @@ async def stories_handler(message: Message, state: FSMContext):
 
 
 @router.message(MarketingStates.waiting_for_stories_idea)
+@latest_submission("marketing:stories")
 async def process_stories_idea(message: Message, state: FSMContext):
     """Обработка идеи для сторис и генерация через бэкенд"""
     idea = message.text
 
-    processing_msg = await message.answer("🔄 Генерирую сторис/баннер...")
-
     try:
-        # Вызываем бэкенд для генерации сторис
-        result = await backend_service.generate_stories(idea=idea)
-        stories = result.get("stories", [])
+        async with pending_reply(
+            message, "🔄 Генерирую сторис/баннер...", action_menu
+        ) as reply:
+            # Вызываем бэкенд для генерации сторис
+            result = await backend_service.generate_stories(idea=idea)
+            stories = result.get("stories", [])
 
-        response_text = "🎨 <b>Варианты сторис/баннеров:</b>\n\n"
-        for i, story in enumerate(stories, 1):
-            response_text += f"<b>Вариант {i}:</b>\n{story}\n\n"
+            response_text = "🎨 <b>Варианты сторис/баннеров:</b>\n\n"
+            for i, story in enumerate(stories, 1):
+                response_text += f"<b>Вариант {i}:</b>\n{story}\n\n"
 
-        response_text += "Выберите действие:"
+            response_text += "Выберите действие:"
 
-        await processing_msg.delete()
-        await message.answer(response_text, reply_markup=action_menu, parse_mode="HTML")
+            await reply.finish(response_text)
         await state.clear()
 
     except Exception as e:
@@ -2,12 +2,14 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from keyboards import action_menu, scenario_menu
-from services.ai_service import BackendService
+from services.ai_service import backend_service
 from services.history_service import get_history_service
+from services.inflight import latest_submission
+from services.message_stream import stream_to_message
+from services.replies import pending_reply, send_reply
 from states.meetings_states import MeetingsStates
 
 router = Router()
-backend_service = BackendService()
 
 
 @router.message(F.text == "📝 Краткие итоги встреч")
@@ -22,47 +24,63 @@ async def meetings_handler(message: Message, state: FSMContext):
     await state.set_state(MeetingsStates.waiting_for_meeting_text)
 
 
+def render_meeting_summary(result: dict) -> str:
+    """Ответ с итогами встречи"""
+    key_points = result.get("suggestions", [])
+
+    # Формируем ответ
+    response_text = "📋 <b>Краткие итоги встречи:</b>\n\n"
+    response_text += f"{result.get('document', '')}\n\n"
+
+    if key_points:
+        response_text += "🎯 <b>Ключевые моменты:</b>\n"
+        for point in key_points:
+            response_text += f"• {point}\n"
+
+    response_text += (
+        "\nРезюме готово! Вы можете сохранить его или отправить участникам."
+    )
+    return response_text
+
+
 @router.message(MeetingsStates.waiting_for_meeting_text)
+@latest_submission("meetings:text")
 async def process_meeting_text(message: Message, state: FSMContext):
     """Обработка текста встречи и создание резюме"""
-    meeting_text = message.text
+    await summarize_meeting(message, state, message.text, message.from_user.id)
+
 
-    processing_msg = await message.answer("🔄 Создаю краткое резюме встречи...")
+async def summarize_meeting(
+    message: Message, state: FSMContext, meeting_text: str, user_id: int
+):
+    """Резюме встречи с ответом в чат ``message``
 
+    Общее для нового запроса и повторной генерации из истории.
+    """
     try:
         # Используем сервис документов для создания резюме
-        result = await backend_service.generate_document(
-            doc_type="краткое резюме встречи", content=meeting_text, style="structured"
-        )
+        async with pending_reply(
+            message, "🔄 Создаю краткое резюме встречи...", action_menu
+        ) as reply:
+            result = await stream_to_message(
+                reply,
+                backend_service.stream_document(
+                    doc_type="краткое резюме встречи",
+                    content=meeting_text,
+                    style="structured",
+                ),
+                render_meeting_summary,
+            )
 
         history_service = get_history_service()
-        await history_service.add_record(
-            user_id=message.from_user.id,
+        await history_service.enqueue_record(
+            user_id=user_id,
             category="📝 Краткие итоги встреч",
             request_text=meeting_text,
-            response_text="\n\n".join(result.get("document", [])[:3]),
+            response_text=result.get("document", ""),
             response_data=result,
             message_id=message.message_id,
         )
-
-        summary = result.get("document", "")
-        key_points = result.get("suggestions", [])
-
-        # Формируем ответ
-        response_text = "📋 <b>Краткие итоги встречи:</b>\n\n"
-        response_text += f"{summary}\n\n"
-
-        if key_points:
-            response_text += "🎯 <b>Ключевые моменты:</b>\n"
-            for point in key_points:
-                response_text += f"• {point}\n"
-
-        response_text += (
-            "\nРезюме готово! Вы можете сохранить его или отправить участникам."
-        )
-
-        await processing_msg.delete()
-        await message.answer(response_text, reply_markup=action_menu, parse_mode="HTML")
         await state.clear()
 
     except Exception as e:
@@ -71,3 +89,13 @@ async def process_meeting_text(message: Message, state: FSMContext):
             reply_markup=scenario_menu,
         )
         await state.clear()
+
+
+async def show_meeting_summary(message: Message, state: FSMContext, record: dict):
+    """Итоги встречи из записи истории, без обращения к бэкенду"""
+    await send_reply(
+        message,
+        render_meeting_summary(record["response_data"]),
+        reply_markup=action_menu,
+    )
+    await state.clear()
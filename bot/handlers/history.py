@@ -1,26 +1,49 @@
+import html
 import logging
 import math
+from datetime import datetime
 
 from aiogram import F, Router
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.types import CallbackQuery, Message
-from keyboards import get_history_detail_keyboard, get_history_keyboard
-from services.history_service import get_history_service
+from aiogram.types import CallbackQuery, FSInputFile, Message
+from handlers.categories import documents, finance, legal, marketing, meetings
+from keyboards import (
+    get_history_detail_keyboard,
+    get_history_keyboard,
+    get_history_search_keyboard,
+)
+from services.ai_service import fresh_generation
+from services.dispatcher import release_lane
+from services.history_export import (
+    EXPORT_FORMATS,
+    TELEGRAM_DOCUMENT_LIMIT,
+    history_export,
+)
+from services.history_service import (
+    SEARCH_HIGHLIGHT_START,
+    SEARCH_HIGHLIGHT_STOP,
+    get_history_service,
+)
+from services.outbound import bulk_sends
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 PAGE_SIZE = 5
+SEARCH_LIMIT = 5
 
 
 @router.message(F.text == "🕓 История")
-async def history_handler(message: Message):
+async def history_handler(message: Message, user_id: int = None):
     """Показать историю запросов"""
     try:
         history_service = get_history_service()
-        user_id = message.from_user.id
+        user_id = user_id or message.from_user.id
 
-        records = await history_service.get_user_history(user_id, limit=PAGE_SIZE)
+        records, total_count = await history_service.get_history_page(
+            user_id, limit=PAGE_SIZE
+        )
 
         if not records:
             await message.answer(
@@ -28,7 +51,6 @@ async def history_handler(message: Message):
             )
             return
 
-        total_count = await history_service.get_total_count(user_id)
         total_pages = math.ceil(total_count / PAGE_SIZE)
 
         # Create the keyboard first to ensure it's valid
@@ -51,24 +73,137 @@ async def history_handler(message: Message):
         )
 
 
+def _highlight(snippet: str) -> str:
+    """Экранирование фрагмента для HTML и выделение совпадений жирным"""
+    return (
+        html.escape(snippet)
+        .replace(SEARCH_HIGHLIGHT_START, "<b>")
+        .replace(SEARCH_HIGHLIGHT_STOP, "</b>")
+    )
+
+
+@router.message(Command("search"))
+async def history_search_handler(message: Message, command: CommandObject):
+    """Поиск по истории: /search <запрос>"""
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "🔎 Поиск по истории: <code>/search текст запроса</code>\n\n"
+            'Можно искать фразу в кавычках, например <code>/search "договор поставки"</code>, '
+            "и исключать слова минусом: <code>/search договор -аренда</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    try:
+        history_service = get_history_service()
+        results = await history_service.search_history(
+            message.from_user.id, query, limit=SEARCH_LIMIT
+        )
+
+        if not results:
+            await message.answer("🔎 Ничего не найдено. Попробуйте другие слова.")
+            return
+
+        lines = [f"🔎 <b>Найдено по запросу «{html.escape(query)}»:</b>\n"]
+        for number, record in enumerate(results, start=1):
+            lines.append(
+                f"{number}. <b>{html.escape(record['category'])}</b> - {record['created_at']}\n"
+                f"{_highlight(record['snippet'])}\n"
+            )
+
+        await message.answer(
+            "\n".join(lines),
+            reply_markup=get_history_search_keyboard(results),
+            parse_mode="HTML",
+        )
+    except Exception as e:
+        logger.error(f"Error in history search handler: {e}")
+        await message.answer("❌ Произошла ошибка при поиске. Попробуйте позже.")
+
+
+@router.message(Command("export"))
+async def history_export_handler(message: Message, command: CommandObject):
+    """Выгрузка всей истории файлом: /export [jsonl|csv]"""
+    fmt = (command.args or "jsonl").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer(
+            "📦 Выгрузка истории: <code>/export</code> (JSONL) или "
+            "<code>/export csv</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    # Выгрузка большой истории долгая: следующие сообщения пользователя не ждут ее
+    release_lane()
+    progress = await message.answer("⏳ Готовлю выгрузку истории...")
+    try:
+        exported = await history_export.export(message.from_user.id, fmt)
+    except Exception as e:
+        logger.error(f"Error in history export handler: {e}")
+        await progress.edit_text("❌ Не удалось выгрузить историю. Попробуйте позже.")
+        return
+
+    if exported is None:
+        await progress.edit_text("⏳ Выгрузка истории уже готовится.")
+        return
+
+    path, rows = exported
+    try:
+        if not rows:
+            await progress.edit_text("📚 История запросов пуста.")
+        elif path.stat().st_size > TELEGRAM_DOCUMENT_LIMIT:
+            await progress.edit_text(
+                "❌ Выгрузка больше 50 МБ, Telegram не примет такой файл."
+            )
+        else:
+            # Файл отправляется потоком с диска и уступает очередь ответам
+            with bulk_sends():
+                await message.answer_document(
+                    FSInputFile(
+                        path, filename=f"history-{datetime.now():%Y%m%d}.{fmt}.gz"
+                    ),
+                    caption=f"📦 История запросов: {rows} записей",
+                )
+            await progress.delete()
+    except Exception as e:
+        logger.error(f"Error sending history export: {e}")
+        await message.answer("❌ Не удалось отправить выгрузку. Попробуйте позже.")
+    finally:
+        path.unlink(missing_ok=True)
+
+
 @router.callback_query(F.data.startswith("history_page:"))
 async def history_page_handler(callback: CallbackQuery):
-    """Обработка переключения страниц истории"""
+    """Обработка переключения страниц истории
+
+    callback data: history_page:<страница>:<всего страниц>:<o|n>:<курсор>
+    """
     try:
-        page = int(callback.data.split(":")[1])
+        parts = callback.data.split(":")
+        if len(parts) == 5:
+            _, page, total_pages, direction, cursor = parts
+            page, total_pages = int(page), int(total_pages)
+        else:
+            # Кнопки старого формата (history_page:<страница>) ведут в начало
+            page, total_pages, direction, cursor = 0, 1, "o", None
         user_id = callback.from_user.id
         history_service = get_history_service()
 
-        records = await history_service.get_user_history(
-            user_id, limit=PAGE_SIZE, offset=page * PAGE_SIZE
-        )
-
-        total_count = await history_service.get_total_count(user_id)
-        total_pages = math.ceil(total_count / PAGE_SIZE)
+        if page == 0:
+            # Первая страница всегда свежая: с новыми записями и пересчетом
+            records, total_count = await history_service.get_history_page(
+                user_id, limit=PAGE_SIZE
+            )
+            total_pages = math.ceil(total_count / PAGE_SIZE)
+        else:
+            records, _ = await history_service.get_history_page(
+                user_id, limit=PAGE_SIZE, cursor=cursor, newer=direction == "n"
+            )
 
         await callback.message.edit_reply_markup(
             reply_markup=get_history_keyboard(
-                records, current_page=page, total_pages=total_pages
+                records, current_page=page, total_pages=max(total_pages, page + 1)
             )
         )
         await callback.answer()
@@ -111,137 +246,110 @@ async def history_detail_handler(callback: CallbackQuery):
         await callback.answer("❌ Ошибка при загрузке записи")
 
 
+def _from_request(generate):
+    """Новая генерация по тексту запроса записи"""
+
+    async def regenerate(
+        message: Message, state: FSMContext, record: dict, user_id: int
+    ):
+        await generate(message, state, record["request_text"], user_id)
+
+    return regenerate
+
+
+# Категория записи истории -> (показ сохраненного результата, новая генерация)
+CATEGORY_REPLAYS = {
+    "💬 Маркетинг и контент": (
+        marketing.show_posts,
+        _from_request(marketing.generate_posts),
+    ),
+    "📊 Финансы и аналитика": (
+        finance.show_analysis,
+        _from_request(finance.analyze_data),
+    ),
+    "📑 Документы и письма": (
+        documents.show_document,
+        documents.regenerate_document,
+    ),
+    "⚖️ Юридическая помощь": (
+        legal.show_contract_review,
+        _from_request(legal.analyze_contract),
+    ),
+    "📝 Краткие итоги встреч": (
+        meetings.show_meeting_summary,
+        _from_request(meetings.summarize_meeting),
+    ),
+}
+
+
+async def _regenerate(
+    callback: CallbackQuery, state: FSMContext, record: dict, regenerate
+):
+    """Новая генерация по запросу записи: ответ и новая запись истории"""
+    # Генерация ждет только бэкенд: следующие сообщения пользователя не ждут ее
+    release_lane()
+    # Без нового ключа бэкенд вернул бы сохраненный ответ на тот же запрос
+    with fresh_generation():
+        await regenerate(callback.message, state, record, callback.from_user.id)
+
+
 @router.callback_query(F.data.startswith("history_repeat:"))
 async def history_repeat_handler(callback: CallbackQuery, state: FSMContext):
-    """Повторить запрос из истории"""
+    """Повторить ответ из истории без обращения к бэкенду"""
     try:
         record_id = int(callback.data.split(":")[1])
-        user_id = callback.from_user.id
-        history_service = get_history_service()
-
-        record = await history_service.get_record(record_id, user_id)
+        record = await get_history_service().get_record(
+            record_id, callback.from_user.id, include_data=True
+        )
 
         if not record:
             await callback.answer("Запись не найдена")
             return
 
-        # Сохраняем оригинальный запрос для повторения
-        await state.update_data(
-            history_original_request=record["request_text"],
-            history_category=record["category"],
-        )
-
-        # Перенаправляем в соответствующую категорию
-        category_handlers = {
-            "💬 Маркетинг и контент": marketing_repeat,
-            "📊 Финансы и аналитика": finance_repeat,
-            "📑 Документы и письма": documents_repeat,
-            "⚖️ Юридическая помощь": legal_repeat,
-            "📝 Краткие итоги встреч": meetings_repeat,
-        }
-
-        handler = category_handlers.get(record["category"])
-        if handler:
-            await handler(callback, record)
-        else:
+        replay = CATEGORY_REPLAYS.get(record["category"])
+        if replay is None:
             await callback.answer("❌ Неизвестная категория")
+            return
+
+        show, regenerate = replay
+        if not record["response_data"]:
+            # Старые записи без структурированного результата - только заново
+            await callback.answer()
+            await _regenerate(callback, state, record, regenerate)
+            return
+
+        await show(callback.message, state, record)
+        await callback.answer()
 
     except Exception as e:
         logger.error(f"Error in history repeat handler: {e}")
         await callback.answer("❌ Ошибка при повторении запроса")
 
 
-async def marketing_repeat(callback: CallbackQuery, record: dict):
-    """Повторение маркетингового запроса"""
-    from handlers.categories.marketing import process_idea
-
-    await callback.message.answer(
-        f"🔄 Повторяю запрос в категории 'Маркетинг и контент':\n\n"
-        f"<i>{record['request_text']}</i>",
-        parse_mode="HTML",
-    )
-
-    # Создаем fake message для вызова обработчика
-    class FakeMessage:
-        def __init__(self, text, user_id):
-            self.text = text
-            self.from_user = type("User", (), {"id": user_id})()
-            self.answer = callback.message.answer
-            self.reply_markup = None
-
-    fake_msg = FakeMessage(record["request_text"], callback.from_user.id)
-    await process_idea(fake_msg, callback.message._bot.current_state())
-    await callback.answer()
-
-
-async def finance_repeat(callback: CallbackQuery, record: dict):
-    """Повторение финансового запроса"""
-    from handlers.categories.finance import process_finance_data
-
-    await callback.message.answer(
-        f"🔄 Повторяю запрос в категории 'Финансы и аналитика':\n\n"
-        f"<i>{record['request_text']}</i>",
-        parse_mode="HTML",
-    )
-
-    class FakeMessage:
-        def __init__(self, text, user_id):
-            self.text = text
-            self.from_user = type("User", (), {"id": user_id})()
-            self.answer = callback.message.answer
-
-    fake_msg = FakeMessage(record["request_text"], callback.from_user.id)
-    await process_finance_data(fake_msg, callback.message._bot.current_state())
-    await callback.answer()
-
-
-# Аналогичные функции для других категорий...
-async def documents_repeat(callback: CallbackQuery, record: dict):
-    from keyboards import document_types_menu
-
-    await callback.message.answer(
-        "🔄 Для повторения создания документа выберите тип документа:",
-        reply_markup=document_types_menu,
-    )
-    await callback.answer()
-
-
-async def legal_repeat(callback: CallbackQuery, record: dict):
-    from handlers.categories.legal import process_contract_text
-
-    await callback.message.answer(
-        f"🔄 Повторяю анализ договора:\n\n<i>{record['request_text'][:500]}...</i>",
-        parse_mode="HTML",
-    )
-
-    class FakeMessage:
-        def __init__(self, text, user_id):
-            self.text = text
-            self.from_user = type("User", (), {"id": user_id})()
-            self.answer = callback.message.answer
-
-    fake_msg = FakeMessage(record["request_text"], callback.from_user.id)
-    await process_contract_text(fake_msg, callback.message._bot.current_state())
-    await callback.answer()
-
+@router.callback_query(F.data.startswith("history_regenerate:"))
+async def history_regenerate_handler(callback: CallbackQuery, state: FSMContext):
+    """Сгенерировать ответ на запрос из истории заново"""
+    try:
+        record_id = int(callback.data.split(":")[1])
+        record = await get_history_service().get_record(
+            record_id, callback.from_user.id, include_data=True
+        )
 
-async def meetings_repeat(callback: CallbackQuery, record: dict):
-    from handlers.categories.meetings import process_meeting_text
+        if not record:
+            await callback.answer("Запись не найдена")
+            return
 
-    await callback.message.answer(
-        f"🔄 Повторяю создание резюме встречи:\n\n<i>{record['request_text']}</i>",
-        parse_mode="HTML",
-    )
+        replay = CATEGORY_REPLAYS.get(record["category"])
+        if replay is None:
+            await callback.answer("❌ Неизвестная категория")
+            return
 
-    class FakeMessage:
-        def __init__(self, text, user_id):
-            self.text = text
-            self.from_user = type("User", (), {"id": user_id})()
-            self.answer = callback.message.answer
+        await callback.answer()
+        await _regenerate(callback, state, record, replay[1])
 
-    fake_msg = FakeMessage(record["request_text"], callback.from_user.id)
-    await process_meeting_text(fake_msg, callback.message._bot.current_state())
-    await callback.answer()
+    except Exception as e:
+        logger.error(f"Error in history regenerate handler: {e}")
+        await callback.answer("❌ Ошибка при генерации ответа")
 
 
 @router.callback_query(F.data.startswith("history_show:"))
@@ -278,7 +386,7 @@ async def history_show_handler(callback: CallbackQuery):
 @router.callback_query(F.data == "history_back")
 async def history_back_handler(callback: CallbackQuery):
     """Вернуться к списку истории"""
-    await history_handler(callback.message)
+    await history_handler(callback.message, user_id=callback.from_user.id)
     await callback.answer()
 
 
@@ -294,7 +402,7 @@ async def history_delete_handler(callback: CallbackQuery):
 
         if success:
             await callback.answer("Запись удалена")
-            await history_handler(callback.message)
+            await history_handler(callback.message, user_id=callback.from_user.id)
         else:
             await callback.answer("Ошибка удаления")
     except Exception as e:
@@ -92,12 +92,14 @@ def get_history_keyboard(history_records, current_page=0, total_pages=1):
             ]
         )
 
-    # Навигация
+    # Навигация: курсор первой/последней записи страницы (keyset-пагинация)
     nav_buttons = []
-    if current_page > 0:
+    if current_page > 0 and history_records:
         nav_buttons.append(
             InlineKeyboardButton(
-                text="⬅️ Назад", callback_data=f"history_page:{current_page - 1}"
+                text="⬅️ Назад",
+                callback_data=f"history_page:{current_page - 1}:{total_pages}:n:"
+                f"{history_records[0]['cursor']}",
             )
         )
 
@@ -107,10 +109,12 @@ def get_history_keyboard(history_records, current_page=0, total_pages=1):
         )
     )
 
-    if current_page < total_pages - 1:
+    if current_page < total_pages - 1 and history_records:
         nav_buttons.append(
             InlineKeyboardButton(
-                text="Вперед ➡️", callback_data=f"history_page:{current_page + 1}"
+                text="Вперед ➡️",
+                callback_data=f"history_page:{current_page + 1}:{total_pages}:o:"
+                f"{history_records[-1]['cursor']}",
             )
         )
 
@@ -124,6 +128,24 @@ def get_history_keyboard(history_records, current_page=0, total_pages=1):
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+# Клавиатура результатов поиска по истории
+def get_history_search_keyboard(search_results):
+    """Кнопки найденных записей в порядке релевантности"""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                text=f"{number}. {record['category']} - {record['created_at']}",
+                callback_data=f"history_detail:{record['id']}",
+            )
+        ]
+        for number, record in enumerate(search_results, start=1)
+    ]
+    keyboard.append(
+        [InlineKeyboardButton(text="❌ Закрыть", callback_data="history_close")]
+    )
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
 # Клавиатура для детального просмотра записи
 def get_history_detail_keyboard(record_id, has_response=True):
     """Клавиатура для работы с конкретной записью"""
@@ -134,7 +156,7 @@ def get_history_detail_keyboard(record_id, has_response=True):
             [
                 [
                     InlineKeyboardButton(
-                        text="🔄 Повторить запрос",
+                        text="🔄 Повторить ответ",
                         callback_data=f"history_repeat:{record_id}",
                     )
                 ],
@@ -147,6 +169,16 @@ def get_history_detail_keyboard(record_id, has_response=True):
             ]
         )
 
+    # Новая генерация по тому же запросу - отдельным действием
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                text="♻️ Сгенерировать заново",
+                callback_data=f"history_regenerate:{record_id}",
+            )
+        ]
+    )
+
     keyboard.append(
         [
             InlineKeyboardButton(
@@ -2,8 +2,7 @@ import asyncio
 import logging
 import os
 
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram import Bot
 from dotenv import load_dotenv
 
 # Настройка логирования
@@ -14,14 +13,28 @@ _ = load_dotenv()
 
 TOKEN = os.getenv("TOKEN", "1234:token")
 
-# Используем MemoryStorage для состояний
-storage = MemoryStorage()
+from services.ai_service import RequestOriginMiddleware
+from services.dispatcher import create_dispatcher
+from services.fsm_storage import create_fsm_storage
+from services.outbound import outbound_scheduler
+
+# Хранилище состояний по FSM_STORAGE (memory, postgres или redis)
+storage = create_fsm_storage()
 bot = Bot(TOKEN)
-dp = Dispatcher(storage=storage)
+# Все запросы к чатам проходят через общую очередь с лимитами Telegram
+bot.session.middleware(outbound_scheduler)
+# DISPATCH_MODE=sharded (по умолчанию): обновления пользователя по порядку,
+# пользователи параллельно; default - обработка aiogram без порядка
+dp = create_dispatcher(storage=storage)
+# Ключи идемпотентности запросов к бэкенду - по исходному сообщению
+dp.update.outer_middleware(RequestOriginMiddleware())
 
 # Регистрируем все роутеры
 from handlers import history, menu, start
 from handlers.categories import documents, finance, legal, marketing, meetings
+from services.ai_service import backend_service
+from services.history_maintenance import history_maintenance
+from services.history_service import close_history_service, get_history_service
 
 dp.include_router(start.router)
 dp.include_router(menu.router)
@@ -33,10 +46,57 @@ dp.include_router(legal.router)
 dp.include_router(meetings.router)
 
 
+async def on_startup():
+    """Проверка схемы истории, прогрев пулов и обслуживание партиций
+
+    Без примененных миграций бот не запускается, а соединения с БД и
+    бэкендом открываются до первого запроса пользователя.
+    """
+    history_service = get_history_service()
+    await history_service.initialize()
+    await history_service.warm_up()
+    await backend_service.warm_up()
+    history_maintenance.start()
+
+
+async def on_shutdown():
+    """Дописываем буфер истории и закрываем пулы соединений"""
+    await history_maintenance.stop()
+    await close_history_service()
+    await backend_service.close()
+    await outbound_scheduler.stop()
+
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
 async def main():
     logger.info("🤖 Alfapilot Bot started...")
     await dp.start_polling(bot)
 
 
+def run_webhook():
+    """Вебхук за балансировщиком; реплик может быть несколько"""
+    from aiohttp import web
+    from webhook import build_webhook_app
+
+    if os.getenv("FSM_STORAGE", "memory").lower() == "memory":
+        logger.warning(
+            "FSM_STORAGE=memory keeps conversations in one replica, "
+            "use postgres or redis behind a load balancer"
+        )
+    logger.info("🤖 Alfapilot Bot started in webhook mode...")
+    web.run_app(
+        build_webhook_app(dp, bot),
+        host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", "8080")),
+    )
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Polling по умолчанию - для локальной разработки
+    if os.getenv("BOT_MODE", "polling").lower() == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,45 @@
+import asyncio
+import os
+from logging.config import fileConfig
+
+from alembic import context
+from dotenv import load_dotenv
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from services.history_service import HistoryService
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+_ = load_dotenv()
+
+
+def _run_migrations(connection):
+    # Каждая ревизия в своей транзакции: прерванный upgrade продолжится
+    # со следующей непримененной
+    context.configure(connection=connection, transaction_per_migration=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        raise Exception("DATABASE_URL environment variable is required")
+
+    engine = create_async_engine(
+        HistoryService._async_url(db_url), poolclass=pool.NullPool
+    )
+    async with engine.connect() as connection:
+        await connection.run_sync(_run_migrations)
+    await engine.dispose()
+
+
+# Ревизии проверяют текущую схему (ее могли создать версии бота до Alembic),
+# поэтому SQL-скрипт без подключения (--sql) не поддерживается
+if context.is_offline_mode():
+    raise Exception("Offline migrations are not supported, run against the database")
+
+asyncio.run(run_migrations_online())
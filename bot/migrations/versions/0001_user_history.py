@@ -0,0 +1,69 @@
+"""Таблица истории запросов user_history
+
+Базовая ревизия. Версии бота до Alembic создавали и меняли схему сами при
+запуске, поэтому эта и следующие ревизии проверяют текущее состояние
+таблицы и доводят до нужного любую из прежних схем; на уже актуальной
+схеме они ничего не меняют.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-03 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _column_type(bind, column):
+    return bind.execute(
+        sa.text(
+            """
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'user_history' AND column_name = :column
+        """
+        ),
+        {"column": column},
+    ).scalar()
+
+
+def upgrade():
+    bind = op.get_bind()
+    exists = bind.execute(
+        sa.text("SELECT to_regclass('user_history') IS NOT NULL")
+    ).scalar()
+
+    if not exists:
+        # Месячные партиции по created_at; ключ партиционирования
+        # обязан входить в первичный ключ
+        op.execute(
+            """
+            CREATE TABLE user_history (
+                id SERIAL,
+                user_id BIGINT NOT NULL,
+                category VARCHAR(100) NOT NULL,
+                request_text TEXT NOT NULL,
+                response_text TEXT,
+                response_data JSONB,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                message_id BIGINT,
+                request_preview VARCHAR(103),
+                response_preview VARCHAR(153),
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+        """
+        )
+        op.execute("CREATE INDEX idx_created_at ON user_history(created_at)")
+        return
+
+    # Telegram ID не помещаются в INTEGER
+    for column in ("user_id", "message_id"):
+        if _column_type(bind, column) == "integer":
+            op.execute(f"ALTER TABLE user_history ALTER COLUMN {column} TYPE BIGINT")
+
+
+def downgrade():
+    op.execute("DROP TABLE user_history")
@@ -0,0 +1,63 @@
+"""Превью записей и покрывающий индекс списка истории
+
+Список истории читается index-only scan по (user_id, created_at DESC,
+id DESC) INCLUDE (...) без полных TEXT-столбцов. Старые индексы по user_id
+являются префиксами нового и только замедляют вставки.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-11-03 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+_BACKFILL_PREVIEWS = sa.text(
+    """
+    UPDATE user_history
+    SET request_preview = CASE
+            WHEN length(request_text) > 100 THEN left(request_text, 100) || '...'
+            ELSE request_text END,
+        response_preview = CASE
+            WHEN length(response_text) > 150 THEN left(response_text, 150) || '...'
+            ELSE coalesce(response_text, '') END
+    WHERE request_preview IS NULL
+"""
+)
+
+
+def upgrade():
+    op.execute(
+        """
+        ALTER TABLE user_history
+        ADD COLUMN IF NOT EXISTS request_preview VARCHAR(103),
+        ADD COLUMN IF NOT EXISTS response_preview VARCHAR(153)
+    """
+    )
+    op.get_bind().execute(_BACKFILL_PREVIEWS)
+
+    op.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_history_listing
+        ON user_history (user_id, created_at DESC, id DESC)
+        INCLUDE (category, message_id, request_preview, response_preview)
+    """
+    )
+    op.execute("DROP INDEX IF EXISTS idx_user_id")
+    op.execute("DROP INDEX IF EXISTS idx_user_history_user_created")
+
+
+def downgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON user_history(user_id)")
+    op.execute("DROP INDEX IF EXISTS idx_user_history_listing")
+    op.execute(
+        """
+        ALTER TABLE user_history
+        DROP COLUMN IF EXISTS request_preview,
+        DROP COLUMN IF EXISTS response_preview
+    """
+    )
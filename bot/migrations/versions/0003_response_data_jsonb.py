@@ -0,0 +1,113 @@
+"""response_data как JSONB вместо str(dict) в TEXT
+
+Старые значения разбираются ast.literal_eval пачками по первичному ключу;
+строки, которые не являются Python-литералом, сохраняются как JSON-строка.
+Откат возвращает столбцу тип TEXT с JSON-текстом значений (не str(dict)).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-11-03 12:00:00
+"""
+import ast
+import json
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+BATCH = 1000
+
+_SELECT_LEGACY = sa.text(
+    """
+    SELECT id, response_data_legacy
+    FROM user_history
+    WHERE id > :after AND response_data_legacy IS NOT NULL
+    ORDER BY id
+    LIMIT :batch
+"""
+)
+_UPDATE_RESPONSE_DATA = sa.text(
+    """
+    UPDATE user_history
+    SET response_data = CAST(:response_data AS JSONB), response_data_legacy = NULL
+    WHERE id = :id
+"""
+)
+
+
+def _parse(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = dict(
+        bind.execute(
+            sa.text(
+                """
+                SELECT column_name, data_type
+                FROM information_schema.columns
+                WHERE table_name = 'user_history'
+                  AND column_name IN ('response_data', 'response_data_legacy')
+            """
+            )
+        ).fetchall()
+    )
+
+    if columns.get("response_data") == "text":
+        op.execute(
+            "ALTER TABLE user_history RENAME COLUMN response_data TO response_data_legacy"
+        )
+        op.execute("ALTER TABLE user_history ADD COLUMN response_data JSONB")
+        columns["response_data_legacy"] = "text"
+
+    if "response_data_legacy" in columns:
+        migrated, after = 0, 0
+        while True:
+            rows = bind.execute(
+                _SELECT_LEGACY, {"after": after, "batch": BATCH}
+            ).fetchall()
+            if not rows:
+                break
+            bind.execute(
+                _UPDATE_RESPONSE_DATA,
+                [
+                    {
+                        "id": row.id,
+                        "response_data": json.dumps(
+                            _parse(row.response_data_legacy), ensure_ascii=False
+                        ),
+                    }
+                    for row in rows
+                ],
+            )
+            migrated += len(rows)
+            after = rows[-1].id
+        op.execute("ALTER TABLE user_history DROP COLUMN response_data_legacy")
+        logger.info(f"Migrated {migrated} history records to JSONB response_data")
+
+    try:
+        # lz4 быстрее pglz при сжатии TOAST (PostgreSQL 14+)
+        with bind.begin_nested():
+            op.execute(
+                "ALTER TABLE user_history ALTER COLUMN response_data SET COMPRESSION lz4"
+            )
+    except sa.exc.SQLAlchemyError as e:
+        logger.info(f"lz4 compression for response_data is unavailable: {e}")
+
+
+def downgrade():
+    op.execute(
+        "ALTER TABLE user_history ALTER COLUMN response_data TYPE TEXT "
+        "USING response_data::text"
+    )
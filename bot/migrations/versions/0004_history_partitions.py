@@ -0,0 +1,109 @@
+"""Партиционирование user_history по месяцам created_at
+
+Обычная таблица переименовывается в user_history_legacy и подключается к
+новой партиционированной таблице одной партицией с диапазоном [MINVALUE,
+начало следующего месяца): данные не копируются, а существующие индексы
+переиспользуются. Партиции следующих месяцев дальше создает
+обслуживание истории (services/history_maintenance.py).
+
+Миграция необратима: после нее записи лежат в нескольких партициях, и
+собрать их обратно в одну таблицу без копирования всех данных нельзя.
+Откат до 0003 - только восстановлением из резервной копии.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-11-03 12:00:00
+"""
+import re
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 2
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def _month_start(value, months=0):
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    kind = bind.execute(
+        sa.text("SELECT relkind::text FROM pg_class WHERE oid = 'user_history'::regclass")
+    ).scalar()
+    now = datetime.utcnow()
+
+    if kind != "p":
+        cutoff = _month_start(now, 1)
+        op.execute("ALTER TABLE user_history RENAME TO user_history_legacy")
+        # Первичный ключ партиции должен включать created_at;
+        # ATTACH построит его заново как (id, created_at)
+        op.execute("ALTER TABLE user_history_legacy DROP CONSTRAINT user_history_pkey")
+        op.execute("ALTER INDEX IF EXISTS idx_created_at RENAME TO idx_created_at_legacy")
+        op.execute(
+            "ALTER INDEX IF EXISTS idx_user_history_listing "
+            "RENAME TO idx_user_history_listing_legacy"
+        )
+        op.execute("ALTER TABLE user_history_legacy ALTER COLUMN created_at SET NOT NULL")
+        op.execute(
+            "CREATE TABLE user_history "
+            "(LIKE user_history_legacy INCLUDING DEFAULTS INCLUDING GENERATED, "
+            "PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)"
+        )
+        # Иначе последовательность id удалится вместе с партицией legacy
+        op.execute("ALTER SEQUENCE user_history_id_seq OWNED BY user_history.id")
+        op.execute(
+            "ALTER TABLE user_history ATTACH PARTITION user_history_legacy "
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutoff.isoformat()}')"
+        )
+        op.execute("CREATE INDEX idx_created_at ON user_history(created_at)")
+        # Индекс партиции legacy с тем же определением подключится к нему
+        op.execute(
+            """
+            CREATE INDEX idx_user_history_listing
+            ON user_history (user_id, created_at DESC, id DESC)
+            INCLUDE (category, message_id, request_preview, response_preview)
+        """
+        )
+
+    bounds = bind.execute(
+        sa.text(
+            """
+            SELECT pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'user_history'::regclass
+        """
+        )
+    ).scalars()
+    covered_until = datetime.min
+    for bound in bounds:
+        match = _UPPER_BOUND.search(bound)
+        if match:
+            covered_until = max(covered_until, datetime.fromisoformat(match.group(1)))
+
+    for offset in range(MONTHS_AHEAD + 1):
+        start = _month_start(now, offset)
+        if start < covered_until:
+            continue
+        op.execute(
+            f"CREATE TABLE IF NOT EXISTS user_history_p{start:%Y%m} "
+            f"PARTITION OF user_history FOR VALUES FROM ('{start.isoformat()}') "
+            f"TO ('{_month_start(start, 1).isoformat()}')"
+        )
+
+
+def downgrade():
+    """Необратима (см. описание миграции)"""
+    raise NotImplementedError(
+        "Irreversible migration: restore the database from a backup taken before 0004"
+    )
@@ -0,0 +1,51 @@
+"""tsvector для поиска по истории и GIN-индекс по нему
+
+Запрос весит больше ответа (A против B). С расширением btree_gin в индекс
+добавляется user_id, и поиск не перебирает совпадения других пользователей.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-11-03 12:00:00
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def upgrade():
+    op.execute(
+        """
+        ALTER TABLE user_history
+        ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(request_text, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(response_text, '')), 'B')
+        ) STORED
+    """
+    )
+
+    bind = op.get_bind()
+    columns = "search_vector"
+    try:
+        with bind.begin_nested():
+            op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+        columns = "user_id, search_vector"
+    except sa.exc.SQLAlchemyError as e:
+        logger.info(f"btree_gin is unavailable, search index without user_id: {e}")
+
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_history_search "
+        f"ON user_history USING GIN ({columns})"
+    )
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_user_history_search")
+    op.execute("ALTER TABLE user_history DROP COLUMN IF EXISTS search_vector")
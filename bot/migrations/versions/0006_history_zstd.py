@@ -0,0 +1,63 @@
+"""Столбцы для сжатых zstd текстов и таблица версий словарей
+
+Сжатый текст хранится в *_zstd (request_text/response_text тогда NULL),
+поэтому search_vector перестает быть генерируемым столбцом и заполняется
+при вставке из исходного текста.
+
+Миграция необратима: сжатые тексты распаковывает только бот (zstd со
+словарем из history_zstd_dicts), в SQL их не восстановить. Откат до 0005 -
+только восстановлением из резервной копии.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-11-03 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history_zstd_dicts (
+            id SERIAL PRIMARY KEY,
+            dictionary BYTEA NOT NULL,
+            samples INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    op.execute(
+        """
+        ALTER TABLE user_history
+        ADD COLUMN IF NOT EXISTS request_zstd BYTEA,
+        ADD COLUMN IF NOT EXISTS response_zstd BYTEA,
+        ADD COLUMN IF NOT EXISTS zstd_dict_id INTEGER,
+        ALTER COLUMN request_text DROP NOT NULL,
+        -- уже сжато: TOAST не должен пытаться сжимать повторно
+        ALTER COLUMN request_zstd SET STORAGE EXTERNAL,
+        ALTER COLUMN response_zstd SET STORAGE EXTERNAL
+    """
+    )
+    generated = op.get_bind().execute(
+        sa.text(
+            """
+            SELECT attgenerated::text FROM pg_attribute
+            WHERE attrelid = 'user_history'::regclass AND attname = 'search_vector'
+        """
+        )
+    ).scalar()
+    if generated == "s":
+        op.execute("ALTER TABLE user_history ALTER COLUMN search_vector DROP EXPRESSION")
+
+
+def downgrade():
+    """Необратима (см. описание миграции)"""
+    raise NotImplementedError(
+        "Irreversible migration: restore the database from a backup taken before 0006"
+    )
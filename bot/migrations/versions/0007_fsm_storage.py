@@ -0,0 +1,35 @@
+"""Таблица состояний FSM для общего хранилища нескольких реплик бота
+
+UNLOGGED: запись без WAL, но после аварийной остановки PostgreSQL таблица
+очищается (при штатном перезапуске данные сохраняются). Для незавершенных
+диалогов это приемлемо. Индекса по expires_at нет намеренно: он меняется
+при каждой записи и не дал бы обновлениям быть HOT; просроченные строки
+удаляет редкий полный проход по маленькой таблице.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-11-10 12:00:00
+"""
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            expires_at TIMESTAMPTZ NOT NULL
+        ) WITH (fillfactor = 70)
+    """
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS fsm_storage")
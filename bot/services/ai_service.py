@@ -1,27 +1,236 @@
+import hashlib
+import json
+import logging
 import os
-from typing import Any, Dict
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
 
 import httpx
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Обновление Telegram, которое обрабатывается сейчас (RequestOriginMiddleware)
+_current_update: ContextVar[Optional[Update]] = ContextVar(
+    "current_update", default=None
+)
+
+
+def update_origin(update: Update) -> str:
+    """Исходное сообщение (чат и номер) или нажатие кнопки обновления"""
+    if update.message:
+        return f"message:{update.message.chat.id}:{update.message.message_id}"
+    if update.edited_message:
+        message = update.edited_message
+        return f"message:{message.chat.id}:{message.message_id}"
+    if update.callback_query:
+        return f"callback:{update.callback_query.id}"
+    return f"update:{update.update_id}"
+
+
+def update_tenant(update: Update) -> Optional[str]:
+    """Tenant бэкенда (X-Tenant-Id) - пользователь Telegram обновления
+
+    Планировщик бэкенда обслуживает tenant'ов по очереди, поэтому поток
+    запросов одного пользователя не задерживает остальных.
+    """
+    user = UserContextMiddleware.resolve_event_context(update).user
+    return f"telegram:{user.id}" if user else None
+
+
+def make_idempotency_key(origin: str, endpoint: str, data: Dict[str, Any]) -> str:
+    """Ключ идемпотентности из исходного обновления, эндпоинта и тела запроса
+
+    Тот же текст в другом сообщении (другой пользователь или повтор
+    пользователем) дает новый ключ и новую генерацию; ключ совпадает только
+    у повторов запроса по тому же сообщению.
+    """
+    raw = "\n".join(
+        (origin, endpoint, json.dumps(data, sort_keys=True, ensure_ascii=False))
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RequestOriginMiddleware(BaseMiddleware):
+    """Запоминает обрабатываемое обновление для запросов к бэкенду"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = _current_update.set(event)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_update.reset(token)
+
+
+# Запросы внутри fresh_generation() получают новый ключ идемпотентности
+_fresh_generation: ContextVar[bool] = ContextVar("fresh_generation", default=False)
+
+
+@contextmanager
+def fresh_generation():
+    """Новая генерация вместо готового ответа бэкенда на тот же запрос
+
+    Бэкенд хранит результат по ключу идемпотентности, поэтому повтор
+    прежнего запроса без нового ключа вернул бы прежний ответ.
+    """
+    token = _fresh_generation.set(True)
+    try:
+        yield
+    finally:
+        _fresh_generation.reset(token)
 
 
 class BackendService:
+    """Клиент бэкенда с общим пулом keep-alive соединений
+
+    Один httpx.AsyncClient на процесс: соединение с бэкендом
+    устанавливается один раз и переиспользуется всеми обработчиками.
+    BACKEND_UDS направляет запросы в Unix-сокет бэкенда на той же машине
+    (uvicorn --uds), BACKEND_HTTP2 включает HTTP/2 для бэкенда за прокси
+    с его поддержкой (нужен пакет h2).
+    """
+
     def __init__(self):
         self.backend_url = os.getenv("BACKEND_URL", "http://localhost:8000")
+        self.timeout = 30.0
+        # Поток не ограничен по общему времени: длинный документ пишется,
+        # сколько нужно, а ошибкой считается только долгая тишина бэкенда
+        self.stream_idle_timeout = float(
+            os.getenv("BACKEND_STREAM_IDLE_TIMEOUT", "90")
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _create_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("BACKEND_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("BACKEND_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("BACKEND_KEEPALIVE_EXPIRY", "60")),
+        )
+        http2 = os.getenv("BACKEND_HTTP2", "false").lower() == "true"
+        uds = os.getenv("BACKEND_UDS")
+        try:
+            transport = httpx.AsyncHTTPTransport(
+                http2=http2, limits=limits, uds=uds, retries=1
+            )
+        except ImportError:
+            raise Exception("BACKEND_HTTP2=true requires the h2 package")
+        logger.info(
+            f"Backend client: {self.backend_url}"
+            f"{f' via {uds}' if uds else ''}{' (HTTP/2)' if http2 else ''}, "
+            f"max {limits.max_connections} connections"
+        )
+        return httpx.AsyncClient(
+            base_url=self.backend_url,
+            transport=transport,
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+        )
+
+    async def warm_up(self):
+        """Открытие соединения с бэкендом до первого запроса пользователя"""
+        try:
+            await self.client.get("/health", timeout=5.0)
+        except httpx.HTTPError as e:
+            logger.warning(f"Backend is not reachable yet: {e}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _headers(headers: Dict[str, str]) -> Dict[str, str]:
+        """Заголовки запроса к бэкенду: приоритет и tenant текущего обновления"""
+        headers = {**headers, "X-Priority": "interactive"}
+        update = _current_update.get()
+        tenant = update_tenant(update) if update is not None else None
+        if tenant:
+            headers["X-Tenant-Id"] = tenant
+        return headers
 
     async def _make_request(
-        self, endpoint: str, data: Dict[str, Any]
+        self,
+        endpoint: str,
+        data: Dict[str, Any],
+        idempotency_key: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """Универсальный метод для запросов к бэкенду"""
+        """Универсальный метод для запросов к бэкенду
+
+        Повтор того же запроса (например, после таймаута) отправляется с тем же
+        Idempotency-Key, и бэкенд отдает уже идущую или готовую генерацию
+        вместо запуска новой. Ключ привязан к исходному сообщению; вне
+        обработчика обновления ключ случайный. X-Request-Deadline сообщает бэкенду, когда бот
+        перестанет ждать ответ, чтобы тот не держал запрос к провайдеру дольше,
+        X-Tenant-Id - чей это запрос (см. update_tenant).
+        """
+        if idempotency_key is None:
+            update = _current_update.get()
+            idempotency_key = (
+                uuid.uuid4().hex
+                if update is None or _fresh_generation.get()
+                else make_idempotency_key(update_origin(update), endpoint, data)
+            )
+        headers = self._headers(
+            {
+                "Idempotency-Key": idempotency_key,
+                "X-Request-Deadline": f"{time.time() + self.timeout:.3f}",
+            }
+        )
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(f"{self.backend_url}{endpoint}", json=data)
-                response.raise_for_status()
-                return response.json()
+            response = await self.client.post(endpoint, json=data, headers=headers)
+            response.raise_for_status()
+            return response.json()
         except httpx.RequestError as e:
             raise Exception(f"Backend request error: {str(e)}")
         except Exception as e:
             raise Exception(f"Unexpected error: {str(e)}")
 
+    async def _stream(
+        self, endpoint: str, data: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """События потокового эндпоинта бэкенда (NDJSON)
+
+        Ошибка, пришедшая посреди потока строкой {"error": ...}, поднимается
+        как исключение. Повторов нет: частично показанный ответ повтором
+        не продолжить. X-Request-Deadline не отправляется: таймаут чтения
+        (stream_idle_timeout) ограничивает паузу между событиями, а не весь
+        поток, и бэкенд останавливает генерацию, когда бот закрывает поток.
+        """
+        headers = self._headers({})
+        try:
+            async with self.client.stream(
+                "POST",
+                endpoint,
+                json=data,
+                headers=headers,
+                timeout=httpx.Timeout(self.stream_idle_timeout, connect=5.0),
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise Exception(f"Backend stream error: {event['error']}")
+                    yield event
+        except httpx.HTTPError as e:
+            raise Exception(f"Backend request error: {str(e)}")
+
     async def generate_marketing_posts(
         self, idea: str, tone: str = "professional", target_audience: str = "general"
     ) -> Dict[str, Any]:
@@ -46,6 +255,15 @@ class BackendService:
             {"doc_type": doc_type, "content": content, "style": style},
         )
 
+    def stream_document(
+        self, doc_type: str, content: str, style: str = "formal"
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковая генерация документа: {"delta": текст}, затем {"result": ...}"""
+        return self._stream(
+            "/api/v1/documents/generate-document/stream",
+            {"doc_type": doc_type, "content": content, "style": style},
+        )
+
     async def analyze_contract(
         self, contract_text: str, analyze_risks: bool = True
     ) -> Dict[str, Any]:
@@ -63,3 +281,7 @@ class BackendService:
             "/api/v1/finance/analyze-data",
             {"data": data, "analysis_type": analysis_type},
         )
+
+
+# Глобальный экземпляр: общий пул соединений для всех обработчиков
+backend_service = BackendService()
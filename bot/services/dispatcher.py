@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+LaneKey = Tuple[Optional[int], Optional[int]]
+
+
+class _Lane:
+    """Очередь обновлений одного пользователя: замок с FIFO-ожиданием"""
+
+    __slots__ = ("key", "lock", "updates", "sequence", "written", "writes")
+
+    def __init__(self, key: LaneKey):
+        self.key = key
+        self.lock = asyncio.Lock()
+        self.updates = 0
+        # Номер последнего обновления, взявшего очередь, и последнего,
+        # записавшего состояние FSM
+        self.sequence = 0
+        self.written = 0
+        self.writes = asyncio.Lock()
+
+
+class _Hold:
+    __slots__ = ("lane", "sequence", "released")
+
+    def __init__(self, lane: _Lane):
+        lane.sequence += 1
+        self.lane = lane
+        self.sequence = lane.sequence
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.lane.lock.release()
+
+
+# Очередь пользователя, которую держит текущее обновление
+_current_hold: ContextVar[Optional[_Hold]] = ContextVar("current_hold", default=None)
+
+
+def release_lane():
+    """Пропустить следующие обновления пользователя, не дожидаясь конца текущего
+
+    Для обработчиков, которые уже прочитали состояние и дальше только ждут
+    бэкенд: новое сообщение пользователя может заменить их генерацию. Их
+    поздние записи состояния не затирают записи следующих обновлений
+    (см. _LaneOrderedStorage).
+    """
+    hold = _current_hold.get()
+    if hold is not None:
+        hold.release()
+
+
+class _LaneOrderedStorage(BaseStorage):
+    """FSM-хранилище, в котором устаревшая запись не затирает новую
+
+    Обработчик, отпустивший очередь (release_lane), может записать состояние
+    позже следующих обновлений пользователя. Такая запись пропускается, если
+    состояние уже записало более позднее обновление: остается состояние,
+    оставленное последним сообщением. Записи вне очереди (другой ключ, нет
+    чата и пользователя) проходят как есть.
+    """
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+        self.skipped = 0
+
+    def __getattr__(self, name: str) -> Any:
+        # memory_report и прочее, что есть только у исходного хранилища
+        return getattr(self.storage, name)
+
+    async def _write(
+        self, key: StorageKey, write: Callable[[], Awaitable[Any]]
+    ) -> Tuple[bool, Any]:
+        """Запись, если более позднее обновление еще не писало: (записано, результат)"""
+        hold = _current_hold.get()
+        if hold is None or (key.chat_id, key.user_id) != hold.lane.key:
+            return True, await write()
+        lane = hold.lane
+        # Записи по очереди: проверка и запись не разделяются чужой записью
+        async with lane.writes:
+            if hold.sequence < lane.written:
+                self.skipped += 1
+                logger.info(f"Skipped a stale FSM write for {lane.key}")
+                return False, None
+            lane.written = hold.sequence
+            return True, await write()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(key, lambda: self.storage.set_state(key=key, state=state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.storage.get_state(key=key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._write(key, lambda: self.storage.set_data(key=key, data=data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return await self.storage.get_data(key=key)
+
+    async def update_data(
+        self, key: StorageKey, data: Mapping[str, Any]
+    ) -> Dict[str, Any]:
+        written, result = await self._write(
+            key, lambda: self.storage.update_data(key=key, data=data)
+        )
+        return result if written else await self.storage.get_data(key=key)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+class ShardedDispatcher(Dispatcher):
+    """Диспетчер с очередями обновлений по пользователям.
+
+    Обновления одного пользователя (ключ - чат и пользователь, как у FSM)
+    обрабатываются строго по порядку, поэтому каждое видит состояние,
+    оставленное предыдущим. Разные пользователи обрабатываются параллельно,
+    но одновременно выполняется не больше ``workers`` обновлений; остальные
+    ждут в своих очередях, не занимая места в пуле. Очередь берется до
+    middleware, в том числе до чтения состояния FSM. Обработчик может
+    отпустить очередь раньше (release_lane); порядок записей состояния
+    тогда сохраняет _LaneOrderedStorage.
+    """
+
+    def __init__(self, *args: Any, workers: Optional[int] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._storage = _LaneOrderedStorage(self.fsm.storage)
+        self.fsm.storage = self._storage
+        self.workers = workers or int(os.getenv("DISPATCH_WORKERS", "64"))
+        self._pool = asyncio.Semaphore(self.workers)
+        self._lanes: Dict[LaneKey, _Lane] = {}
+        self.waiting = 0
+        self.running = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "lanes": len(self._lanes),
+            "stale_writes": self._storage.skipped,
+        }
+
+    @staticmethod
+    def _lane_key(update: Update) -> Optional[LaneKey]:
+        context = UserContextMiddleware.resolve_event_context(update)
+        chat_id = context.chat.id if context.chat else None
+        user_id = context.user.id if context.user else None
+        if chat_id is None and user_id is None:
+            return None
+        return chat_id, user_id
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        key = self._lane_key(update)
+        if key is None:
+            return await self._run_in_pool(bot, update, **kwargs)
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(key)
+        lane.updates += 1
+        self.waiting += 1
+        hold = None
+        try:
+            await lane.lock.acquire()
+            hold = _Hold(lane)
+            token = _current_hold.set(hold)
+            try:
+                return await self._run_in_pool(bot, update, counted=True, **kwargs)
+            finally:
+                _current_hold.reset(token)
+        finally:
+            if hold is None:
+                self.waiting -= 1
+            else:
+                hold.release()
+            lane.updates -= 1
+            if not lane.updates:
+                del self._lanes[key]
+
+    async def _run_in_pool(
+        self, bot: Bot, update: Update, counted: bool = False, **kwargs: Any
+    ) -> Any:
+        if not counted:
+            self.waiting += 1
+        try:
+            await self._pool.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await super().feed_update(bot, update, **kwargs)
+        finally:
+            self.running -= 1
+            self._pool.release()
+
+
+def create_dispatcher(**kwargs: Any) -> Dispatcher:
+    """Диспетчер по DISPATCH_MODE: sharded (по умолчанию) или default (aiogram)"""
+    mode = os.getenv("DISPATCH_MODE", "sharded").lower()
+    if mode == "default":
+        return Dispatcher(**kwargs)
+    if mode == "sharded":
+        return ShardedDispatcher(**kwargs)
+    raise Exception(f"Unknown DISPATCH_MODE: {mode}")
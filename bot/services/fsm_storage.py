@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import orjson
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from services.history_service import get_history_service
+
+logger = logging.getLogger(__name__)
+
+# Строка с истекшим expires_at считается отсутствующей: ее состояние и данные
+# не читаются и заменяются при следующей записи
+_EXPIRES_AT = "now() + CAST(:ttl AS DOUBLE PRECISION) * INTERVAL '1 second'"
+_LIVE_STATE = "CASE WHEN fsm_storage.expires_at > now() THEN fsm_storage.state END"
+_LIVE_DATA = (
+    "CASE WHEN fsm_storage.expires_at > now() THEN fsm_storage.data "
+    "ELSE CAST('{}' AS JSONB) END"
+)
+
+_SELECT_STATE = text(
+    "SELECT state FROM fsm_storage WHERE key = :key AND expires_at > now()"
+)
+_SELECT_DATA = text(
+    "SELECT data FROM fsm_storage WHERE key = :key AND expires_at > now()"
+)
+_UPSERT_STATE = text(
+    f"""
+    INSERT INTO fsm_storage (key, state, expires_at)
+    VALUES (:key, :state, {_EXPIRES_AT})
+    ON CONFLICT (key) DO UPDATE
+    SET state = EXCLUDED.state, data = {_LIVE_DATA}, expires_at = EXCLUDED.expires_at
+"""
+)
+_UPSERT_DATA = text(
+    f"""
+    INSERT INTO fsm_storage (key, data, expires_at)
+    VALUES (:key, CAST(:data AS JSONB), {_EXPIRES_AT})
+    ON CONFLICT (key) DO UPDATE
+    SET data = EXCLUDED.data, state = {_LIVE_STATE}, expires_at = EXCLUDED.expires_at
+"""
+)
+# Слияние на стороне БД одним запросом: одновременные update_data с разных
+# реплик не затирают ключи друг друга
+_MERGE_DATA = text(
+    f"""
+    INSERT INTO fsm_storage (key, data, expires_at)
+    VALUES (:key, CAST(:data AS JSONB), {_EXPIRES_AT})
+    ON CONFLICT (key) DO UPDATE
+    SET data = {_LIVE_DATA} || EXCLUDED.data, state = {_LIVE_STATE},
+        expires_at = EXCLUDED.expires_at
+    RETURNING data
+"""
+)
+_PURGE_EXPIRED = text("DELETE FROM fsm_storage WHERE expires_at <= now()")
+_MEMORY_REPORT = text(
+    """
+    SELECT state, COUNT(*) AS records, SUM(pg_column_size(data)) AS bytes
+    FROM fsm_storage
+    WHERE expires_at > now()
+    GROUP BY state
+"""
+)
+
+# Отчет по памяти: состояние -> (число диалогов, байт данных)
+MemoryReport = Dict[Optional[str], Tuple[int, int]]
+
+
+def _dumps(data: Any) -> str:
+    return orjson.dumps(data).decode()
+
+
+class _MemoryRecord:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, touched: float):
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.touched = touched
+
+
+class TTLMemoryStorage(BaseStorage):
+    """FSM-хранилище в памяти процесса с вытеснением простаивающих диалогов.
+
+    В отличие от MemoryStorage aiogram, запись не создается при чтении
+    (иначе каждый написавший боту пользователь оставался бы в памяти
+    навсегда), пустая запись удаляется сразу, а диалог без обращений
+    дольше ``ttl`` секунд забывается. Записи упорядочены по последнему
+    обращению, поэтому очистка раз в ``sweep_interval`` секунд проходит
+    только по вытесняемым.
+    """
+
+    def __init__(self, ttl: float, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._records: "OrderedDict[StorageKey, _MemoryRecord]" = OrderedDict()
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def _record(self, key: StorageKey, create: bool = False) -> Optional[_MemoryRecord]:
+        now = time.monotonic()
+        record = self._records.get(key)
+        if record is not None and now - record.touched > self.ttl:
+            del self._records[key]
+            record = None
+        if record is None:
+            if not create:
+                return None
+            record = self._records[key] = _MemoryRecord(now)
+            self._start_sweep()
+        else:
+            record.touched = now
+            self._records.move_to_end(key)
+        return record
+
+    def _discard_empty(self, key: StorageKey, record: _MemoryRecord):
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+    def _start_sweep(self):
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._sweep(), name="fsm-memory-sweep")
+
+    async def _sweep(self):
+        while self._records:
+            await asyncio.sleep(self.sweep_interval)
+            deadline = time.monotonic() - self.ttl
+            evicted = 0
+            while self._records:
+                key, record = next(iter(self._records.items()))
+                if record.touched > deadline:
+                    break
+                del self._records[key]
+                evicted += 1
+            if evicted:
+                logger.info(
+                    f"Evicted {evicted} idle FSM records, {len(self._records)} left"
+                )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key, create=state is not None)
+        if record is not None:
+            record.state = state.state if isinstance(state, State) else state
+            self._discard_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._record(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        record = self._record(key, create=bool(data))
+        if record is not None:
+            record.data = data.copy()
+            self._discard_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._record(key)
+        return record.data.copy() if record is not None else {}
+
+    async def memory_report(self) -> MemoryReport:
+        """Число диалогов и примерный объем их данных (JSON) по состояниям"""
+        report: Dict[Optional[str], list] = {}
+        for record in self._records.values():
+            entry = report.setdefault(record.state, [0, 0])
+            entry[0] += 1
+            entry[1] += len(orjson.dumps(record.data))
+        return {state: (records, size) for state, (records, size) in report.items()}
+
+    async def close(self) -> None:
+        if self._sweep_task is not None and not self._sweep_task.done():
+            self._sweep_task.cancel()
+
+
+class PostgresStorage(BaseStorage):
+    """FSM-хранилище в UNLOGGED-таблице fsm_storage (миграция 0007).
+
+    Состояние и данные диалога хранятся одной строкой на ключ и живут
+    ``ttl`` секунд с последней записи. Каждая операция - один запрос по
+    первичному ключу в режиме autocommit, без BEGIN/ROLLBACK вокруг него.
+    Таблица общая для всех реплик бота; просроченные строки удаляются
+    фоновой задачей раз в ``purge_interval`` секунд.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        ttl: float,
+        key_builder: Optional[KeyBuilder] = None,
+        purge_interval: float = 3600,
+    ):
+        self.engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.purge_interval = purge_interval
+        self._purge_task: Optional[asyncio.Task] = None
+
+    def _start_purge(self):
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(
+                self._purge_expired(), name="fsm-storage-purge"
+            )
+
+    async def _purge_expired(self):
+        while True:
+            try:
+                async with self.engine.connect() as conn:
+                    result = await conn.execute(_PURGE_EXPIRED)
+                if result.rowcount:
+                    logger.info(f"Purged {result.rowcount} expired FSM records")
+            except Exception as e:
+                logger.error(f"FSM storage purge failed: {e}")
+            await asyncio.sleep(self.purge_interval)
+
+    async def _execute(self, query, params: Dict[str, Any]) -> Any:
+        """Один запрос; возвращает первое значение, если запрос отдает строки"""
+        async with self.engine.connect() as conn:
+            result = await conn.execute(query, params)
+            return result.scalar() if result.returns_rows else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._start_purge()
+        await self._execute(
+            _UPSERT_STATE,
+            {
+                "key": self.key_builder.build(key),
+                "state": state.state if isinstance(state, State) else state,
+                "ttl": self.ttl,
+            },
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._execute(_SELECT_STATE, {"key": self.key_builder.build(key)})
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        self._start_purge()
+        await self._execute(
+            _UPSERT_DATA,
+            {"key": self.key_builder.build(key), "data": _dumps(data), "ttl": self.ttl},
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self._execute(_SELECT_DATA, {"key": self.key_builder.build(key)})
+        return data if data is not None else {}
+
+    async def update_data(
+        self, key: StorageKey, data: Mapping[str, Any]
+    ) -> Dict[str, Any]:
+        self._start_purge()
+        return await self._execute(
+            _MERGE_DATA,
+            {
+                "key": self.key_builder.build(key),
+                "data": _dumps(dict(data)),
+                "ttl": self.ttl,
+            },
+        )
+
+    async def memory_report(self) -> MemoryReport:
+        """Число действующих диалогов и объем их данных по состояниям"""
+        async with self.engine.connect() as conn:
+            result = await conn.execute(_MEMORY_REPORT)
+            return {row.state: (row.records, row.bytes or 0) for row in result}
+
+    async def close(self) -> None:
+        # Пул соединений общий с историей и закрывается вместе с ней
+        if self._purge_task is not None and not self._purge_task.done():
+            self._purge_task.cancel()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Хранилище FSM по FSM_STORAGE: memory (по умолчанию), postgres или redis
+
+    memory хранит диалоги в процессе и подходит только для одной реплики.
+    postgres использует пул соединений истории, redis - REDIS_URL (любой
+    сервер с протоколом Redis). Во всех хранилищах диалог живет
+    FSM_TTL_HOURS часов с последнего обращения (в общих - с изменения).
+    """
+    backend = os.getenv("FSM_STORAGE", "memory").lower()
+    ttl = float(os.getenv("FSM_TTL_HOURS", "24")) * 3600
+
+    if backend == "postgres":
+        return PostgresStorage(get_history_service().engine, ttl=ttl)
+
+    if backend == "redis":
+        # redis импортируется только в этом режиме
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=int(ttl),
+            data_ttl=int(ttl),
+            json_loads=orjson.loads,
+            json_dumps=_dumps,
+        )
+
+    if backend != "memory":
+        raise Exception(f"Unknown FSM_STORAGE: {backend}")
+    return TTLMemoryStorage(ttl=ttl)
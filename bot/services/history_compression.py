@@ -0,0 +1,73 @@
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryCompression:
+    """Сжатие текстов истории zstd со словарем.
+
+    Ответы модели в истории очень похожи друг на друга (шаблоны постов,
+    типовые формулировки договоров), поэтому словарь, обученный на выборке
+    записей, сжимает даже короткие тексты в несколько раз. Словари хранятся
+    в БД с версиями: новые записи сжимаются последним словарем, а для чтения
+    старых словарь подгружается по его ID. Без словаря (ID None) используется
+    обычный zstd.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, level: Optional[int] = None):
+        if enabled is None:
+            enabled = os.getenv("HISTORY_COMPRESSION", "").lower() == "zstd"
+        self.enabled = enabled
+        self.level = level or int(os.getenv("HISTORY_ZSTD_LEVEL", "3"))
+        # Короче порога текст не сжимаем: выигрыш меньше накладных расходов
+        self.min_bytes = int(os.getenv("HISTORY_ZSTD_MIN_BYTES", "64"))
+        self.dict_size = int(os.getenv("HISTORY_ZSTD_DICT_SIZE", str(110 * 1024)))
+        self.active_dict_id: Optional[int] = None
+        self._dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+        self._compressor = zstandard.ZstdCompressor(level=self.level)
+        self._decompressors: Dict[Optional[int], zstandard.ZstdDecompressor] = {
+            None: zstandard.ZstdDecompressor()
+        }
+
+    def has_dictionary(self, dict_id: Optional[int]) -> bool:
+        return dict_id is None or dict_id in self._dictionaries
+
+    def register(self, dict_id: int, data: bytes):
+        """Добавить словарь для чтения записей, сжатых им"""
+        if dict_id in self._dictionaries:
+            return
+        dictionary = zstandard.ZstdCompressionDict(data)
+        self._dictionaries[dict_id] = dictionary
+        self._decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+
+    def activate(self, dict_id: int, data: bytes):
+        """Сжимать новые записи этим словарем"""
+        self.register(dict_id, data)
+        self.active_dict_id = dict_id
+        self._compressor = zstandard.ZstdCompressor(
+            level=self.level, dict_data=self._dictionaries[dict_id]
+        )
+
+    def train(self, samples: Iterable[str]) -> bytes:
+        """Обучение словаря на выборке текстов"""
+        encoded = [sample.encode() for sample in samples if sample]
+        dictionary = zstandard.train_dictionary(
+            self.dict_size, encoded, level=self.level
+        )
+        return dictionary.as_bytes()
+
+    def compress(self, value: Optional[str]) -> Optional[bytes]:
+        """Сжатый текст или None, если сжатие выключено или текст короткий"""
+        if not self.enabled or not value:
+            return None
+        data = value.encode()
+        if len(data) < self.min_bytes:
+            return None
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes, dict_id: Optional[int]) -> str:
+        return self._decompressors[dict_id].decompress(data).decode()
@@ -0,0 +1,139 @@
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import os
+import tempfile
+from contextlib import aclosing
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import orjson
+
+from services.history_service import get_history_service
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("jsonl", "csv")
+EXPORT_FIELDS = (
+    "id",
+    "created_at",
+    "category",
+    "request_text",
+    "response_text",
+    "response_data",
+)
+# Бот может отправить документ не больше 50 МБ
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+
+def _jsonl_lines(records: List[Dict[str, Any]]) -> bytes:
+    return b"".join(orjson.dumps(record) + b"\n" for record in records)
+
+
+def _csv_lines(records: List[Dict[str, Any]]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow(
+            [
+                record["id"],
+                record["created_at"].isoformat(),
+                record["category"],
+                record["request_text"],
+                record["response_text"],
+                orjson.dumps(record["response_data"]).decode()
+                if record["response_data"] is not None
+                else "",
+            ]
+        )
+    return buffer.getvalue().encode("utf-8")
+
+
+def _csv_header() -> bytes:
+    # BOM: Excel открывает UTF-8 с кириллицей только с ним
+    return ("\ufeff" + ",".join(EXPORT_FIELDS) + "\r\n").encode("utf-8")
+
+
+class HistoryExport:
+    """Выгрузка всей истории пользователя в сжатый файл.
+
+    Записи читаются серверным курсором пачками по ``batch`` и сразу
+    дописываются в gzip-файл во временном каталоге, поэтому память не растет
+    с числом записей. Сжатие пачки выполняется в потоке и не задерживает
+    обработку других обновлений. Одновременно идет не больше ``concurrency``
+    выгрузок (каждая держит соединение пула), у пользователя - одна.
+    """
+
+    def __init__(
+        self,
+        batch: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        directory: Optional[str] = None,
+    ):
+        self.batch = batch or int(os.getenv("HISTORY_EXPORT_BATCH", "500"))
+        self.concurrency = concurrency or int(
+            os.getenv("HISTORY_EXPORT_CONCURRENCY", "2")
+        )
+        self.directory = directory or os.getenv("HISTORY_EXPORT_DIR")
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._users: Set[int] = set()
+
+    async def export(self, user_id: int, fmt: str) -> Optional[Tuple[Path, int]]:
+        """Файл выгрузки и число записей; None, если выгрузка уже идет
+
+        Файл удаляет вызывающий после отправки.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise Exception(f"Unknown export format: {fmt}")
+        if user_id in self._users:
+            return None
+        self._users.add(user_id)
+        try:
+            async with self._slots:
+                return await self._write(user_id, fmt)
+        finally:
+            self._users.discard(user_id)
+
+    async def _write(self, user_id: int, fmt: str) -> Tuple[Path, int]:
+        handle, name = tempfile.mkstemp(
+            prefix=f"history-{user_id}-", suffix=f".{fmt}.gz", dir=self.directory
+        )
+        os.close(handle)
+        path = Path(name)
+        encode = _jsonl_lines if fmt == "jsonl" else _csv_lines
+        archive = gzip.open(path, "wb")
+
+        def append(records: List[Dict[str, Any]]):
+            archive.write(encode(records))
+
+        rows = 0
+        try:
+            if fmt == "csv":
+                archive.write(_csv_header())
+            records = []
+            history = get_history_service().stream_user_history(user_id, self.batch)
+            # aclosing: при ошибке курсор и соединение освобождаются сразу
+            async with aclosing(history) as stream:
+                async for record in stream:
+                    records.append(record)
+                    if len(records) >= self.batch:
+                        # Кодирование и сжатие пачки - в потоке, не в event loop
+                        await asyncio.to_thread(append, records)
+                        rows += len(records)
+                        records = []
+            if records:
+                await asyncio.to_thread(append, records)
+                rows += len(records)
+            await asyncio.to_thread(archive.close)
+        except BaseException:
+            archive.close()
+            path.unlink(missing_ok=True)
+            raise
+
+        logger.info(f"Exported {rows} history records of user {user_id} to {path}")
+        return path, rows
+
+
+history_export = HistoryExport()
@@ -0,0 +1,118 @@
+import asyncio
+import gzip
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import orjson
+
+from services.history_service import get_history_service
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryMaintenance:
+    """Обслуживание партиций истории.
+
+    Раз в ``interval`` секунд создает партиции на ближайшие месяцы и удаляет
+    партиции старше ``retention_months``. Если задан ``archive_dir``, перед
+    удалением партиция выгружается в ``<archive_dir>/<партиция>.jsonl.gz``.
+    При включенном сжатии без словаря пробует обучить первый словарь.
+    """
+
+    def __init__(
+        self,
+        retention_months: Optional[int] = None,
+        archive_dir: Optional[str] = None,
+        interval: Optional[float] = None,
+    ):
+        if retention_months is None:
+            retention_months = int(os.getenv("HISTORY_RETENTION_MONTHS", "0"))
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir or os.getenv("HISTORY_ARCHIVE_DIR")
+        self.interval = interval or (
+            float(os.getenv("HISTORY_MAINTENANCE_INTERVAL_HOURS", "24")) * 3600
+        )
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запуск периодического обслуживания (идемпотентно)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(), name="history-maintenance")
+
+    async def stop(self):
+        if self._task is None or self._task.done():
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"History maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> List[str]:
+        """Один проход обслуживания; возвращает удаленные партиции"""
+        service = get_history_service()
+        await service.ensure_partitions()
+
+        compression = service.compression
+        if compression.enabled and compression.active_dict_id is None:
+            await service.train_compression_dictionary()
+
+        if self.retention_months <= 0:
+            return []
+
+        dropped = []
+        for name in await service.expired_partitions(self.retention_months):
+            if self.archive_dir:
+                await self.archive_partition(name)
+            await service.drop_partition(name)
+            dropped.append(name)
+        return dropped
+
+    async def archive_partition(self, name: str) -> Path:
+        """Выгрузка партиции в сжатый JSONL потоком, без загрузки в память
+
+        Файл пишется во временный и переименовывается только после полной
+        выгрузки, поэтому партиция удаляется лишь при наличии целого архива.
+        """
+        directory = Path(self.archive_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{name}.jsonl.gz"
+        partial = path.with_name(path.name + ".partial")
+
+        service = get_history_service()
+        archive = gzip.open(partial, "wb")
+        rows = 0
+        try:
+            lines = []
+            async for record in service.stream_partition(name):
+                lines.append(orjson.dumps(record) + b"\n")
+                rows += 1
+                if len(lines) >= 1000:
+                    # Сжатие не блокирует event loop
+                    await asyncio.to_thread(archive.writelines, lines)
+                    lines = []
+            if lines:
+                await asyncio.to_thread(archive.writelines, lines)
+        except BaseException:
+            archive.close()
+            partial.unlink(missing_ok=True)
+            raise
+        archive.close()
+        os.replace(partial, path)
+
+        logger.info(f"Archived {rows} history records from {name} to {path}")
+        return path
+
+
+history_maintenance = HistoryMaintenance()
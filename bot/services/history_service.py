@@ -1,14 +1,292 @@
+import asyncio
 import logging
 import os
-from datetime import datetime
-from typing import Any, Dict, List, Optional
-
-from sqlalchemy import create_engine, text
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from services.history_compression import HistoryCompression
+from services.history_writer import HistoryWriter
 
 logger = logging.getLogger(__name__)
 
+REQUEST_PREVIEW_LENGTH = 100
+RESPONSE_PREVIEW_LENGTH = 150
+
+# Порядок столбцов для COPY пакетной записи
+_RECORD_COLUMNS = (
+    "id",
+    "user_id",
+    "category",
+    "request_text",
+    "response_text",
+    "request_zstd",
+    "response_zstd",
+    "zstd_dict_id",
+    "response_data",
+    "message_id",
+    "created_at",
+    "request_preview",
+    "response_preview",
+)
+
+# Вектор поиска считается при вставке из исходного текста: у сжатых записей
+# request_text/response_text пусты, и выражение столбца их бы не увидело
+_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', coalesce({request}, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce({response}, '')), 'B')"
+)
+
+# Запросы собраны один раз: одинаковый SQL переиспользует подготовленные
+# выражения asyncpg на каждом соединении пула
+_INSERT_RECORD = text(
+    f"""
+    INSERT INTO user_history
+    (user_id, category, request_text, response_text, request_zstd, response_zstd,
+     zstd_dict_id, response_data, message_id, created_at, request_preview,
+     response_preview, search_vector)
+    VALUES (:user_id, :category,
+            CASE WHEN CAST(:request_zstd AS BYTEA) IS NULL THEN CAST(:request_text AS TEXT) END,
+            CASE WHEN CAST(:response_zstd AS BYTEA) IS NULL THEN CAST(:response_text AS TEXT) END,
+            :request_zstd, :response_zstd, :zstd_dict_id, CAST(:response_data AS JSONB),
+            :message_id, :created_at, :request_preview, :response_preview,
+            {_SEARCH_VECTOR_SQL.format(
+                request="CAST(:request_text AS TEXT)",
+                response="CAST(:response_text AS TEXT)",
+            )})
+    RETURNING id
+"""
+)
+# Пакет из буфера: COPY во временную таблицу соединения (с исходным текстом
+# для вектора поиска), затем один INSERT ... SELECT
+_CREATE_STAGE = text(
+    """
+    CREATE TEMP TABLE IF NOT EXISTS history_stage (
+        id INTEGER,
+        user_id BIGINT,
+        category VARCHAR(100),
+        request_text TEXT,
+        response_text TEXT,
+        request_zstd BYTEA,
+        response_zstd BYTEA,
+        zstd_dict_id INTEGER,
+        response_data JSONB,
+        message_id BIGINT,
+        created_at TIMESTAMP,
+        request_preview VARCHAR(103),
+        response_preview VARCHAR(153)
+    ) ON COMMIT DELETE ROWS
+"""
+)
+_INSERT_STAGED = text(
+    f"""
+    INSERT INTO user_history
+    (id, user_id, category, request_text, response_text, request_zstd, response_zstd,
+     zstd_dict_id, response_data, message_id, created_at, request_preview,
+     response_preview, search_vector)
+    SELECT coalesce(id, nextval('user_history_id_seq')), user_id, category,
+           CASE WHEN request_zstd IS NULL THEN request_text END,
+           CASE WHEN response_zstd IS NULL THEN response_text END,
+           request_zstd, response_zstd, zstd_dict_id, response_data, message_id,
+           created_at, request_preview, response_preview,
+           {_SEARCH_VECTOR_SQL.format(request="request_text", response="response_text")}
+    FROM history_stage
+"""
+)
+# ID записи, которая пойдет через буфер, но нужна следующему шагу сценария
+_RESERVE_RECORD_ID = text("SELECT nextval('user_history_id_seq')")
+# Keyset-пагинация по покрывающему индексу (user_id, created_at DESC, id DESC)
+# INCLUDE (...): список читается index-only scan без полных TEXT-столбцов.
+# Отдельное условие по created_at дублирует сравнение строк, но в отличие от
+# него позволяет отсечь месячные партиции старше/новее курсора.
+# Первая страница сразу возвращает общее количество записей, остальные
+# страницы получают его из callback data и не считают COUNT(*) заново.
+_SELECT_HISTORY_FIRST_PAGE = text(
+    """
+    SELECT id, category, created_at, message_id, request_preview, response_preview,
+           (SELECT COUNT(*) FROM user_history WHERE user_id = :user_id) AS total
+    FROM user_history
+    WHERE user_id = :user_id
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+"""
+)
+_SELECT_HISTORY_OLDER = text(
+    """
+    SELECT id, category, created_at, message_id, request_preview, response_preview
+    FROM user_history
+    WHERE user_id = :user_id AND (created_at, id) < (:created_at, :id)
+      AND created_at <= :created_at
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+"""
+)
+_SELECT_HISTORY_NEWER = text(
+    """
+    SELECT id, category, created_at, message_id, request_preview, response_preview
+    FROM user_history
+    WHERE user_id = :user_id AND (created_at, id) > (:created_at, :id)
+      AND created_at >= :created_at
+    ORDER BY created_at ASC, id ASC
+    LIMIT :limit
+"""
+)
+# Выгрузка всей истории пользователя: обратный проход того же индекса
+_SELECT_USER_HISTORY = text(
+    """
+    SELECT id, category, created_at, request_text, response_text, request_zstd,
+           response_zstd, zstd_dict_id, response_data
+    FROM user_history
+    WHERE user_id = :user_id
+    ORDER BY created_at, id
+"""
+)
+_SELECT_USER_DICTIONARY_IDS = text(
+    "SELECT DISTINCT zstd_dict_id FROM user_history "
+    "WHERE user_id = :user_id AND zstd_dict_id IS NOT NULL"
+)
+_RECORD_FIELDS = (
+    "id, user_id, category, request_text, response_text, request_zstd, "
+    "response_zstd, zstd_dict_id, created_at, message_id"
+)
+
+
+@lru_cache(maxsize=None)
+def _select_record_query(by_user: bool, include_data: bool):
+    """SELECT одной записи; структурированные данные читаются только по запросу"""
+    fields = _RECORD_FIELDS + (", response_data" if include_data else "")
+    where = "id = :record_id" + (" AND user_id = :user_id" if by_user else "")
+    return text(f"SELECT {fields} FROM user_history WHERE {where}")
+
+
+_SELECT_SCHEMA_VERSION = text("SELECT version_num FROM alembic_version")
+_MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "migrations"
+)
+
+
+@lru_cache(maxsize=None)
+def _schema_head() -> str:
+    """Последняя ревизия миграций, с которой совместим этот код"""
+    return ScriptDirectory(_MIGRATIONS_DIR).get_current_head()
+
+
+_SELECT_PARTITIONS = text(
+    """
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'user_history'::regclass
+"""
+)
+_PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+# Полнотекстовый поиск: ранжирование по всем совпадениям пользователя, но
+# ts_headline (дорогой разбор полного текста) только для первых :limit записей
+SEARCH_HIGHLIGHT_START = "\ue000"
+SEARCH_HIGHLIGHT_STOP = "\ue001"
+_SEARCH_HEADLINE_OPTIONS = (
+    f"StartSel={SEARCH_HIGHLIGHT_START}, StopSel={SEARCH_HIGHLIGHT_STOP}, "
+    'MaxFragments=2, MaxWords=18, MinWords=6, FragmentDelimiter=" … "'
+)
+# tsquery записан прямо в условиях, а не в CTE: планировщик видит значение и
+# по статистике выбирает между GIN и индексом по user_id.
+# Для сжатых записей фрагмент строится вторым запросом по распакованному тексту.
+_SEARCH_HISTORY = text(
+    """
+    WITH matches AS (
+        SELECT id, category, created_at, request_text, response_text,
+               request_zstd, response_zstd, zstd_dict_id,
+               ts_rank_cd(search_vector, websearch_to_tsquery('russian', :query)) AS rank
+        FROM user_history
+        WHERE user_id = :user_id
+          AND search_vector @@ websearch_to_tsquery('russian', :query)
+        ORDER BY rank DESC, created_at DESC
+        LIMIT :limit
+    )
+    SELECT id, category, created_at, rank, request_zstd, response_zstd, zstd_dict_id,
+           CASE WHEN request_zstd IS NULL AND response_zstd IS NULL THEN
+               ts_headline('russian', coalesce(request_text, '') || chr(10) || coalesce(response_text, ''),
+                           websearch_to_tsquery('russian', :query), :options)
+           END AS snippet,
+           CASE WHEN request_zstd IS NOT NULL OR response_zstd IS NOT NULL
+                THEN request_text END AS request_text,
+           CASE WHEN request_zstd IS NOT NULL OR response_zstd IS NOT NULL
+                THEN response_text END AS response_text
+    FROM matches
+    ORDER BY rank DESC, created_at DESC
+"""
+)
+_SEARCH_HEADLINES = text(
+    """
+    SELECT ts_headline('russian', doc, websearch_to_tsquery('russian', :query), :options)
+    FROM unnest(CAST(:docs AS TEXT[])) WITH ORDINALITY AS d(doc, n)
+    ORDER BY n
+"""
+)
+_FORCE_CUSTOM_PLAN = text("SET LOCAL plan_cache_mode = force_custom_plan")
+
+_SELECT_DICTIONARY = text(
+    "SELECT id, dictionary FROM history_zstd_dicts WHERE id = :dict_id"
+)
+_SELECT_LATEST_DICTIONARY = text(
+    "SELECT id, dictionary FROM history_zstd_dicts ORDER BY id DESC LIMIT 1"
+)
+_INSERT_DICTIONARY = text(
+    """
+    INSERT INTO history_zstd_dicts (dictionary, samples)
+    VALUES (:dictionary, :samples)
+    RETURNING id
+"""
+)
+_SELECT_DICTIONARY_SAMPLES = text(
+    """
+    SELECT request_text, response_text, request_zstd, response_zstd, zstd_dict_id
+    FROM user_history
+    ORDER BY created_at DESC
+    LIMIT :samples
+"""
+)
+
+_DELETE_RECORD = text("DELETE FROM user_history WHERE id = :record_id")
+_DELETE_USER_RECORD = text(
+    "DELETE FROM user_history WHERE id = :record_id AND user_id = :user_id"
+)
+_COUNT_USER_RECORDS = text(
+    "SELECT COUNT(*) as count FROM user_history WHERE user_id = :user_id"
+)
+
+
+_EPOCH = datetime(1970, 1, 1)
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _dumps(data: Any) -> str:
+    return orjson.dumps(data).decode()
+
+
+def _month_start(value: datetime, months: int = 0) -> datetime:
+    """Начало месяца value, сдвинутого на months месяцев"""
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def _to_base36(value: int) -> str:
+    digits = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        digits = _BASE36[remainder] + digits
+        if not value:
+            return digits
+
 
 class HistoryService:
     _instance = None
@@ -25,11 +303,40 @@ class HistoryService:
 
         self._initialized = True
         self.engine = None
-        self.Session = None
+        self._schema_ready = False
+        self._schema_lock = asyncio.Lock()
+        self.compression = HistoryCompression()
+        self.writer = HistoryWriter(self._copy_records)
+        # Записи с выданным ID, которые буфер еще не записал: get_record
+        # отдает их до записи в БД
+        self._pending_records: Dict[int, Tuple[Dict[str, Any], Optional[dict]]] = {}
         self._initialize_database()
 
+    @staticmethod
+    def encode_cursor(created_at: datetime, record_id: int) -> str:
+        """Компактный курсор страницы для callback data: микросекунды и id в base36"""
+        micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+        return f"{_to_base36(micros)}.{_to_base36(record_id)}"
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        micros, record_id = cursor.split(".")
+        return _EPOCH + timedelta(microseconds=int(micros, 36)), int(record_id, 36)
+
+    @staticmethod
+    def _async_url(db_url: str):
+        """postgresql:// -> postgresql+asyncpg:// с кэшем подготовленных выражений"""
+        url = make_url(db_url.replace("postgres://", "postgresql://", 1))
+        return url.set(drivername="postgresql+asyncpg").update_query_dict(
+            {
+                "prepared_statement_cache_size": os.getenv(
+                    "DB_PREPARED_STATEMENT_CACHE_SIZE", "256"
+                )
+            }
+        )
+
     def _initialize_database(self):
-        """Инициализация базы данных PostgreSQL"""
+        """Инициализация async-движка PostgreSQL (asyncpg)"""
         db_url = os.getenv("DATABASE_URL")
 
         if not db_url:
@@ -41,102 +348,338 @@ class HistoryService:
             raise Exception("DATABASE_URL must be a PostgreSQL connection string")
 
         try:
-            self.engine = create_engine(db_url, pool_pre_ping=True, pool_recycle=300)
-            self.Session = sessionmaker(bind=self.engine)
-
-            # Создаем таблицы
-            self._create_tables()
-            logger.info("PostgreSQL database initialized successfully")
+            self.engine = create_async_engine(
+                self._async_url(db_url),
+                pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+                max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+                pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                pool_recycle=300,
+                # asyncpg отдает JSONB уже декодированным этой функцией
+                json_deserializer=orjson.loads,
+                connect_args={
+                    "statement_cache_size": int(
+                        os.getenv("DB_STATEMENT_CACHE_SIZE", "256")
+                    )
+                },
+            )
+            logger.info("PostgreSQL async engine created")
 
         except Exception as e:
             logger.error(f"Failed to initialize PostgreSQL database: {e}")
             raise Exception(f"Database initialization failed: {str(e)}")
 
-    def _create_tables(self):
-        """Создание таблиц в PostgreSQL"""
-        with self.engine.connect() as conn:
-            # Check if table exists
-            result = conn.execute(
-                text(
-                    """
-                    SELECT EXISTS (
-                        SELECT FROM information_schema.tables 
-                        WHERE table_name = 'user_history'
-                    );
-                """
-                )
-            )
-            table_exists = result.scalar()
-
-            if not table_exists:
-                conn.execute(
-                    text(
-                        """
-                        CREATE TABLE user_history (
-                            id SERIAL PRIMARY KEY,
-                            user_id BIGINT NOT NULL,
-                            category VARCHAR(100) NOT NULL,
-                            request_text TEXT NOT NULL,
-                            response_text TEXT,
-                            response_data TEXT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            message_id BIGINT
-                        );
-                        
-                        CREATE INDEX idx_user_id ON user_history(user_id);
-                        CREATE INDEX idx_created_at ON user_history(created_at);
-                    """
-                    )
-                )
-                conn.commit()
-                logger.info("Created user_history table")
-            else:
-                # Проверяем тип столбцов и изменяем если нужно
-                self._migrate_columns(conn)
-
-    def _migrate_columns(self, conn):
-        """Миграция столбцов к BIGINT если нужно"""
+    async def initialize(self):
+        """Проверка версии схемы; выполняется один раз при запуске бота
+
+        Схему создают и меняют миграции Alembic (alembic upgrade head из
+        каталога bot/), здесь только сверяется строка alembic_version.
+        """
+        if self._schema_ready:
+            return
+        async with self._schema_lock:
+            if self._schema_ready:
+                return
+            async with self.engine.connect() as conn:
+                await self._check_schema(conn)
+
+                if self.compression.enabled:
+                    result = await conn.execute(_SELECT_LATEST_DICTIONARY)
+                    row = result.fetchone()
+                    if row:
+                        self.compression.activate(row.id, row.dictionary)
+                        logger.info(f"History compression uses zstd dictionary {row.id}")
+            self._schema_ready = True
+            logger.info("PostgreSQL database initialized successfully")
+
+    @staticmethod
+    async def _check_schema(conn: AsyncConnection):
+        head = _schema_head()
         try:
-            # Проверяем тип user_id
-            result = conn.execute(
-                text(
-                    """
-                    SELECT data_type 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'user_history' AND column_name = 'user_id'
-                """
-                )
+            result = await conn.execute(_SELECT_SCHEMA_VERSION)
+            version = result.scalar()
+        except SQLAlchemyError:
+            await conn.rollback()
+            version = None
+        if version != head:
+            raise Exception(
+                f"History schema is at revision {version}, expected {head}: "
+                "run `alembic upgrade head` in bot/"
             )
-            user_id_type = result.scalar()
 
-            if user_id_type == "integer":
-                logger.info("Migrating user_id from INTEGER to BIGINT")
-                conn.execute(
-                    text("ALTER TABLE user_history ALTER COLUMN user_id TYPE BIGINT")
+    async def warm_up(self, connections: Optional[int] = None):
+        """Открытие соединений пула до первого запроса пользователя"""
+        if connections is None:
+            connections = int(
+                os.getenv("DB_POOL_WARMUP", str(self.engine.pool.size()))
+            )
+        # Соединения держатся открытыми одновременно, иначе пул вернул бы
+        # одно и то же соединение
+        opened = await asyncio.gather(
+            *(self.engine.connect().start() for _ in range(connections))
+        )
+        await asyncio.gather(*(conn.close() for conn in opened))
+        logger.info(f"Warmed up {connections} history database connections")
+
+    async def close(self):
+        """Запись буфера истории и закрытие пула соединений"""
+        await self.writer.stop()
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def ensure_partitions(
+        self, conn: Optional[AsyncConnection] = None, months_ahead: int = 2
+    ) -> List[str]:
+        """Создание партиций текущего и следующих months_ahead месяцев"""
+        if conn is None:
+            await self.initialize()
+            async with self.engine.connect() as conn:
+                return await self.ensure_partitions(conn, months_ahead)
+
+        partitions = await self._partition_bounds(conn)
+        if partitions is None:
+            return []
+        # Месяцы, уже покрытые партицией legacy, пропускаем
+        covered_until = max(partitions.values(), default=datetime.min)
+
+        created = []
+        now = datetime.utcnow()
+        for offset in range(months_ahead + 1):
+            start = _month_start(now, offset)
+            if start < covered_until:
+                continue
+            name = f"user_history_p{start:%Y%m}"
+            if name in partitions:
+                continue
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF user_history "
+                    f"FOR VALUES FROM ('{start.isoformat()}') "
+                    f"TO ('{_month_start(start, 1).isoformat()}')"
                 )
-                conn.commit()
+            )
+            created.append(name)
+        await conn.commit()
+        if created:
+            logger.info(f"Created history partitions: {', '.join(created)}")
+        return created
+
+    async def _partition_bounds(
+        self, conn: AsyncConnection
+    ) -> Optional[Dict[str, datetime]]:
+        """Партиции user_history и их верхние границы; None для обычной таблицы"""
+        result = await conn.execute(
+            text("SELECT relkind::text FROM pg_class WHERE oid = 'user_history'::regclass")
+        )
+        if result.scalar() != "p":
+            return None
+        result = await conn.execute(_SELECT_PARTITIONS)
+        bounds = {}
+        for row in result.fetchall():
+            match = _PARTITION_UPPER_BOUND.search(row.bound)
+            if match:
+                bounds[row.name] = datetime.fromisoformat(match.group(1))
+        return bounds
+
+    async def expired_partitions(self, retention_months: int) -> List[str]:
+        """Партиции, все записи которых старше retention_months месяцев"""
+        await self.initialize()
+        boundary = _month_start(datetime.utcnow(), -retention_months)
+        async with self.engine.connect() as conn:
+            partitions = await self._partition_bounds(conn) or {}
+        return sorted(
+            name for name, upper in partitions.items() if upper <= boundary
+        )
+
+    async def stream_partition(
+        self, name: str, batch: int = 1000
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Чтение партиции серверным курсором, без загрузки ее в память"""
+        await self.initialize()
+        async with self.engine.connect() as conn:
+            # Словари нужны заранее: пока открыт курсор, других запросов нет
+            result = await conn.execute(
+                text(f"SELECT DISTINCT zstd_dict_id FROM {name} WHERE zstd_dict_id IS NOT NULL")
+            )
+            for dict_id in result.scalars().all():
+                await self._ensure_dictionary(conn, dict_id)
 
-            # Проверяем тип message_id
-            result = conn.execute(
+            result = await conn.stream(
                 text(
-                    """
-                    SELECT data_type 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'user_history' AND column_name = 'message_id'
-                """
-                )
+                    "SELECT id, user_id, category, request_text, response_text, "
+                    "request_zstd, response_zstd, zstd_dict_id, "
+                    f"response_data, created_at, message_id FROM {name} ORDER BY id"
+                ).execution_options(yield_per=batch)
             )
-            message_id_type = result.scalar()
+            async for row in result.mappings():
+                yield self._decode_streamed(dict(row))
+
+    async def stream_user_history(
+        self, user_id: int, batch: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Все записи пользователя (старые сначала) серверным курсором
+
+        В памяти не больше ``batch`` строк, сколько бы записей ни было.
+        Курсор держит соединение пула до конца чтения.
+        """
+        await self.initialize()
+        params = {"user_id": user_id}
+        async with self.engine.connect() as conn:
+            # Словари нужны заранее: пока открыт курсор, других запросов нет
+            result = await conn.execute(_SELECT_USER_DICTIONARY_IDS, params)
+            for dict_id in result.scalars().all():
+                await self._ensure_dictionary(conn, dict_id)
+
+            result = await conn.stream(
+                _SELECT_USER_HISTORY.execution_options(yield_per=batch), params
+            )
+            async for row in result.mappings():
+                yield self._decode_streamed(dict(row))
+
+    def _decode_streamed(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Распаковка текстов строки курсора; словарь уже загружен"""
+        request_zstd = record.pop("request_zstd")
+        response_zstd = record.pop("response_zstd")
+        dict_id = record.pop("zstd_dict_id")
+        if request_zstd is not None:
+            record["request_text"] = self.compression.decompress(request_zstd, dict_id)
+        if response_zstd is not None:
+            record["response_text"] = self.compression.decompress(response_zstd, dict_id)
+        return record
+
+    async def drop_partition(self, name: str):
+        """Удаление партиции целиком: O(1), без DELETE и последующего VACUUM"""
+        await self.initialize()
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        logger.info(f"Dropped history partition {name}")
+
+    async def _ensure_dictionary(self, conn: AsyncConnection, dict_id: Optional[int]):
+        """Подгрузка словаря, которым сжаты читаемые записи"""
+        if self.compression.has_dictionary(dict_id):
+            return
+        result = await conn.execute(_SELECT_DICTIONARY, {"dict_id": dict_id})
+        row = result.fetchone()
+        if row is None:
+            raise LookupError(f"zstd dictionary {dict_id} is missing")
+        self.compression.register(row.id, row.dictionary)
 
-            if message_id_type == "integer":
-                logger.info("Migrating message_id from INTEGER to BIGINT")
-                conn.execute(
-                    text("ALTER TABLE user_history ALTER COLUMN message_id TYPE BIGINT")
+    async def _decode_texts(
+        self,
+        conn: AsyncConnection,
+        request_text: Optional[str],
+        response_text: Optional[str],
+        request_zstd: Optional[bytes],
+        response_zstd: Optional[bytes],
+        dict_id: Optional[int],
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Исходные тексты записи: распаковка сжатых столбцов"""
+        if request_zstd is None and response_zstd is None:
+            return request_text, response_text
+        await self._ensure_dictionary(conn, dict_id)
+        if request_zstd is not None:
+            request_text = self.compression.decompress(request_zstd, dict_id)
+        if response_zstd is not None:
+            response_text = self.compression.decompress(response_zstd, dict_id)
+        return request_text, response_text
+
+    def _encode_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Сжатие текстов записи перед вставкой, если сжатие включено"""
+        request_zstd = self.compression.compress(row["request_text"])
+        response_zstd = self.compression.compress(row["response_text"])
+        dict_id = None
+        if request_zstd is not None or response_zstd is not None:
+            dict_id = self.compression.active_dict_id
+        return {
+            **row,
+            "request_zstd": request_zstd,
+            "response_zstd": response_zstd,
+            "zstd_dict_id": dict_id,
+        }
+
+    async def sample_texts(self, records: int) -> List[str]:
+        """Распакованные тексты запросов и ответов последних records записей"""
+        await self.initialize()
+        texts = []
+        async with self.engine.connect() as conn:
+            result = await conn.execute(_SELECT_DICTIONARY_SAMPLES, {"samples": records})
+            for row in result.fetchall():
+                texts.extend(
+                    await self._decode_texts(
+                        conn,
+                        row.request_text,
+                        row.response_text,
+                        row.request_zstd,
+                        row.response_zstd,
+                        row.zstd_dict_id,
+                    )
                 )
-                conn.commit()
+        return [value for value in texts if value]
 
-        except Exception as e:
-            logger.warning(f"Column migration not needed or failed: {e}")
+    async def train_compression_dictionary(
+        self, samples: int = 2000, min_samples: Optional[int] = None
+    ) -> Optional[int]:
+        """Обучение нового zstd-словаря на последних записях истории
+
+        Словарь сохраняется новой версией и сразу используется для сжатия;
+        записи, сжатые прежними словарями, читаются по их ID. Возвращает ID
+        словаря или None, если записей для обучения недостаточно.
+        """
+        if min_samples is None:
+            min_samples = int(os.getenv("HISTORY_ZSTD_MIN_SAMPLES", "500"))
+
+        texts = await self.sample_texts(samples)
+        if len(texts) < min_samples:
+            logger.info(
+                f"Not enough history for a zstd dictionary: {len(texts)}/{min_samples}"
+            )
+            return None
+
+        # Обучение занимает секунды CPU: не блокируем event loop
+        dictionary = await asyncio.to_thread(self.compression.train, texts)
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                _INSERT_DICTIONARY, {"dictionary": dictionary, "samples": len(texts)}
+            )
+            dict_id = result.scalar()
+        self.compression.activate(dict_id, dictionary)
+        logger.info(
+            f"Trained zstd dictionary {dict_id} ({len(dictionary)} bytes) "
+            f"on {len(texts)} texts"
+        )
+        return dict_id
+
+    @staticmethod
+    def _record_row(
+        user_id: int,
+        category: str,
+        request_text: str,
+        response_text: str = None,
+        response_data: dict = None,
+        message_id: int = None,
+    ) -> Dict[str, Any]:
+        """Значения столбцов новой записи вместе с превью для списка истории"""
+        request_preview = request_text
+        if len(request_preview) > REQUEST_PREVIEW_LENGTH:
+            request_preview = request_preview[:REQUEST_PREVIEW_LENGTH] + "..."
+
+        response_preview = ""
+        if response_text:
+            response_preview = response_text
+            if len(response_preview) > RESPONSE_PREVIEW_LENGTH:
+                response_preview = response_preview[:RESPONSE_PREVIEW_LENGTH] + "..."
+
+        return {
+            "id": None,
+            "user_id": user_id,
+            "category": category,
+            "request_text": request_text,
+            "response_text": response_text,
+            "response_data": _dumps(response_data) if response_data else None,
+            "message_id": message_id,
+            "created_at": datetime.utcnow(),
+            "request_preview": request_preview,
+            "response_preview": response_preview,
+        }
 
     async def add_record(
         self,
@@ -147,115 +690,252 @@ class HistoryService:
         response_data: dict = None,
         message_id: int = None,
     ) -> Optional[int]:
-        """Добавление записи в историю"""
-        session = self.Session()
+        """Добавление записи в историю с ожиданием ее ID
+
+        Для ответов пользователю, которым ID не нужен, используйте enqueue_record.
+        """
+        await self.initialize()
         try:
-            result = session.execute(
-                text(
-                    """
-                    INSERT INTO user_history 
-                    (user_id, category, request_text, response_text, response_data, message_id, created_at)
-                    VALUES (:user_id, :category, :request_text, :response_text, :response_data, :message_id, :created_at)
-                    RETURNING id
-                """
-                ),
-                {
-                    "user_id": user_id,
-                    "category": category,
-                    "request_text": request_text,
-                    "response_text": response_text,
-                    "response_data": str(response_data) if response_data else None,
-                    "message_id": message_id,
-                    "created_at": datetime.utcnow(),
-                },
+            row = self._encode_row(
+                self._record_row(
+                    user_id,
+                    category,
+                    request_text,
+                    response_text,
+                    response_data,
+                    message_id,
+                )
             )
-            session.commit()
-            record_id = result.scalar()
+            async with self.engine.begin() as conn:
+                result = await conn.execute(_INSERT_RECORD, row)
+                record_id = result.scalar()
             logger.info(f"Added history record with ID: {record_id}")
             return record_id
         except SQLAlchemyError as e:
             logger.error(f"Error adding history record: {e}")
-            session.rollback()
             return None
+
+    async def enqueue_record(
+        self,
+        user_id: int,
+        category: str,
+        request_text: str,
+        response_text: str = None,
+        response_data: dict = None,
+        message_id: int = None,
+        reserve_id: bool = False,
+    ) -> Optional[int]:
+        """Добавление записи в историю через write-behind буфер (без ожидания БД)
+
+        С reserve_id=True ID выдается сразу (nextval последовательности, без
+        вставки и фиксации) и возвращается; None - если выдать его не удалось.
+        """
+        row = self._record_row(
+            user_id,
+            category,
+            request_text,
+            response_text,
+            response_data,
+            message_id,
+        )
+        if reserve_id:
+            await self.initialize()
+            try:
+                async with self.engine.connect() as conn:
+                    row["id"] = (await conn.execute(_RESERVE_RECORD_ID)).scalar()
+            except SQLAlchemyError as e:
+                logger.error(f"Error reserving history record ID: {e}")
+                return None
+            self._pending_records[row["id"]] = (row, response_data)
+        await self.writer.enqueue(row)
+        return row["id"]
+
+    async def _copy_records(self, rows: List[Dict[str, Any]]):
+        """Пакетная запись буфера: COPY во временную таблицу и INSERT ... SELECT"""
+        await self.initialize()
+        records = []
+        for row in rows:
+            row = self._encode_row(row)
+            records.append(tuple(row[column] for column in _RECORD_COLUMNS))
+
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(_CREATE_STAGE)
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    "history_stage", records=records, columns=_RECORD_COLUMNS
+                )
+                await conn.execute(_INSERT_STAGED)
         finally:
-            session.close()
+            # После неудачной попытки записи читаются из БД после повтора
+            for row in rows:
+                self._pending_records.pop(row["id"], None)
+
+    async def get_history_page(
+        self,
+        user_id: int,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        newer: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Страница истории пользователя (новые записи сначала)
+
+        Без курсора возвращается первая страница и общее количество записей
+        за один запрос. С курсором - записи старше него (или новее при
+        newer=True), а количество равно None.
+        """
+        await self.initialize()
+        params = {"user_id": user_id, "limit": limit}
+        query = _SELECT_HISTORY_FIRST_PAGE
+        if cursor:
+            params["created_at"], params["id"] = self.decode_cursor(cursor)
+            query = _SELECT_HISTORY_NEWER if newer else _SELECT_HISTORY_OLDER
 
-    async def get_user_history(
-        self, user_id: int, limit: int = 10, offset: int = 0
-    ) -> List[Dict[str, Any]]:
-        """Получение истории пользователя"""
-        session = self.Session()
         try:
-            result = session.execute(
-                text(
-                    """
-                    SELECT id, category, request_text, response_text, created_at, message_id
-                    FROM user_history 
-                    WHERE user_id = :user_id 
-                    ORDER BY created_at DESC 
-                    LIMIT :limit OFFSET :offset
-                """
-                ),
-                {"user_id": user_id, "limit": limit, "offset": offset},
+            async with self.engine.connect() as conn:
+                result = await conn.execute(query, params)
+                rows = result.fetchall()
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting user history: {e}")
+            return [], 0 if not cursor else None
+
+        if cursor and newer:
+            rows.reverse()
+
+        total = None
+        if not cursor:
+            total = rows[0].total if rows else 0
+
+        records = []
+        for row in rows:
+            records.append(
+                {
+                    "id": row.id,
+                    "category": row.category,
+                    "request_preview": row.request_preview,
+                    "response_preview": row.response_preview,
+                    "created_at": row.created_at.strftime("%d.%m.%Y %H:%M"),
+                    "message_id": row.message_id,
+                    "cursor": self.encode_cursor(row.created_at, row.id),
+                }
             )
 
-            records = []
-            for row in result:
-                request_preview = row.request_text
-                if len(request_preview) > 100:
-                    request_preview = request_preview[:100] + "..."
+        return records, total
 
-                response_preview = ""
-                if row.response_text:
-                    response_preview = row.response_text
-                    if len(response_preview) > 150:
-                        response_preview = response_preview[:150] + "..."
+    async def search_history(
+        self, user_id: int, query: str, limit: int = 5
+    ) -> List[Dict[str, Any]]:
+        """Поиск по истории пользователя (синтаксис websearch: "фраза", -слово, or)
 
-                records.append(
+        Фрагменты текста в snippet содержат совпадения между
+        SEARCH_HIGHLIGHT_START и SEARCH_HIGHLIGHT_STOP; сам текст не
+        экранирован.
+        """
+        await self.initialize()
+        try:
+            async with self.engine.begin() as conn:
+                # Общий (generic) план подготовленного выражения не знает
+                # частоту слов запроса и для частых слов выбирает GIN вместо
+                # индекса по user_id, медленнее на порядок
+                await conn.execute(_FORCE_CUSTOM_PLAN)
+                result = await conn.execute(
+                    _SEARCH_HISTORY,
                     {
-                        "id": row.id,
-                        "category": row.category,
-                        "request_text": row.request_text,
-                        "request_preview": request_preview,
-                        "response_preview": response_preview,
-                        "created_at": row.created_at.strftime("%d.%m.%Y %H:%M"),
-                        "message_id": row.message_id,
-                    }
+                        "user_id": user_id,
+                        "query": query,
+                        "limit": limit,
+                        "options": _SEARCH_HEADLINE_OPTIONS,
+                    },
                 )
-
-            return records
+                rows = result.fetchall()
+                snippets = [row.snippet for row in rows]
+
+                compressed = [i for i, row in enumerate(rows) if row.snippet is None]
+                if compressed:
+                    docs = []
+                    for i in compressed:
+                        row = rows[i]
+                        request_text, response_text = await self._decode_texts(
+                            conn,
+                            row.request_text,
+                            row.response_text,
+                            row.request_zstd,
+                            row.response_zstd,
+                            row.zstd_dict_id,
+                        )
+                        docs.append(f"{request_text or ''}\n{response_text or ''}")
+                    result = await conn.execute(
+                        _SEARCH_HEADLINES,
+                        {"docs": docs, "query": query, "options": _SEARCH_HEADLINE_OPTIONS},
+                    )
+                    for i, snippet in zip(compressed, result.scalars().all()):
+                        snippets[i] = snippet
         except SQLAlchemyError as e:
-            logger.error(f"Error getting user history: {e}")
+            logger.error(f"Error searching history: {e}")
             return []
-        finally:
-            session.close()
+
+        return [
+            {
+                "id": row.id,
+                "category": row.category,
+                "created_at": row.created_at.strftime("%d.%m.%Y %H:%M"),
+                "rank": row.rank,
+                "snippet": snippet,
+            }
+            for row, snippet in zip(rows, snippets)
+        ]
 
     async def get_record(
-        self, record_id: int, user_id: int = None
+        self, record_id: int, user_id: int = None, include_data: bool = False
     ) -> Optional[Dict[str, Any]]:
-        """Получение конкретной записи"""
-        session = self.Session()
+        """Получение конкретной записи
+
+        Структурированный response_data читается и декодируется только при
+        include_data=True; иначе в записи будет None.
+        """
+        pending = self._pending_records.get(record_id)
+        if pending is not None:
+            row, response_data = pending
+            if user_id and row["user_id"] != user_id:
+                return None
+            return {
+                "id": record_id,
+                "user_id": row["user_id"],
+                "category": row["category"],
+                "request_text": row["request_text"],
+                "response_text": row["response_text"],
+                "response_data": response_data if include_data else None,
+                "created_at": row["created_at"],
+                "message_id": row["message_id"],
+            }
+        await self.initialize()
         try:
-            query = "SELECT * FROM user_history WHERE id = :record_id"
+            query = _select_record_query(bool(user_id), include_data)
             params = {"record_id": record_id}
-
             if user_id:
-                query += " AND user_id = :user_id"
                 params["user_id"] = user_id
 
-            result = session.execute(text(query), params)
-            row = result.fetchone()
+            async with self.engine.connect() as conn:
+                result = await conn.execute(query, params)
+                row = result.fetchone()
+                if row:
+                    request_text, response_text = await self._decode_texts(
+                        conn,
+                        row.request_text,
+                        row.response_text,
+                        row.request_zstd,
+                        row.response_zstd,
+                        row.zstd_dict_id,
+                    )
 
             if row:
                 return {
                     "id": row.id,
                     "user_id": row.user_id,
                     "category": row.category,
-                    "request_text": row.request_text,
-                    "response_text": row.response_text,
-                    "response_data": (
-                        eval(row.response_data) if row.response_data else None
-                    ),
+                    "request_text": request_text,
+                    "response_text": response_text,
+                    "response_data": row.response_data if include_data else None,
                     "created_at": row.created_at,
                     "message_id": row.message_id,
                 }
@@ -263,46 +943,37 @@ class HistoryService:
         except SQLAlchemyError as e:
             logger.error(f"Error getting record: {e}")
             return None
-        finally:
-            session.close()
 
     async def delete_record(self, record_id: int, user_id: int = None) -> bool:
         """Удаление записи"""
-        session = self.Session()
+        await self.initialize()
         try:
-            query = "DELETE FROM user_history WHERE id = :record_id"
+            query = _DELETE_RECORD
             params = {"record_id": record_id}
 
             if user_id:
-                query += " AND user_id = :user_id"
+                query = _DELETE_USER_RECORD
                 params["user_id"] = user_id
 
-            result = session.execute(text(query), params)
-            session.commit()
+            async with self.engine.begin() as conn:
+                result = await conn.execute(query, params)
             return result.rowcount > 0
         except SQLAlchemyError as e:
             logger.error(f"Error deleting record: {e}")
-            session.rollback()
             return False
-        finally:
-            session.close()
 
     async def get_total_count(self, user_id: int) -> int:
         """Получение общего количества записей пользователя"""
-        session = self.Session()
+        await self.initialize()
         try:
-            result = session.execute(
-                text(
-                    "SELECT COUNT(*) as count FROM user_history WHERE user_id = :user_id"
-                ),
-                {"user_id": user_id},
-            )
-            return result.scalar()
+            async with self.engine.connect() as conn:
+                result = await conn.execute(
+                    _COUNT_USER_RECORDS, {"user_id": user_id}
+                )
+                return result.scalar()
         except SQLAlchemyError as e:
             logger.error(f"Error getting total count: {e}")
             return 0
-        finally:
-            session.close()
 
 
 # Глобальный экземпляр
@@ -315,3 +986,9 @@ def get_history_service():
     if history_service is None:
         history_service = HistoryService()
     return history_service
+
+
+async def close_history_service():
+    """Запись буфера и закрытие пула, если сервис был создан"""
+    if history_service is not None:
+        await history_service.close()
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """Write-behind буфер записей истории.
+
+    Обработчики кладут запись в очередь и сразу отвечают пользователю, а фоновая
+    задача пишет накопленные записи одним COPY каждые ``flush_interval`` секунд
+    или по достижении ``max_batch`` записей. Очередь ограничена: при
+    переполнении ``enqueue`` ждет, пока flusher освободит место.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        max_batch: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+    ):
+        self._flush_rows = flush
+        self.max_batch = max_batch or int(os.getenv("HISTORY_FLUSH_BATCH", "200"))
+        self.flush_interval = flush_interval or (
+            float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200")) / 1000
+        )
+        self.max_pending = max_pending or int(os.getenv("HISTORY_BUFFER_SIZE", "5000"))
+        self.retries = 3
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Запуск фоновой задачи записи (идемпотентно)"""
+        if self._task is not None and not self._task.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run(), name="history-writer")
+
+    async def enqueue(self, row: Dict[str, Any]):
+        """Поставить запись в очередь; ждет только если буфер переполнен"""
+        self.start()
+        await self._queue.put(row)
+
+    async def stop(self):
+        """Записать все накопленное и остановить фоновую задачу"""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(_STOP)
+        await self._task
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self._flush_rows(batch)
+                logger.debug(f"Flushed {len(batch)} history records")
+                return
+            except Exception as e:
+                logger.warning(
+                    f"History flush failed (attempt {attempt}/{self.retries}): {e}"
+                )
+                await asyncio.sleep(0.5 * attempt)
+        logger.error(f"Dropped {len(batch)} history records after {self.retries} failed flushes")
@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import logging
+import os
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from services.dispatcher import release_lane
+
+logger = logging.getLogger(__name__)
+
+SubmissionKey = Tuple[int, str]
+
+# Клиенты Telegram делят длинный текст на сообщения до 4096 символов: продолжения
+# стоит ждать только после сообщения, близкого к этому пределу
+SPLIT_FRAGMENT_LENGTH = 3500
+
+
+class _Run:
+    __slots__ = ("task", "superseded", "settled")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.superseded = False
+        self.settled = False
+
+
+class _Submission:
+    """Сообщения пользователя в сценарии, на которые еще нет ответа"""
+
+    __slots__ = ("fragments", "generation", "running")
+
+    def __init__(self):
+        self.fragments: List[str] = []
+        self.generation = 0
+        self.running: Optional[_Run] = None
+
+
+# Генерация, которую обслуживает текущая задача (для settle_submission)
+current_submission: ContextVar[
+    Optional[Tuple["InflightRegistry", SubmissionKey, _Submission, _Run]]
+] = ContextVar("current_submission", default=None)
+
+
+class InflightRegistry:
+    """Реестр генераций, выполняющихся для пользователей.
+
+    Пока ответ в сценарии не показан, новое сообщение пользователя в том же
+    сценарии отменяет идущую генерацию (а с ней и запрос к бэкенду) и
+    запускает новую по всем накопленным сообщениям: исправление идеи или
+    длинный текст, который Telegram разбил на части, дают один запрос.
+    Ключ идемпотентности запроса - по сообщению, поэтому бэкенд отменяет
+    замененную генерацию, когда бот разрывает ее запрос. Если сообщение
+    похоже на часть разбитого текста (SPLIT_FRAGMENT_LENGTH), генерация
+    ждет ``debounce`` секунд, чтобы следующие части успели прийти до
+    обращения к бэкенду; короткие сообщения запускаются сразу.
+    """
+
+    def __init__(self, debounce: Optional[float] = None):
+        if debounce is None:
+            debounce = float(os.getenv("INFLIGHT_DEBOUNCE_MS", "700")) / 1000
+        self.debounce = debounce
+        self._submissions: Dict[SubmissionKey, _Submission] = {}
+        self._stats = {"started": 0, "superseded": 0, "merged": 0}
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "in_flight": len(self._submissions)}
+
+    async def handle(self, scenario: str, handler, message: Message, *args, **kwargs):
+        key = (message.from_user.id, scenario)
+        # Следующее сообщение пользователя не ждет конца генерации, иначе
+        # оно не смогло бы ее заменить
+        release_lane()
+        submission = self._submissions.get(key)
+        if submission is None:
+            submission = self._submissions[key] = _Submission()
+        submission.fragments.append(message.text or "")
+        submission.generation += 1
+        generation = submission.generation
+
+        running = submission.running
+        if running is not None and not running.settled:
+            # Ответ еще не показан: прежняя генерация больше не нужна
+            running.superseded = True
+            running.task.cancel()
+            submission.running = None
+            self._stats["superseded"] += 1
+
+        if len(message.text or "") >= SPLIT_FRAGMENT_LENGTH:
+            await asyncio.sleep(self.debounce)
+        if submission.generation != generation:
+            # Фрагмент войдет в запрос по более позднему сообщению
+            self._stats["merged"] += 1
+            return None
+
+        if len(submission.fragments) > 1:
+            message = message.model_copy(
+                update={"text": "\n".join(submission.fragments)}
+            )
+        run = _Run(asyncio.current_task())
+        submission.running = run
+        self._stats["started"] += 1
+        token = current_submission.set((self, key, submission, run))
+        try:
+            return await handler(message, *args, **kwargs)
+        except asyncio.CancelledError:
+            if not run.superseded:
+                raise
+            run.task.uncancel()
+            logger.debug(f"Generation for {key} superseded by a newer message")
+            return None
+        finally:
+            current_submission.reset(token)
+            if submission.running is run:
+                submission.running = None
+                self._release(key, submission)
+
+    def _release(self, key: SubmissionKey, submission: _Submission):
+        if self._submissions.get(key) is submission:
+            del self._submissions[key]
+
+
+def settle_submission():
+    """Ответ показан: генерацию больше нельзя отменить новым сообщением
+
+    Следующее сообщение пользователя начнет новый запрос, а не войдет в
+    уже отвеченный.
+    """
+    current = current_submission.get()
+    if current is None:
+        return
+    registry, key, submission, run = current
+    run.settled = True
+    registry._release(key, submission)
+
+
+def latest_submission(scenario: str):
+    """Декоратор обработчика генерации: в работе только последнее сообщение
+
+    См. InflightRegistry; ``scenario`` отделяет сценарии одного пользователя.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(message: Message, *args, **kwargs):
+            return await inflight_registry.handle(
+                scenario, handler, message, *args, **kwargs
+            )
+
+        return wrapper
+
+    return decorator
+
+
+# Глобальный экземпляр
+inflight_registry = InflightRegistry()
@@ -0,0 +1,65 @@
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from services.replies import MESSAGE_LIMIT, PendingReply
+
+logger = logging.getLogger(__name__)
+
+# Telegram ограничивает частоту изменений сообщений в чате (порядка одного
+# в секунду), поэтому промежуточный текст обновляется не чаще интервала
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+CURSOR = " ▌"
+
+
+def _preview(text: str) -> str:
+    """Промежуточный текст без разметки: частичный HTML может быть невалидным"""
+    if len(text) + len(CURSOR) > MESSAGE_LIMIT:
+        return text[: MESSAGE_LIMIT - 2] + " …"
+    return text + CURSOR
+
+
+async def stream_to_message(
+    reply: PendingReply,
+    events: AsyncIterator[Dict[str, Any]],
+    render: Callable[[Dict[str, Any]], str],
+    interval: float = STREAM_EDIT_INTERVAL,
+) -> Dict[str, Any]:
+    """Показ потокового ответа бэкенда в заглушке ``reply``
+
+    Фрагменты {"delta": ...} накапливаются, а заглушка редактируется не чаще
+    ``interval`` секунд; фрагменты, пришедшие между правками, попадают в
+    следующую. После {"result": ...} заглушка заменяется на
+    ``render(result)`` в HTML, и результат возвращается.
+    """
+    message = reply.placeholder
+    text = ""
+    shown = ""
+    result = None
+    # Заглушка только что отправлена - первая правка не раньше интервала
+    next_edit = time.monotonic() + interval
+    async for event in events:
+        if "result" in event:
+            result = event["result"]
+            continue
+        text += event.get("delta", "")
+        now = time.monotonic()
+        if now < next_edit or not text.strip() or text == shown:
+            continue
+        next_edit = now + interval
+        try:
+            await message.edit_text(_preview(text))
+            shown = text
+        except TelegramRetryAfter as e:
+            # Очередь исчерпала повторы: пропускаем правки до конца паузы
+            next_edit = now + e.retry_after
+        except TelegramBadRequest as e:
+            logger.debug(f"Stream preview edit skipped: {e}")
+    if result is None:
+        raise Exception("Backend stream ended without a result")
+
+    await reply.finish(render(result))
+    return result
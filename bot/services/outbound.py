@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Deque, Dict, Optional, Union
+
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "bulk")
+
+# Класс исходящих запросов текущей задачи: ответы пользователю или рассылки
+send_priority: ContextVar[str] = ContextVar("send_priority", default="interactive")
+
+
+@contextmanager
+def bulk_sends():
+    """Запросы к Bot API внутри блока уступают очередь ответам пользователям"""
+    token = send_priority.set("bulk")
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Единая очередь исходящих запросов Bot API (middleware сессии бота).
+
+    Запросы к чатам (все методы с ``chat_id``) проходят два ограничения:
+    частоту на чат - ``chat_rate`` в секунду для личных чатов и
+    ``group_rate_per_minute`` для групп, с запасом ``chat_burst`` подряд - и
+    общую частоту бота ``global_rate`` в секунду. Общие слоты выдаются сначала
+    ответам пользователям, затем рассылкам (``bulk_sends``). На 429 запрос
+    повторяется после ``retry_after`` до ``max_retries`` раз, а чат до конца
+    паузы не получает новых сообщений. Остальные методы (getUpdates,
+    setWebhook) идут без очереди; chat action не ждет частоты чата, но
+    после 429 тоже повторяется только через ``retry_after``.
+    """
+
+    def __init__(
+        self,
+        global_rate: Optional[float] = None,
+        chat_rate: Optional[float] = None,
+        group_rate_per_minute: Optional[float] = None,
+        chat_burst: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ):
+        self.global_rate = global_rate or float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+        self.chat_rate = chat_rate or float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+        self.group_rate = (
+            group_rate_per_minute
+            or float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+        ) / 60
+        self.chat_burst = chat_burst or int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+        if max_retries is None:
+            max_retries = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+        self.max_retries = max_retries
+
+        self._tokens = self.global_rate
+        self._refilled = time.monotonic()
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {
+            priority: deque() for priority in PRIORITIES
+        }
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Теоретическое время следующего сообщения в чат (GCRA)
+        self._chat_tat: Dict[Union[int, str], float] = {}
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "chat_wait_seconds": 0.0,
+            "queue_wait_seconds": 0.0,
+        }
+
+    def stats(self) -> Dict[str, float]:
+        """Счетчики и текущая глубина очереди по классам"""
+        stats = {name: round(value, 3) for name, value in self._stats.items()}
+        for priority, waiters in self._waiters.items():
+            stats[f"queue_depth.{priority}"] = sum(not f.done() for f in waiters)
+        stats["chats_tracked"] = len(self._chat_tat)
+        return stats
+
+    def start(self):
+        """Запуск раздачи общих слотов (идемпотентно)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(), name="telegram-outbound")
+
+    async def stop(self):
+        if self._task is None or self._task.done():
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        self._stats["requests"] += 1
+        for attempt in range(self.max_retries + 1):
+            if not isinstance(method, SendChatAction):
+                await self._wait_chat(chat_id)
+            await self._wait_global(priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._stats["rate_limited"] += 1
+                # Пауза касается всего чата: следующие сообщения ждут вместе с
+                # этим, и запас на серию после паузы не восстанавливается
+                interval = self._chat_interval(chat_id)
+                self._chat_tat[chat_id] = (
+                    time.monotonic() + e.retry_after + (self.chat_burst - 1) * interval
+                )
+                if attempt == self.max_retries:
+                    raise
+                self._stats["retries"] += 1
+                logger.warning(
+                    f"Telegram flood limit for chat {chat_id}, "
+                    f"retry {type(method).__name__} in {e.retry_after}s"
+                )
+                if isinstance(method, SendChatAction):
+                    # Chat action не ждет очереди чата, но пауза после 429
+                    # касается и его: без нее повтор снова получил бы 429
+                    await asyncio.sleep(e.retry_after)
+
+    def _chat_interval(self, chat_id: Union[int, str]) -> float:
+        is_group = not isinstance(chat_id, int) or chat_id < 0
+        return 1 / (self.group_rate if is_group else self.chat_rate)
+
+    async def _wait_chat(self, chat_id: Union[int, str]):
+        """Очередь чата: запросы резервируют время отправки в порядке прихода"""
+        interval = self._chat_interval(chat_id)
+        now = time.monotonic()
+        if len(self._chat_tat) > 10_000:
+            self._chat_tat = {
+                chat: tat for chat, tat in self._chat_tat.items() if tat > now
+            }
+        tat = max(self._chat_tat.get(chat_id, now), now) + interval
+        self._chat_tat[chat_id] = tat
+        delay = tat - now - self.chat_burst * interval
+        if delay > 0:
+            self._stats["chat_wait_seconds"] += delay
+            await asyncio.sleep(delay)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.global_rate, self._tokens + (now - self._refilled) * self.global_rate
+        )
+        self._refilled = now
+
+    async def _wait_global(self, priority: str):
+        self._refill()
+        if self._tokens >= 1 and not any(self._waiters.values()):
+            self._tokens -= 1
+            return
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        self._wakeup.set()
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            self._stats["queue_wait_seconds"] += time.monotonic() - started
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while any(self._waiters.values()):
+                self._refill()
+                while self._tokens >= 1:
+                    future = self._next_waiter()
+                    if future is None:
+                        break
+                    self._tokens -= 1
+                    future.set_result(None)
+                if any(self._waiters.values()):
+                    await asyncio.sleep((1 - self._tokens) / self.global_rate)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():  # ожидавший запрос мог быть отменен
+                    return future
+        return None
+
+
+# Глобальный экземпляр: подключается к сессии бота в main.py
+outbound_scheduler = OutboundScheduler()
@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
+from typing import AsyncIterator, List, Optional
+
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import InlineKeyboardMarkup, Message, ReplyKeyboardMarkup
+from aiogram.utils.chat_action import ChatActionSender
+
+from services.inflight import settle_submission
+
+MESSAGE_LIMIT = 4096
+# Заглушка сама показывает, что ответ готовится; «печатает» начинается, только
+# если ответ задерживается дольше одного периода статуса
+TYPING_INTERVAL = 5.0
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Деление длинного ответа на сообщения по абзацам, затем по строкам
+
+    Разметка ответов (<b>...</b>) не переходит через перевод строки, поэтому
+    деление по строкам ее не ломает. Строка длиннее лимита режется по
+    пробелу и не посреди тега.
+    """
+    chunks = []
+    while len(text) > limit:
+        head = text[:limit]
+        # Граница абзаца или строки, если она не оставляет сообщение полупустым
+        cut = head.rfind("\n\n")
+        if cut < limit // 2:
+            cut = head.rfind("\n")
+        if cut < limit // 2:
+            cut = head.rfind(" ")
+            if head.rfind("<", 0, cut) > head.rfind(">", 0, cut):
+                cut = head.rfind("<", 0, cut)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n ")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+async def send_reply(
+    message: Message,
+    text: str,
+    parse_mode: Optional[str] = "HTML",
+    reply_markup: Optional[ReplyKeyboardMarkup] = None,
+):
+    """Готовый ответ в чат ``message``; клавиатура - у последней части"""
+    chunks = split_message(text)
+    for number, chunk in enumerate(chunks, 1):
+        await message.answer(
+            chunk,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup if number == len(chunks) else None,
+        )
+
+
+class PendingReply:
+    """Заглушка ответа, которая одной правкой становится самим ответом"""
+
+    def __init__(self, placeholder: Message, typing: AsyncExitStack):
+        self.placeholder = placeholder
+        self.finished = False
+        self._typing = typing
+
+    async def finish(
+        self,
+        text: str,
+        parse_mode: Optional[str] = "HTML",
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ):
+        """Замена заглушки ответом; продолжение длинного ответа - новыми сообщениями"""
+        await self._typing.aclose()
+        settle_submission()
+        first, *rest = split_message(text)
+        await self.placeholder.edit_text(
+            first, parse_mode=parse_mode, reply_markup=None if rest else reply_markup
+        )
+        self.finished = True
+        for number, chunk in enumerate(rest, 1):
+            await self.placeholder.answer(
+                chunk,
+                parse_mode=parse_mode,
+                reply_markup=reply_markup if number == len(rest) else None,
+            )
+
+
+@asynccontextmanager
+async def pending_reply(
+    message: Message,
+    text: str,
+    reply_markup: Optional[ReplyKeyboardMarkup] = None,
+) -> AsyncIterator[PendingReply]:
+    """Заглушка и статус «печатает» до готовности ответа
+
+    Вместо прежних трех запросов (заглушка, ее удаление, ответ) - заглушка и
+    одна ее правка, плюс статус раз в TYPING_INTERVAL для долгих ответов.
+    Обычную клавиатуру правкой не назначить, поэтому ``reply_markup`` ответа
+    ставится сразу с заглушкой. Если блок завершился ошибкой до ответа,
+    заглушка удаляется, а исключение пробрасывается.
+    """
+    placeholder = await message.answer(text, reply_markup=reply_markup)
+    typing = AsyncExitStack()
+    await typing.enter_async_context(
+        ChatActionSender.typing(
+            bot=message.bot,
+            chat_id=message.chat.id,
+            interval=TYPING_INTERVAL,
+            initial_sleep=TYPING_INTERVAL,
+        )
+    )
+    reply = PendingReply(placeholder, typing)
+    try:
+        yield reply
+    except (Exception, asyncio.CancelledError):
+        # Ошибка или генерация заменена новым сообщением пользователя
+        if not reply.finished:
+            with suppress(TelegramAPIError):
+                await placeholder.delete()
+        raise
+    finally:
+        await typing.aclose()
@@ -0,0 +1,36 @@
+from dataclasses import astuple, dataclass
+from typing import Optional, Type, TypeVar
+
+from aiogram.fsm.context import FSMContext
+
+P = TypeVar("P")
+
+
+@dataclass(slots=True)
+class MarketingDraft:
+    history_id: int  # Варианты постов - в response_data записи истории
+    variants: int
+
+
+@dataclass(slots=True)
+class FinanceDraft:
+    history_id: int  # Исходные данные - request_text записи истории
+
+
+@dataclass(slots=True)
+class DocumentDraft:
+    doc_type: str
+
+
+async def save_payload(state: FSMContext, payload) -> None:
+    """Данные сценария в FSM: только поля payload, списком значений
+
+    Полные ответы модели в FSM не копируются - следующие шаги читают их из
+    истории по history_id. Заменяет все прежние данные состояния.
+    """
+    await state.set_data({type(payload).__name__: list(astuple(payload))})
+
+
+async def load_payload(state: FSMContext, payload_type: Type[P]) -> Optional[P]:
+    values = (await state.get_data()).get(payload_type.__name__)
+    return payload_type(*values) if values is not None else None
@@ -0,0 +1,61 @@
+import asyncio
+import datetime
+
+import httpx
+from aiogram.types import Chat, Message, Update, User
+
+from services.ai_service import BackendService, RequestOriginMiddleware
+
+
+def _update(update_id: int, user_id: int, message_id: int) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=message_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="User"),
+            text="идея",
+        ),
+    )
+
+
+def _requests(updates):
+    """Заголовки запросов generate_marketing_posts, отправленных по обновлениям"""
+    sent = []
+
+    async def backend(request: httpx.Request) -> httpx.Response:
+        sent.append(request.headers)
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        service = BackendService()
+        service._client = httpx.AsyncClient(
+            base_url="http://backend", transport=httpx.MockTransport(backend)
+        )
+        middleware = RequestOriginMiddleware()
+        for update in updates:
+            await middleware(
+                lambda event, data: service.generate_marketing_posts("идея"),
+                update,
+                {},
+            )
+        await service.close()
+
+    asyncio.run(scenario())
+    return sent
+
+
+def test_tenant_is_telegram_user():
+    first, second = _requests([_update(1, 10, 1), _update(2, 20, 1)])
+    assert first["X-Tenant-Id"] == "telegram:10"
+    assert second["X-Tenant-Id"] == "telegram:20"
+
+
+def test_idempotency_key_is_scoped_to_message():
+    same_users_text, retry, next_message, other_user = _requests(
+        [_update(1, 10, 1), _update(1, 10, 1), _update(2, 10, 2), _update(3, 20, 1)]
+    )
+    assert same_users_text["Idempotency-Key"] == retry["Idempotency-Key"]
+    assert next_message["Idempotency-Key"] != retry["Idempotency-Key"]
+    assert other_user["Idempotency-Key"] != retry["Idempotency-Key"]
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+
+from aiogram import Bot, F
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update, User
+
+from services.dispatcher import ShardedDispatcher, create_dispatcher, release_lane
+
+USER_ID = 10
+
+
+def _update(update_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=USER_ID, type="private"),
+            from_user=User(id=USER_ID, is_bot=False, first_name="User"),
+            text=text,
+        ),
+    )
+
+
+def _run(texts, release: bool):
+    """Состояние FSM после обновлений и статистика диспетчера
+
+    "slow" ждет "бэкенд" (отпуская очередь, если release), который отвечает,
+    когда отправлены все обновления, и записывает состояние "slow".
+    """
+    storage = MemoryStorage()
+    dp = ShardedDispatcher(storage=storage)
+    backend = asyncio.Event()
+    order = []
+
+    @dp.message(F.text == "slow")
+    async def slow(message: Message, state: FSMContext):
+        order.append("slow started")
+        if release:
+            release_lane()
+        await backend.wait()
+        await state.set_state("slow")
+        order.append("slow done")
+
+    @dp.message()
+    async def fast(message: Message, state: FSMContext):
+        order.append(f"{message.text} started")
+        await state.set_state(message.text)
+
+    async def scenario():
+        bot = Bot("42:TEST")
+        tasks = []
+        for update_id, text in enumerate(texts, 1):
+            update = _update(update_id, text)
+            tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+            await asyncio.sleep(0.01)
+        backend.set()
+        await asyncio.gather(*tasks)
+        await bot.session.close()
+        key = StorageKey(bot_id=42, chat_id=USER_ID, user_id=USER_ID)
+        return await storage.get_state(key)
+
+    state = asyncio.run(scenario())
+    return state, dp.stats(), order
+
+
+def test_lane_keeps_updates_in_order():
+    state, stats, order = _run(["slow", "fast"], release=False)
+    assert order == ["slow started", "slow done", "fast started"]
+    assert state == "fast"
+    assert stats["stale_writes"] == 0
+
+
+def test_released_lane_skips_stale_write():
+    state, stats, order = _run(["slow", "fast"], release=True)
+    # Следующее сообщение обработано, не дожидаясь генерации
+    assert order == ["slow started", "fast started", "slow done"]
+    # Поздняя запись генерации пропущена: осталось состояние последнего сообщения
+    assert state == "fast"
+    assert stats["stale_writes"] == 1
+
+
+def test_released_lane_writes_when_nothing_newer_did():
+    state, stats, _ = _run(["slow"], release=True)
+    assert state == "slow"
+    assert stats["stale_writes"] == 0
+
+
+def test_sharded_is_default_mode(monkeypatch):
+    monkeypatch.delenv("DISPATCH_MODE", raising=False)
+    assert isinstance(create_dispatcher(storage=MemoryStorage()), ShardedDispatcher)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from sqlalchemy import text
+
+from services.dispatcher import ShardedDispatcher
+from services.history_service import get_history_service
+from services.inflight import inflight_registry
+from services.outbound import outbound_scheduler
+
+logger = logging.getLogger(__name__)
+
+_PING = text("SELECT 1")
+
+
+class UpdateConcurrency(BaseMiddleware):
+    """Ограничение числа одновременно обрабатываемых обновлений.
+
+    Вебхук отвечает Telegram сразу, а обновление обрабатывается в фоновой
+    задаче; без ограничения всплеск обновлений запустил бы столько же
+    параллельных запросов к бэкенду и БД. Сверх ``limit`` обновления ждут
+    своей очереди, а когда ждущих больше ``backlog``, вебхук отвечает 503
+    и Telegram повторит доставку позже (возможно, другой реплике).
+    """
+
+    def __init__(self, limit: int, backlog: int):
+        self.limit = limit
+        self.backlog = backlog
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.limit
+
+    @property
+    def overloaded(self) -> bool:
+        return self.pending >= self.limit + self.backlog
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.pending += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self.pending -= 1
+            if not self.pending:
+                self._idle.set()
+
+    async def drain(self, timeout: float):
+        """Ожидание обработки принятых обновлений при остановке"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown with {self.pending} updates still in progress")
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp-приложение вебхука: POST WEBHOOK_PATH, /healthz, /readyz и /metrics
+
+    Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются (401).
+    /healthz отвечает, пока процесс жив; /readyz - только после запуска
+    диспетчера, при доступной БД и свободных слотах обработки, чтобы
+    балансировщик не направлял обновления перегруженной реплике.
+    """
+    secret = os.getenv("WEBHOOK_SECRET")
+    if not secret:
+        raise Exception("WEBHOOK_SECRET environment variable is required in webhook mode")
+    path = os.getenv("WEBHOOK_PATH", "/webhook")
+    public_url = os.getenv("WEBHOOK_URL")
+
+    limiter = UpdateConcurrency(
+        limit=int(os.getenv("WEBHOOK_CONCURRENCY", "100")),
+        backlog=int(os.getenv("WEBHOOK_BACKLOG", "1000")),
+    )
+    dp.update.outer_middleware(limiter)
+    ready = asyncio.Event()
+
+    @web.middleware
+    async def reject_when_overloaded(request: web.Request, handler):
+        if request.path == path and limiter.overloaded:
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return await handler(request)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def readyz(request: web.Request) -> web.Response:
+        status = {"started": ready.is_set(), "pending_updates": limiter.pending}
+        try:
+            async with get_history_service().engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(_PING), 1)
+            status["database"] = True
+        except Exception as e:
+            logger.warning(f"Readiness database check failed: {e}")
+            status["database"] = False
+        is_ready = status["started"] and status["database"] and not limiter.saturated
+        return web.json_response(status, status=200 if is_ready else 503)
+
+    async def metrics(request: web.Request) -> web.Response:
+        snapshot = {
+            "pending_updates": limiter.pending,
+            "outbound": outbound_scheduler.stats(),
+            "generations": inflight_registry.stats(),
+        }
+        if isinstance(dp, ShardedDispatcher):
+            snapshot["dispatcher"] = dp.stats()
+        # Диалоги FSM и объем их данных по состояниям (memory и postgres)
+        if hasattr(dp.storage, "memory_report"):
+            try:
+                report = await dp.storage.memory_report()
+                snapshot["fsm"] = {
+                    state or "none": {"dialogs": dialogs, "bytes": size}
+                    for state, (dialogs, size) in report.items()
+                }
+            except Exception as e:
+                logger.warning(f"FSM memory report failed: {e}")
+        return web.json_response(snapshot)
+
+    async def on_startup(app: web.Application):
+        if public_url:
+            # Одинаковый вызов со всех реплик идемпотентен
+            await bot.set_webhook(
+                public_url.rstrip("/") + path,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+            )
+            logger.info(f"Telegram webhook set to {public_url.rstrip('/')}{path}")
+        ready.set()
+
+    async def on_shutdown(app: web.Application):
+        # Остальные реплики продолжают принимать обновления: вебхук не удаляем
+        ready.clear()
+        await limiter.drain(float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25")))
+
+    app = web.Application(middlewares=[reject_when_overloaded])
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    # Порядок остановки: дождаться обновлений, закрыть сессию бота,
+    # затем shutdown диспетчера (запись буфера истории, закрытие пула)
+    app.on_shutdown.append(on_shutdown)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(
+        app, path=path
+    )
+    setup_application(app, dp, bot=bot)
+    app.on_startup.append(on_startup)
+    return app